@@ -2,7 +2,7 @@ from django.contrib import admin
 from .models import EvalSession, VideoFile, VideoConfig
 
 class VideoConfigAdmin(admin.ModelAdmin):
-    list_display = ('numeric_id', 'description', 'updated_at')
+    list_display = ('numeric_id', 'description', 'skip_frames', 'repetition_alignment', 'updated_at')
     search_fields = ('numeric_id', 'description')
 
 admin.site.register(VideoConfig, VideoConfigAdmin)
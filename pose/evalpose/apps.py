@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class EvalposeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "evalpose"
+
+    def start_pose_pool(self):
+        """
+        服务进程启动时调用（pose/wsgi.py）：按 POSE_POOL_SIZE 调整 Pose 实例池，POSE_POOL_WARMUP 开启时
+        在后台预热默认检测参数和可见性预检（static_image_mode）两组实例。
+        不放在 ready() 中，migrate 等管理命令因此不会加载 MediaPipe。
+        """
+        from django.conf import settings
+        from .pose_analyze.pose_detector import PoseDetector
+        from .pose_analyze.pose_pool import get_pose_pool, warm_in_background
+
+        get_pose_pool().resize(settings.POSE_POOL_SIZE)
+        if settings.POSE_POOL_WARMUP:
+            tracking = PoseDetector().detector_settings()
+            warm_in_background([tracking, dict(tracking, static_image_mode=True)])
@@ -2,6 +2,7 @@ import json
 import os
 from django.core.management.base import BaseCommand, CommandError
 from evalpose.models import VideoConfig
+from evalpose.pose_analyze.sequence_cache import PoseSequenceCache
 from django.conf import settings
 
 class Command(BaseCommand):
@@ -16,6 +17,8 @@ class Command(BaseCommand):
         create_parser.add_argument('--description', default='', help='Description of the video')
         create_parser.add_argument('--key-angles', type=json.loads, default={}, help='Key angles as JSON string')
         create_parser.add_argument('--normalization-joints', type=json.loads, default=[], help='Normalization joints as JSON array')
+        create_parser.add_argument('--skip-frames', type=int, default=0, help='Frames skipped between pose inferences (interpolated)')
+        create_parser.add_argument('--repetition-alignment', action='store_true', help='Align repeated exercises rep by rep')
         
         # Read command
         read_parser = subparsers.add_parser('read', help='Read video configuration(s)')
@@ -29,6 +32,9 @@ class Command(BaseCommand):
         update_parser.add_argument('--description', help='New description (optional)')
         update_parser.add_argument('--key-angles', type=json.loads, help='New key angles as JSON string (optional)')
         update_parser.add_argument('--normalization-joints', type=json.loads, help='New normalization joints as JSON array (optional)')
+        update_parser.add_argument('--skip-frames', type=int, help='New number of frames skipped between pose inferences (optional)')
+        update_parser.add_argument('--repetition-alignment', type=lambda v: v.lower() in ('1', 'true', 'yes'),
+                                   help='Enable or disable per-repetition alignment: true/false (optional)')
         
         # Delete command
         delete_parser = subparsers.add_parser('delete', help='Delete a video configuration')
@@ -63,6 +69,8 @@ class Command(BaseCommand):
         description = options['description']
         key_angles = options['key_angles']
         normalization_joints = options['normalization_joints']
+        skip_frames = options['skip_frames']
+        repetition_alignment = options['repetition_alignment']
         
         # Check if config already exists
         if VideoConfig.objects.filter(numeric_id=numeric_id).exists():
@@ -74,7 +82,9 @@ class Command(BaseCommand):
             numeric_id=numeric_id,
             description=description,
             key_angles=key_angles,
-            normalization_joints=normalization_joints
+            normalization_joints=normalization_joints,
+            skip_frames=skip_frames,
+            repetition_alignment=repetition_alignment
         )
         
         self.stdout.write(self.style.SUCCESS(f"Created configuration with ID: {numeric_id}"))
@@ -99,7 +109,9 @@ class Command(BaseCommand):
             result[config.numeric_id] = {
                 'description': config.description,
                 'key_angles': config.key_angles,
-                'normalization_joints': config.normalization_joints
+                'normalization_joints': config.normalization_joints,
+                'skip_frames': config.skip_frames,
+                'repetition_alignment': config.repetition_alignment
             }
         
         # Export to file or print to console
@@ -138,10 +150,19 @@ class Command(BaseCommand):
         if options.get('normalization_joints') is not None:
             config.normalization_joints = options['normalization_joints']
             update_fields.append('normalization_joints')
+            
+        if options.get('skip_frames') is not None:
+            config.skip_frames = options['skip_frames']
+            update_fields.append('skip_frames')
+
+        if options.get('repetition_alignment') is not None:
+            config.repetition_alignment = options['repetition_alignment']
+            update_fields.append('repetition_alignment')
         
         if update_fields:
             config.save(update_fields=update_fields)
             self.stdout.write(self.style.SUCCESS(f"Updated configuration with ID: {numeric_id}"))
+            self._clear_pose_cache(numeric_id)
         else:
             self.stdout.write(self.style.WARNING("No fields specified for update"))
     
@@ -163,6 +184,13 @@ class Command(BaseCommand):
         
         config.delete()
         self.stdout.write(self.style.SUCCESS(f"Deleted configuration with ID: {numeric_id}"))
+        self._clear_pose_cache(numeric_id)
+
+    def _clear_pose_cache(self, numeric_id):
+        # Cache keys already include the config digest; this only drops the stale entries
+        removed = PoseSequenceCache(settings.POSE_CACHE_DIR).clear(numeric_id)
+        if removed:
+            self.stdout.write(f"Removed {removed} cached pose sequence(s) for {numeric_id}")
     
     def _handle_import(self, options):
         file_path = options['file']
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evalpose', '0002_videoconfig'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoconfig',
+            name='skip_frames',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('evalpose', '0003_videoconfig_skip_frames'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoconfig',
+            name='repetition_alignment',
+            field=models.BooleanField(default=False),
+        ),
+    ]
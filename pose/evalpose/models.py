@@ -50,6 +50,8 @@ class VideoConfig(models.Model):
     numeric_id = models.CharField(max_length=10, unique=True)
     key_angles = models.JSONField()
     normalization_joints = models.JSONField()
+    skip_frames = models.PositiveIntegerField(default=0)
+    repetition_alignment = models.BooleanField(default=False)
     description = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -7,11 +7,15 @@ from django.conf import settings
 # Import new implementation components
 from .pose_analyze.pose_detector import VideoAnalyzer
 from .pose_analyze.action_comparator import ActionComparator
-from .pose_analyze.evaluation import detect_action_stages, select_lowest_score_frames
+from .pose_analyze.evaluation import detect_action_stages, select_lowest_score_frames, detect_active_range, offset_patient_indices
 from .pose_analyze.visualization import generate_video_with_selected_frames, draw_bone
 from .pose_analyze.video_stretch import stretch_videos_to_same_length
 from .pose_analyze.pose_comparison import dtw_compare, score_cos_sim, weight_match_l1, weight_match_l2
 from .pose_analyze.config_service import get_config_class, get_config_instance
+from .pose_analyze.sequence_cache import PoseSequenceCache
+from .pose_analyze.pose_sequence import PoseSequence
+from .pose_analyze.reference_ranking import rank_references
+from .pose_analyze.exercise_index import get_exercise_index
 from .models import VideoConfig
 from .exceptions import PoseAnalysisError, FullBodyNotVisibleError, VideoLengthMismatchError, ErrorCodes
 
@@ -44,16 +48,28 @@ class ModernPoseAnalyzer:
             logger.info("Using default configuration")
             
         # Initialize analyzer with the selected config
-        self.analyzer = VideoAnalyzer(config=self.config)
+        self.analyzer = self._build_analyzer()
+        self.sequence_cache = PoseSequenceCache(settings.POSE_CACHE_DIR)
         logger.info("Initialized Modern Pose Analyzer")
+
+    def _build_analyzer(self):
+        """Create a VideoAnalyzer for the current config using the extraction settings."""
+        return VideoAnalyzer(
+            config=self.config,
+            workers=settings.POSE_EXTRACTION_WORKERS,
+            queue_size=settings.POSE_DECODE_QUEUE_SIZE,
+            roi=settings.POSE_ROI_MODE,
+            roi_max_side=settings.POSE_ROI_MAX_SIDE
+        )
     
-    def process_video(self, video_path, skip_frames=2):
+    def process_video(self, video_path, skip_frames=None):
         """
         Process a single video to extract pose sequence data.
         
         Args:
             video_path: Path to video file
-            skip_frames: Number of frames to skip (for performance)
+            skip_frames: Number of frames to skip between inferences; defaults to
+                the config's SKIP_FRAMES. Skipped frames are interpolated.
             
         Returns:
             List of dictionaries containing landmarks and angles for each frame
@@ -64,7 +80,257 @@ class ModernPoseAnalyzer:
         except Exception as e:
             logger.error(f"Error processing video {video_path}: {str(e)}")
             raise
-    
+
+    def check_full_body_visible(self, video_path):
+        """
+        Run the cheap visibility probe on an uploaded video.
+
+        Raises:
+            FullBodyNotVisibleError: When too few sampled frames show the joints
+                required by the current config.
+        """
+        if not settings.POSE_VISIBILITY_PROBE:
+            return
+        probe = self.analyzer.probe_visibility(video_path, samples=settings.POSE_VISIBILITY_PROBE_SAMPLES)
+        logger.info(f"Visibility probe for {video_path}: {probe['visible']}/{probe['sampled']} frames visible")
+        if not probe['passed']:
+            raise FullBodyNotVisibleError()
+
+    def get_active_range(self, sequence):
+        """
+        Return the (start, end) frame range of a patient sequence with leading and
+        trailing idle spans removed, or the full range when idle trimming is disabled.
+        """
+        if not settings.POSE_IDLE_TRIM:
+            return 0, len(sequence) - 1
+        start, end = detect_active_range(sequence)
+        if (start, end) != (0, len(sequence) - 1):
+            logger.info(f"Trimmed idle frames: active range {start}-{end} of {len(sequence)}")
+        return start, end
+
+    def process_reference_video(self, video_path):
+        """
+        Extract the pose sequence of a standard (reference) video, consulting the
+        on-disk cache first.
+
+        Only configurations bound to a numeric_id are cached; ad-hoc uploads of a
+        standard video (no numeric_id) are always processed directly.
+
+        Args:
+            video_path: Path to the standard video file
+
+        Returns:
+            List of dictionaries containing landmarks and angles for each frame
+        """
+        key = self._reference_cache_key(video_path)
+        if key is None:
+            return self.process_video(video_path)
+
+        sequence = self.sequence_cache.get(key)
+        if sequence is not None:
+            logger.info(f"Pose cache hit for standard video {video_path} ({key})")
+            return sequence
+
+        logger.info(f"Pose cache miss for standard video {video_path} ({key})")
+        sequence = self.process_video(video_path)
+        try:
+            self.sequence_cache.put(key, sequence)
+        except Exception as e:
+            logger.warning(f"Failed to write pose cache entry {key}: {str(e)}")
+        return sequence
+
+    def get_reference_features(self, video_path, std_sequence):
+        """
+        Return the fitted scaler statistics and scaled feature matrix of a standard
+        video, loading them from the cache or fitting and storing them on first use.
+
+        The entry shares the pose sequence's cache key, so a config change that
+        invalidates the sequence invalidates the features as well.
+
+        Args:
+            video_path: Path to the standard video file
+            std_sequence: The standard video's pose sequence
+
+        Returns:
+            dict accepted by ActionComparator(reference_features=...), or None for
+            uncached (ad-hoc) standard videos
+        """
+        key = self._reference_cache_key(video_path)
+        if key is None:
+            return None
+
+        features = self.sequence_cache.get_features(key)
+        if features is not None:
+            return features
+
+        features = ActionComparator.fit_reference_features(std_sequence)
+        try:
+            self.sequence_cache.put_features(key, features)
+        except Exception as e:
+            logger.warning(f"Failed to write feature cache entry {key}: {str(e)}")
+        return features
+
+    def prepare_reference(self, video_path):
+        """Warm the cache for a standard video: pose sequence plus scaler features."""
+        sequence = self.process_reference_video(video_path)
+        return sequence, self.get_reference_features(video_path, sequence)
+
+    def cached_reference(self, video_path):
+        """
+        Return the cached (pose sequence, scaler features) of a standard video
+        without running pose extraction, or None when the sequence is not cached
+        (see `import_videos --build-reference-cache`). Missing features are fitted
+        from the cached sequence and stored.
+        """
+        key = self._reference_cache_key(video_path)
+        if key is None:
+            return None
+        sequence = self.sequence_cache.get(key)
+        if sequence is None:
+            return None
+        return sequence, self.get_reference_features(video_path, sequence)
+
+    def _reference_cache_key(self, video_path):
+        """Cache key of a standard video, or None when the config has no numeric_id."""
+        if not getattr(self.config, 'NUMERIC_ID', None):
+            return None
+        return self.sequence_cache.make_key(video_path, self.config, self.analyzer.detector_settings())
+
+    def rank_references(self, exercise_video_path, references):
+        """
+        Score one exercise video against several standard videos and rank them.
+
+        The exercise pose landmarks are extracted once (with the current config)
+        and re-projected onto each reference's KEY_ANGLES/NORMALIZATION_JOINTS.
+        References are compared in a process pool against their cached scaler
+        features; a lower bound on the DTW distance skips references that cannot
+        beat the best match found so far. Only references already in the pose
+        cache are compared; the others are reported as 'uncached' rather than
+        extracted inline.
+
+        Args:
+            exercise_video_path: Path to exercise/patient video
+            references: Iterable of (numeric_id, standard_video_path) pairs
+
+        Returns:
+            dict with 'ranking' (best match first), 'pruned' and 'uncached'
+            numeric_ids and 'active_range' of the exercise video
+
+        Raises:
+            PoseAnalysisError: When none of the references has a cached pose sequence
+        """
+        loaded, uncached = self._load_references(references)
+        self.check_full_body_visible(exercise_video_path)
+        exe_sequence = self.process_video(exercise_video_path)
+        return dict(self._rank_sequence(exe_sequence, loaded), uncached=uncached)
+
+    def recognize_exercise(self, exercise_video_path, top_k=None):
+        """
+        Identify which standard exercise an exercise video is closest to, without
+        a standard_numeric_id.
+
+        The exercise video is embedded once and matched against the prebuilt
+        exercise index (see `import_videos --build-index`); the top_k nearest
+        references are then re-ranked with full DTW via rank_references.
+
+        Returns:
+            dict with 'candidates' (index neighbours and their embedding distance)
+            plus the rank_references result for those candidates
+
+        Raises:
+            PoseAnalysisError: When the exercise index has not been built
+        """
+        index = get_exercise_index(settings.POSE_INDEX_DIR)
+        if index is None or len(index) == 0:
+            raise PoseAnalysisError("Exercise index has not been built; run import_videos --build-index",
+                                    code=503,
+                                    ui_error_code=ErrorCodes.SYSTEM_ERROR)
+
+        self.check_full_body_visible(exercise_video_path)
+        exe_sequence = self.process_video(exercise_video_path)
+        neighbours = index.query(exe_sequence, top_k=top_k or settings.POSE_RECOGNITION_TOP_K)
+        logger.info(f"Exercise index candidates for {exercise_video_path}: {neighbours}")
+
+        loaded, uncached = self._load_references([(numeric_id, index.references[numeric_id])
+                                                  for numeric_id, _ in neighbours])
+        result = dict(self._rank_sequence(exe_sequence, loaded), uncached=uncached)
+        result['candidates'] = [{'numeric_id': numeric_id, 'embedding_distance': distance}
+                                for numeric_id, distance in neighbours]
+        return result
+
+    def _load_references(self, references):
+        """
+        Load the cached pose sequence and scaler features of each (numeric_id, path)
+        reference. Nothing is extracted here: uncached references are skipped so a
+        cold cache cannot turn one request into a serial MediaPipe run per reference.
+
+        Returns:
+            (loaded, uncached): loaded is a list of (numeric_id, analyzer,
+            std_sequence, reference_features); uncached lists skipped numeric_ids
+
+        Raises:
+            PoseAnalysisError: When no reference is cached
+        """
+        loaded, uncached = [], []
+        for numeric_id, video_path in references:
+            reference = ModernPoseAnalyzer(config=get_config_class(numeric_id))
+            prepared = reference.cached_reference(str(video_path))
+            if prepared is None:
+                uncached.append(numeric_id)
+                continue
+            loaded.append((numeric_id, reference, *prepared))
+
+        if uncached:
+            logger.warning(f"Skipping references without a pose cache entry: {uncached}")
+        if not loaded:
+            raise PoseAnalysisError("Standard videos have not been prepared; run import_videos --build-reference-cache",
+                                    code=503,
+                                    ui_error_code=ErrorCodes.SYSTEM_ERROR)
+        return loaded, uncached
+
+    def _rank_sequence(self, exe_sequence, references):
+        """Trim idle frames of an extracted exercise sequence and rank it against loaded references."""
+        active_start, active_end = self.get_active_range(exe_sequence)
+        active_sequence = exe_sequence[active_start:active_end + 1]
+
+        candidates = []
+        for numeric_id, reference, std_sequence, reference_features in references:
+            candidates.append({
+                'key': numeric_id,
+                'std_sequence': std_sequence,
+                'pat_sequence': reference.analyzer.rebuild_sequence(active_sequence),
+                'reference_features': reference_features,
+            })
+
+        try:
+            ranked, pruned = rank_references(candidates,
+                                             workers=settings.POSE_RANKING_WORKERS,
+                                             dtw_method=settings.POSE_DTW_METHOD,
+                                             dtw_band=settings.POSE_DTW_BAND,
+                                             subsequence=settings.POSE_DTW_SUBSEQUENCE)
+        except ValueError as e:
+            raise PoseAnalysisError(f"DTW comparison error: {str(e)}",
+                                    code=400,
+                                    ui_error_code=ErrorCodes.PROCESSING_ERROR)
+
+        ranking = []
+        for rank, outcome in enumerate(ranked, start=1):
+            first, last = outcome['matched_range']
+            ranking.append({
+                'rank': rank,
+                'numeric_id': outcome['key'],
+                'similarity_score': outcome['similarity_score'],
+                'dtw_distance': outcome['dtw_distance'],
+                'normalized_distance': outcome['normalized_distance'],
+                'matched_range': [first + active_start, last + active_start],
+            })
+        logger.info(f"Ranked {len(ranking)} references, pruned {len(pruned)}")
+        return {
+            'ranking': ranking,
+            'pruned': pruned,
+            'active_range': [active_start, active_end],
+        }
+
     def process_videos(self, session_id, standard_video_path, exercise_video_path, standard_numeric_id=None, config=None):
         """
         Process standard and exercise videos and perform comparison analysis.
@@ -97,21 +363,36 @@ class ModernPoseAnalyzer:
             # Update configuration if needed
             if config and not self.config == config:
                 self.config = config
-                self.analyzer = VideoAnalyzer(config=self.config)
+                self.analyzer = self._build_analyzer()
                 logger.info(f"Updated analyzer with provided configuration")
             elif standard_numeric_id and not hasattr(self.config, 'NUMERIC_ID'):
                 self.config = get_config_class(standard_numeric_id)
-                self.analyzer = VideoAnalyzer(config=self.config)
+                self.analyzer = self._build_analyzer()
                 logger.info(f"Updated configuration for {standard_numeric_id}")
                 
+            # Reject uploads without a fully visible body before the full extraction
+            self.check_full_body_visible(exercise_video_path)
+
             # Process videos
-            std_sequence = self.process_video(standard_video_path)
+            std_sequence = self.process_reference_video(standard_video_path)
             exe_sequence = self.process_video(exercise_video_path)
+
+            # Drop leading/trailing idle frames; alignment runs on the active window only
+            active_start, active_end = self.get_active_range(exe_sequence)
+            result['active_range'] = [active_start, active_end]
             
             # Compare sequences 
             try:
-                comparator = ActionComparator(std_sequence, exe_sequence)
-                dtw_result = comparator.compare_sequences()
+                comparator = ActionComparator(std_sequence, exe_sequence[active_start:active_end + 1],
+                                              dtw_method=settings.POSE_DTW_METHOD,
+                                              dtw_band=settings.POSE_DTW_BAND,
+                                              reference_features=self.get_reference_features(standard_video_path, std_sequence),
+                                              subsequence=settings.POSE_DTW_SUBSEQUENCE)
+                if getattr(self.config, 'REPETITION_ALIGNMENT', False):
+                    dtw_result = comparator.compare_repetitions()
+                else:
+                    dtw_result = comparator.compare_sequences()
+                dtw_result = offset_patient_indices(dtw_result, active_start)
             except ValueError as e:
                 if 'X has 4 features, but StandardScaler is expecting 70 features as input' in str(e):
                     logger.error("Mismatch in feature dimensions during DTW comparison")
@@ -140,6 +421,8 @@ class ModernPoseAnalyzer:
             # Core metrics
             result['dtw_distance'] = float(dtw_result['dtw_distance'])
             result['similarity_score'] = float(dtw_result['similarity_score'] * 100)
+            result['matched_range'] = list(dtw_result['matched_range'])
+            result['repetitions'] = dtw_result.get('repetitions', [])
             result['dtw_success'] = True
             
             # Action stages detection using the new implementation from pose_detector.py
@@ -182,27 +465,27 @@ class ModernPoseAnalyzer:
         
         Args:
             dtw_result: DTW alignment result
-            comparator: Optional ActionComparator instance
+            comparator: Optional ActionComparator instance; pass the one used for
+                compare_sequences so its cached features and trimmed path are reused
             
         Returns:
             dict: Advanced metrics
         """
         if comparator is None and 'std_sequence' in vars(self) and 'exe_sequence' in vars(self):
-            comparator = ActionComparator(self.std_sequence, self.exe_sequence)
+            comparator = ActionComparator(self.std_sequence, self.exe_sequence,
+                                          dtw_method=settings.POSE_DTW_METHOD,
+                                          dtw_band=settings.POSE_DTW_BAND,
+                                          subsequence=settings.POSE_DTW_SUBSEQUENCE)
         
         if not comparator:
             logger.warning("No comparator available for advanced metrics")
             return {}
         
         try:
-            alignment_path = dtw_result['alignment_path']
-            return {
-                'alignment_angle': comparator.compute_alignment_angle_score(alignment_path),
-                'time_variance': comparator.dtw_time_variance_score(alignment_path),
-                'alignment_ratio': comparator.compute_alignment_ratio(alignment_path),
-                'speed_variation': comparator.analyze_speed_variation(alignment_path),
-                'overall_scores': comparator.compare_overall_video()
-            }
+            # Per-repetition results are measured rep by rep, not on the joined path
+            metrics = comparator.alignment_metrics(dtw_result)
+            metrics['overall_scores'] = comparator.compare_overall_video()
+            return metrics
         except Exception as e:
             logger.error(f"Error calculating advanced metrics: {str(e)}")
             return {}
@@ -337,8 +620,8 @@ class ModernPoseAnalyzer:
                 return weight_match_l2(pose1, pose2)
             else:
                 # Default to DTW for sequences
-                if isinstance(pose1, list) and isinstance(pose2, list):
-                    _, similarity = dtw_compare(pose1, pose2)
+                if isinstance(pose1, (list, PoseSequence)) and isinstance(pose2, (list, PoseSequence)):
+                    _, similarity = dtw_compare(pose1, pose2, method=settings.POSE_DTW_METHOD, band=settings.POSE_DTW_BAND)
                     return similarity
                 else:
                     return score_cos_sim(pose1, pose2)
@@ -1,34 +1,138 @@
 # action_comparator.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from fastdtw import fastdtw
-from scipy.spatial.distance import euclidean
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
 
+try:
+    from .dtw_engine import DEFAULT_METHOD, dtw, path_to_list
+    from .evaluation import segment_repetitions
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from dtw_engine import DEFAULT_METHOD, dtw, path_to_list
+    from evaluation import segment_repetitions
+    from pose_sequence import PoseSequence
+
 
 class ActionComparator:
-    def __init__(self, std_sequence, pat_sequence):
+    def __init__(self, std_sequence, pat_sequence, dtw_method=DEFAULT_METHOD, dtw_band=None,
+                 reference_features=None, subsequence=False):
         self.std_seq = std_sequence
         self.pat_seq = pat_sequence
         self.distance_matrix = None
         self.scaler = StandardScaler()
+        # 标准序列预先拟合好的标准化结果（fit_reference_features 的返回值），提供时不再重新拟合 scaler
+        self.reference_features = reference_features
+        # DTW 引擎参数：exact 为精确 DTW（dtw_band 为 Sakoe-Chiba 带宽），fastdtw 用于与历史得分对比
+        self.dtw_method = dtw_method
+        self.dtw_band = dtw_band
+        # 子序列 DTW：标准序列只与患者视频中最匹配的一段对齐，首尾空闲帧不进入路径，路径无需再修剪
+        self.subsequence = subsequence
+        # 惰性计算并缓存的中间结果，compare_sequences 与各项附加指标共用
+        self._sequences = None
+        self._features = None
+        self._scaled_features = None
+        # compare_sequences / compare_repetitions 生成的各段对齐路径及其修剪范围（首次使用时计算）
+        self._paths = []
+        self._trim_ranges = []
+
+    def _get_sequences(self):
+        """(标准, 患者) 的 PoseSequence，首次访问时转换"""
+        if self._sequences is None:
+            self._sequences = (PoseSequence.from_frames(self.std_seq),
+                               PoseSequence.from_frames(self.pat_seq))
+        return self._sequences
+
+    def get_features(self):
+        """(标准, 患者) 的原始特征矩阵，只提取一次"""
+        if self._features is None:
+            std, pat = self._get_sequences()
+            self._features = (self._extract_features(std), self._extract_features(pat))
+        return self._features
+
+    def get_scaled_features(self):
+        """
+        按标准序列拟合 StandardScaler 后的 (标准, 患者) 特征矩阵，scaler 只拟合一次；
+        有预计算的 reference_features 时直接复用，只需变换患者特征。
+        """
+        if self._scaled_features is None:
+            if self.reference_features is not None:
+                _, pat = self._get_sequences()
+                self._load_scaler(self.reference_features)
+                self._scaled_features = (self.reference_features['scaled'],
+                                         self.scaler.transform(self._extract_features(pat)))
+            else:
+                std_features, pat_features = self.get_features()
+                self._scaled_features = (self.scaler.fit_transform(std_features),
+                                         self.scaler.transform(pat_features))
+        return self._scaled_features
+
+    def _load_scaler(self, reference_features):
+        """用保存的统计量恢复已拟合的 StandardScaler"""
+        self.scaler.mean_ = np.asarray(reference_features['mean'], dtype=np.float64)
+        self.scaler.var_ = np.asarray(reference_features['var'], dtype=np.float64)
+        self.scaler.scale_ = np.asarray(reference_features['scale'], dtype=np.float64)
+        self.scaler.n_samples_seen_ = int(reference_features['n_samples_seen'])
+        self.scaler.n_features_in_ = len(self.scaler.mean_)
+
+    @classmethod
+    def fit_reference_features(cls, std_sequence):
+        """
+        对标准序列拟合 StandardScaler，返回可持久化的统计量和缩放后的特征矩阵，
+        供同一标准视频的后续比较通过 reference_features 参数复用。
+        """
+        scaler = StandardScaler()
+        scaled = scaler.fit_transform(cls._extract_features(std_sequence))
+        return {
+            'mean': scaler.mean_,
+            'var': scaler.var_,
+            'scale': scaler.scale_,
+            'n_samples_seen': np.int64(scaler.n_samples_seen_),
+            'scaled': scaled,
+        }
+
+    def _remember_paths(self, paths):
+        """保存本次比较生成的各段对齐路径，之前缓存的修剪范围作废"""
+        self._paths = paths
+        self._trim_ranges = [None] * len(paths)
+
+    def get_trimmed_path(self, alignment_path, segment=None):
+        """
+        trim_alignment 的缓存版本，子序列模式的路径直接使用。
+        alignment_path 是 compare_* 生成的路径本身，或 segment 指明它对应第几段生成的路径
+        （如 offset_patient_indices 平移后的结果，平移患者帧索引不改变修剪范围）时，
+        修剪范围按段只计算一次；其他路径直接修剪。
+        """
+        if self.subsequence:
+            return alignment_path
+        if segment is None:
+            segment = next((k for k, path in enumerate(self._paths) if path is alignment_path), None)
+        if segment is None or len(self._paths[segment]) != len(alignment_path):
+            return self.trim_alignment(alignment_path)
+        if self._trim_ranges[segment] is None:
+            self._trim_ranges[segment] = self._trim_range(self._paths[segment])
+        start, stop = self._trim_ranges[segment]
+        return alignment_path[start:stop]
 
     def compare_sequences(self):
         """
         使用整体特征向量的 DTW 对齐计算，返回对齐后的相似度分析结果，
         包括 DTW 距离、对齐路径、相似度评分以及每帧得分（使用新的帧匹配算法）。
+        matched_range 为路径覆盖的患者帧范围 (首帧, 末帧)；子序列模式下范围外的空闲帧没有得分。
         """
-        std_features = self._extract_features(self.std_seq)
-        pat_features = self._extract_features(self.pat_seq)
-
-        std_features = self.scaler.fit_transform(std_features)
-        pat_features = self.scaler.transform(pat_features)
+        std_features, pat_features = self.get_scaled_features()
 
-        distance, path = fastdtw(std_features, pat_features, dist=euclidean)
+        distance, path_array = dtw(std_features, pat_features, method=self.dtw_method, band=self.dtw_band,
+                                   subsequence=self.subsequence)
+        path = path_to_list(path_array)
+        self._remember_paths([path])
         aligned_std = [std_features[i] for i, j in path]
         aligned_pat = [pat_features[j] for i, j in path]
+        matched_range = (int(path_array[0, 1]), int(path_array[-1, 1]))
 
-        max_length = max(len(self.std_seq), len(self.pat_seq))
+        max_length = max(len(self.std_seq), matched_range[1] - matched_range[0] + 1)
         normalized_distance = distance / max_length
         similarity = 1 / (1 + normalized_distance)
         frame_scores = self._compare_frames_with_multiple_matches(path)
@@ -36,22 +140,89 @@ class ActionComparator:
         return {
             'dtw_distance': distance,
             'alignment_path': path,
+            'path_indices': path_array,
             'aligned_std': aligned_std,
             'aligned_pat': aligned_pat,
             'similarity_score': similarity,
-            'frame_scores': frame_scores
+            'frame_scores': frame_scores,
+            'matched_range': matched_range
+        }
+
+    def compare_repetitions(self, std_reps=None, pat_reps=None, max_workers=None):
+        """
+        按次对齐重复动作：标准视频和患者视频分别切分为若干次动作（默认用 segment_repetitions），
+        第 k 次患者动作与第 k 次标准动作（次数不足时循环使用）各自独立做 DTW，多次动作并行计算。
+        代价从整段的 N·M 降为各次动作长度乘积之和。子序列模式下每次标准动作只与该次患者动作中最匹配的一段对齐。
+        返回值与 compare_sequences 相同（对齐路径为各次路径按原始帧索引拼接，帧得分整体归一化），
+        另含 segment_paths：各次动作自己的对齐路径（拼接路径在每次动作开头回到该次标准动作的起点，
+        不是单调路径，alignment_metrics 按段计算时间类指标），
+        以及 repetitions：每次动作的帧范围、DTW 距离、平均得分、节奏比（患者帧数 / 标准帧数）和速度分析。
+        """
+        std_features, pat_features = self.get_scaled_features()
+        std, pat = self._get_sequences()
+        std_reps = std_reps or segment_repetitions(std)
+        pat_reps = pat_reps or segment_repetitions(pat)
+        pairs = [(pat_rep, std_reps[k % len(std_reps)]) for k, pat_rep in enumerate(pat_reps)]
+
+        def align(pair):
+            (p0, p1), (s0, s1) = pair
+            distance, path = dtw(std_features[s0:s1 + 1], pat_features[p0:p1 + 1],
+                                 method=self.dtw_method, band=self.dtw_band, subsequence=self.subsequence)
+            return distance, path + np.array([s0, p0], dtype=np.int32)
+
+        workers = max_workers or min(len(pairs), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            aligned = list(executor.map(align, pairs))
+
+        path_array = np.concatenate([path for _, path in aligned])
+        path = path_to_list(path_array)
+        segment_paths = [path_to_list(rep_path) for _, rep_path in aligned]
+        self._remember_paths(segment_paths)
+        distance = float(sum(d for d, _ in aligned))
+        max_length = max(sum(s1 - s0 + 1 for _, (s0, s1) in pairs), len(pat))
+        similarity = 1 / (1 + distance / max_length)
+        frame_scores = self._compare_frames_with_multiple_matches(path_array)
+        scores = np.array([score for _, score in frame_scores])
+        score_frames = np.array([idx for idx, _ in frame_scores])
+
+        repetitions = []
+        for k, (((p0, p1), (s0, s1)), (rep_distance, rep_path)) in enumerate(zip(pairs, aligned)):
+            in_rep = (score_frames >= p0) & (score_frames <= p1)
+            repetitions.append({
+                'index': k,
+                'patient_range': (int(p0), int(p1)),
+                'standard_range': (int(s0), int(s1)),
+                'dtw_distance': float(rep_distance),
+                'mean_score': float(scores[in_rep].mean()) if in_rep.any() else 0.0,
+                'tempo_ratio': (p1 - p0 + 1) / (s1 - s0 + 1),
+                'speed_variation': self.analyze_speed_variation(path_to_list(rep_path)),
+            })
+
+        return {
+            'dtw_distance': distance,
+            'alignment_path': path,
+            'path_indices': path_array,
+            'aligned_std': [std_features[i] for i, j in path],
+            'aligned_pat': [pat_features[j] for i, j in path],
+            'similarity_score': similarity,
+            'frame_scores': frame_scores,
+            'matched_range': (int(path_array[0, 1]), int(path_array[-1, 1])),
+            'segment_paths': segment_paths,
+            'repetitions': repetitions
         }
 
-    def _extract_features(self, sequence):
+    @staticmethod
+    def _extract_features(sequence):
         """
         构建时空特征向量：[归一化坐标, 角度值]
         """
-        features = []
-        for frame in sequence:
-            coord_feat = np.array(frame['norm_landmarks']).flatten()
-            angle_feat = np.array(list(frame['angles'].values()))
-            features.append(np.concatenate([coord_feat, angle_feat]))
-        return np.array(features)
+        sequence = PoseSequence.from_frames(sequence)
+        if not sequence.norm_valid.all():
+            # 与逐帧拼接时的报错保持一致，调用方据此判定为人体不完整
+            missing = int((~sequence.norm_valid).sum())
+            raise ValueError(f"inhomogeneous shape: full-body pose missing in {missing} frames")
+        coord_feat = sequence.norm_landmarks.reshape(len(sequence), -1)
+        return np.hstack([coord_feat, sequence.angles])
 
     def _compare_frames_with_multiple_matches(self, path):
         """
@@ -61,54 +232,43 @@ class ActionComparator:
             分别计算所有关节归一化坐标的欧氏距离均值和角度差的平均值（角度差除以 180 缩放到 [0,1]），
             然后将两者相加作为匹配得分。
           - 对所有匹配得分进行 min-max 归一化，将得分转换到 0～100 分（得分越高表示相似性越好）。
-        注意：fastdtw 返回 (i, j) 中，i 属于标准序列，j 属于患者序列，
-              因此构造字典时以患者帧索引 j 作为键。
-        """
-        frame_scores = []
-        patient_to_standard = {}
-        for i, j in path:
-            if j not in patient_to_standard:
-                patient_to_standard[j] = []
-            patient_to_standard[j].append(i)
-
-        for patient_frame_idx, standard_frame_idxs in patient_to_standard.items():
-            patient_frame = self.pat_seq[patient_frame_idx]
-            scores = []
-            for standard_frame_idx in standard_frame_idxs:
-                standard_frame = self.std_seq[standard_frame_idx]
-                # 计算关节坐标差异（欧氏距离均值）
-                coord_diffs = []
-                num_joints = len(patient_frame['norm_landmarks'])
-                for k in range(num_joints):
-                    p_coord = np.array(patient_frame['norm_landmarks'][k])
-                    s_coord = np.array(standard_frame['norm_landmarks'][k])
-                    diff = np.linalg.norm(p_coord - s_coord)
-                    coord_diffs.append(diff)
-                avg_coord_diff = np.mean(coord_diffs)
-
-                # 计算角度差异（绝对值平均，缩放到 [0,1]）
-                p_angles = np.array(list(patient_frame['angles'].values()))
-                s_angles = np.array(list(standard_frame['angles'].values()))
-                if p_angles.size > 0:
-                    avg_angle_diff = np.mean(np.abs(p_angles - s_angles))
-                else:
-                    avg_angle_diff = 0
-                scaled_angle_diff = avg_angle_diff / 180.0
-
-                total_diff = avg_coord_diff + scaled_angle_diff
-                scores.append(total_diff)
-            avg_score = np.mean(scores)
-            frame_scores.append((patient_frame_idx, avg_score))
-
-        all_scores = [score for _, score in frame_scores]
-        min_score = min(all_scores)
-        max_score = max(all_scores)
-        normalized_scores = []
-        for patient_frame_idx, score in frame_scores:
-            normalized_score = 100 * (max_score - score) / (max_score - min_score) if max_score != min_score else 100
-            normalized_scores.append((patient_frame_idx, normalized_score))
-
-        return normalized_scores
+        注意：DTW 路径 (i, j) 中，i 属于标准序列，j 属于患者序列，
+              因此按患者帧索引 j 分组求平均。
+        """
+        path = np.asarray(path, dtype=np.intp).reshape(-1, 2)
+        std_idx, pat_idx = path[:, 0], path[:, 1]
+        std, pat = self._get_sequences()
+
+        # 按路径一次性取出所有 (患者帧, 标准帧) 匹配对的坐标和角度
+        coord_delta = pat.norm_landmarks[pat_idx] - std.norm_landmarks[std_idx]      # (P, 33, 2)
+        avg_coord_diff = np.sqrt((coord_delta ** 2).sum(axis=2)).mean(axis=1)
+        if pat.angles.shape[1] > 0:
+            avg_angle_diff = np.abs(pat.angles[pat_idx] - std.angles[std_idx]).mean(axis=1)
+        else:
+            avg_angle_diff = np.zeros(len(path))
+        total_diff = avg_coord_diff + avg_angle_diff / 180.0
+
+        # 同一患者帧的多个匹配取平均；患者帧按在路径中首次出现的顺序排列
+        patient_frames, first_pos, inverse = np.unique(pat_idx, return_index=True, return_inverse=True)
+        counts = np.bincount(inverse)
+        grouped = total_diff[np.argsort(inverse, kind='stable')]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        # 匹配数相同的分组拼成 (G, L) 矩阵按行求均值，求和顺序与逐组 np.mean 完全一致
+        avg_scores = np.empty(len(counts))
+        for length in np.unique(counts):
+            groups = np.flatnonzero(counts == length)
+            avg_scores[groups] = grouped[starts[groups][:, None] + np.arange(length)].mean(axis=1)
+        order = np.argsort(first_pos, kind='stable')
+        avg_scores = avg_scores[order]
+        patient_frames = patient_frames[order]
+
+        min_score = avg_scores.min()
+        max_score = avg_scores.max()
+        if max_score != min_score:
+            normalized = 100 * (max_score - avg_scores) / (max_score - min_score)
+        else:
+            normalized = np.full(len(avg_scores), 100.0)
+        return list(zip(patient_frames.tolist(), normalized.tolist()))
 
     def generate_report(self, result):
         """
@@ -147,8 +307,7 @@ class ActionComparator:
         然后分别采用余弦相似度、L1 和 L2 差异计算相似度，
         转换为 0～100 分后，返回各项得分及一个综合得分（取平均）。
         """
-        std_features = self._extract_features(self.std_seq)
-        pat_features = self._extract_features(self.pat_seq)
+        std_features, pat_features = self.get_features()
         avg_std = np.mean(std_features, axis=0)
         avg_pat = np.mean(pat_features, axis=0)
         diff = avg_std - avg_pat
@@ -184,8 +343,10 @@ class ActionComparator:
         在计算前先调用 trim_alignment 剔除开头和结尾卡顿部分。
         返回一个字典，包含 slope、theta 和 angle_score。
         """
-        import numpy as np
-        trimmed_path = self.trim_alignment(alignment_path)
+        return self._alignment_angle(self.get_trimmed_path(alignment_path))
+
+    @staticmethod
+    def _alignment_angle(trimmed_path):
         points = np.array([[j, i] for i, j in trimmed_path])
         if points.shape[0] < 2:
             return {"slope": 1, "theta": 45, "angle_score": 100}
@@ -204,7 +365,10 @@ class ActionComparator:
         在计算前先用 trim_alignment 去除开头和结尾连续重复的数据（卡顿）。
         返回一个字典，包含原始方差（time_variance）、得分（time_variance_score）以及时间差列表（differences）。
         """
-        trimmed_path = self.trim_alignment(alignment_path)
+        return self._time_variance(self.get_trimmed_path(alignment_path))
+
+    @staticmethod
+    def _time_variance(trimmed_path):
         differences = [j - i for i, j in trimmed_path]
         if len(differences) == 0:
             return {"time_variance": 0, "time_variance_score": 100, "differences": []}
@@ -218,7 +382,10 @@ class ActionComparator:
         然后计算在修剪后的差值序列中，相邻差值相等的比例，
         返回值在 0～1 之间（比例越高表示中间区域动作时间匹配越好）。
         """
-        trimmed = self.trim_alignment(alignment_path)
+        return self._alignment_ratio(self.get_trimmed_path(alignment_path))
+
+    @staticmethod
+    def _alignment_ratio(trimmed):
         differences = [j - i for i, j in trimmed]
         if len(differences) <= 1:
             return 1.0  # 只有一帧或没有数据时，认为对齐100%
@@ -226,11 +393,60 @@ class ActionComparator:
         ratio = aligned_count / (len(differences) - 1)
         return ratio
 
+    def alignment_metrics(self, dtw_result):
+        """
+        基于对齐路径的时间类指标：alignment_angle、time_variance、alignment_ratio 和 speed_variation。
+        结果含 segment_paths（按次对齐）时各项指标在每次动作自己的路径上分别修剪、计算后汇总：
+        角度、方差及其得分和对齐比例按修剪后的路径长度加权平均，时间差序列与快慢动作区段依次拼接。
+        """
+        segments = dtw_result.get('segment_paths') or [dtw_result['alignment_path']]
+        trimmed = [self.get_trimmed_path(path, segment=k if len(segments) == len(self._paths) else None)
+                   for k, path in enumerate(segments)]
+        angles = [self._alignment_angle(path) for path in trimmed]
+        variances = [self._time_variance(path) for path in trimmed]
+        ratios = [self._alignment_ratio(path) for path in trimmed]
+        speeds = [self.analyze_speed_variation(path) for path in segments]
+        if len(segments) == 1:
+            return {'alignment_angle': angles[0], 'time_variance': variances[0],
+                    'alignment_ratio': ratios[0], 'speed_variation': speeds[0]}
+
+        weights = np.array([len(path) for path in trimmed], dtype=np.float64)
+        if not weights.any():
+            weights[:] = 1.0
+
+        def average(values):
+            return float(np.average(values, weights=weights))
+
+        return {
+            'alignment_angle': {key: average([angle[key] for angle in angles])
+                                for key in ('slope', 'theta', 'angle_score')},
+            'time_variance': {
+                'time_variance': average([variance['time_variance'] for variance in variances]),
+                'time_variance_score': average([variance['time_variance_score'] for variance in variances]),
+                'differences': [d for variance in variances for d in variance['differences']],
+            },
+            'alignment_ratio': average(ratios),
+            'speed_variation': {key: [segment for speed in speeds for segment in speed[key]]
+                                for key in ('slow_segments', 'fast_segments')},
+        }
+
     def trim_alignment(self,alignment_path):
-        """修剪 fastdtw 生成的 alignment_path，移除开头和结尾重复段，并打印患者帧索引范围。"""
+        """修剪 DTW 生成的 alignment_path，移除开头和结尾重复段，并打印患者帧索引范围。"""
         if not alignment_path:
             return []  # 空路径直接返回
 
+        start, stop = self._trim_range(alignment_path)
+        trimmed_path = alignment_path[start:stop]
+        # 输出调试信息：保留的第一个和最后一个患者帧索引
+        if trimmed_path:
+            print(f"保留患者帧索引范围：{trimmed_path[0][1]} 至 {trimmed_path[-1][1]}")
+        else:
+            print("保留患者帧索引范围：<空>")
+        return trimmed_path
+
+    @staticmethod
+    def _trim_range(alignment_path):
+        """trim_alignment 保留的路径区间 [start, stop)：去掉开头和结尾标准帧或患者帧重复的冗余段"""
         # 1. 修剪开头冗余匹配段
         prefix_end = 0
         if len(alignment_path) > 1:
@@ -244,36 +460,21 @@ class ActionComparator:
                 # 患者帧索引重复，患者帧卡顿
                 while prefix_end < len(alignment_path) and alignment_path[prefix_end][1] == first_pat:
                     prefix_end += 1
-        trimmed_path = alignment_path[prefix_end:]  # 去除开头冗余段
 
-        # 2. 修剪结尾冗余匹配段
-        if not trimmed_path:
-            # 开头移除后无剩余对齐点
-            print("保留患者帧索引范围：<空>")  # 或提示路径为空
-            return []
-        suffix_start = len(trimmed_path) - 1
-        if len(trimmed_path) > 1:
-            last_std, last_pat = trimmed_path[-1]
-            prev_std, prev_pat = trimmed_path[-2]
+        # 2. 修剪结尾冗余匹配段（开头移除后无剩余对齐点时为空区间）
+        suffix_start = len(alignment_path) - 1
+        if len(alignment_path) - prefix_end > 1:
+            last_std, last_pat = alignment_path[-1]
+            prev_std, prev_pat = alignment_path[-2]
             if prev_std == last_std:
                 # 结尾标准帧卡顿
-                while suffix_start >= 0 and trimmed_path[suffix_start][0] == last_std:
+                while suffix_start >= prefix_end and alignment_path[suffix_start][0] == last_std:
                     suffix_start -= 1
             elif prev_pat == last_pat:
                 # 结尾患者帧卡顿
-                while suffix_start >= 0 and trimmed_path[suffix_start][1] == last_pat:
+                while suffix_start >= prefix_end and alignment_path[suffix_start][1] == last_pat:
                     suffix_start -= 1
-        trimmed_path = trimmed_path[:suffix_start + 1]  # 去除结尾冗余段
-
-        # 3. 输出调试信息：保留的第一个和最后一个患者帧索引
-        if trimmed_path:
-            first_pat_idx = trimmed_path[0][1]
-            last_pat_idx = trimmed_path[-1][1]
-            print(f"保留患者帧索引范围：{first_pat_idx} 至 {last_pat_idx}")
-        else:
-            print("保留患者帧索引范围：<空>")
-        # 4. 返回修剪后的路径
-        return trimmed_path
+        return prefix_end, max(suffix_start + 1, prefix_end)
 
     def segment_indices(self, indices):
         """
@@ -8,3 +8,7 @@ class Config:
         'left_knee': [23, 25, 27]
     }
     NORMALIZATION_JOINTS = [11, 12, 23]
+    # 每两次姿态推理之间跳过的帧数，跳过的帧由插值补齐
+    SKIP_FRAMES = 0
+    # 重复动作（俯卧撑、深蹲等）按次切分，每次单独与标准动作对齐
+    REPETITION_ALIGNMENT = False
@@ -31,6 +31,8 @@ def get_config_class(numeric_id):
         class DynamicConfig(DefaultConfig):
             KEY_ANGLES = db_config.key_angles
             NORMALIZATION_JOINTS = db_config.normalization_joints
+            SKIP_FRAMES = db_config.skip_frames
+            REPETITION_ALIGNMENT = db_config.repetition_alignment
             DESCRIPTION = db_config.description
             NUMERIC_ID = numeric_id
             
@@ -65,13 +67,16 @@ def get_video_config(numeric_id):
         numeric_id (str): The numeric ID of the standard video (e.g., "01_01")
         
     Returns:
-        dict: Configuration dictionary with KEY_ANGLES and NORMALIZATION_JOINTS
+        dict: Configuration dictionary with KEY_ANGLES, NORMALIZATION_JOINTS, SKIP_FRAMES
+             and REPETITION_ALIGNMENT
     """
     try:
         config = VideoConfig.objects.get(numeric_id=numeric_id)
         return {
             'KEY_ANGLES': config.key_angles,
             'NORMALIZATION_JOINTS': config.normalization_joints,
+            'SKIP_FRAMES': config.skip_frames,
+            'REPETITION_ALIGNMENT': config.repetition_alignment,
             'Describe': config.description
         }
     except VideoConfig.DoesNotExist:
@@ -80,6 +85,8 @@ def get_video_config(numeric_id):
         return {
             'KEY_ANGLES': Config.KEY_ANGLES,
             'NORMALIZATION_JOINTS': Config.NORMALIZATION_JOINTS,
+            'SKIP_FRAMES': Config.SKIP_FRAMES,
+            'REPETITION_ALIGNMENT': Config.REPETITION_ALIGNMENT,
             'Describe': 'Default Configuration'
         }
 
@@ -97,6 +104,8 @@ def create_dynamic_config_from_dict(config_dict, numeric_id=None):
     config_class = type('DynamicConfig', (), {
         'KEY_ANGLES': config_dict.get('KEY_ANGLES', {}),
         'NORMALIZATION_JOINTS': config_dict.get('NORMALIZATION_JOINTS', []),
+        'SKIP_FRAMES': config_dict.get('SKIP_FRAMES', 0),
+        'REPETITION_ALIGNMENT': config_dict.get('REPETITION_ALIGNMENT', False),
         'DESCRIPTION': config_dict.get('Describe', ''),
         'NUMERIC_ID': numeric_id
     })
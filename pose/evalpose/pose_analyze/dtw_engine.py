@@ -0,0 +1,137 @@
+# dtw_engine.py
+import math
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+# exact：精确 DTW（可选 Sakoe-Chiba 带宽约束）；fastdtw：调用 fastdtw 库，用于与历史得分对比
+DTW_METHODS = ('exact', 'fastdtw')
+DEFAULT_METHOD = 'exact'
+
+
+def dtw(x, y, method=DEFAULT_METHOD, band=None, radius=1, subsequence=False):
+    """
+    计算两个特征序列之间的 DTW 距离（逐帧欧氏距离）和对齐路径。
+    :param x: (n, D) 特征矩阵（标准序列）
+    :param y: (m, D) 特征矩阵（患者序列）
+    :param method: 'exact' 或 'fastdtw'
+    :param band: Sakoe-Chiba 带宽（帧），None 表示不限制；仅 exact 模式有效
+    :param radius: fastdtw 的搜索半径；仅 fastdtw 模式有效
+    :param subsequence: 子序列 DTW（开放起点/终点）：x 整段与 y 中最匹配的一段对齐，
+                        y 首尾未匹配的帧不进入路径；仅 exact 模式有效，不能与 band 同时使用
+    :return: (distance, path)，path 为 (L, 2) int32 数组，每行为 (i, j)，i 属于 x，j 属于 y
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) == 0 or len(y) == 0:
+        raise ValueError("DTW 输入序列不能为空")
+
+    if subsequence and (method != 'exact' or band is not None):
+        raise ValueError("子序列 DTW 仅支持不带 band 的 exact 模式")
+
+    if method == 'fastdtw':
+        from fastdtw import fastdtw
+        from scipy.spatial.distance import euclidean
+        distance, path = fastdtw(x, y, radius=radius, dist=euclidean)
+        return distance, np.asarray(path, dtype=np.int32).reshape(-1, 2)
+    if method != 'exact':
+        raise ValueError(f"未知的 DTW 方法：{method}，可选 {DTW_METHODS}")
+
+    acc, steps, lo = accumulated_cost(x, y, band=band, open_begin=subsequence)
+    if subsequence:
+        # 开放终点：在最后一行中取累积代价最小的列作为终点
+        end = int(np.argmin(acc[-1, :len(y)]))
+        return float(acc[-1, end]), _backtrack(steps, lo, end, open_begin=True)
+    end = len(y) - 1
+    return float(acc[-1, end - lo[-1]]), _backtrack(steps, lo, end)
+
+
+def band_limits(n, m, band=None):
+    """
+    每行允许的列范围 [lo[i], hi[i]]（含端点），band 为 None 时不限制。
+    Sakoe-Chiba 带宽以 (0, 0) 到 (n-1, m-1) 的对角线为中心，允许偏离 band 帧；
+    长度不等时带宽至少取两序列长度之比，保证带内总存在连通路径。lo、hi 均随行号单调不减。
+    """
+    if band is None:
+        return np.zeros(n, dtype=np.int64), np.full(n, m - 1, dtype=np.int64)
+    width = max(band, math.ceil(max(n, m) / min(n, m)))
+    center = np.arange(n) * ((m - 1) / max(n - 1, 1))
+    lo = np.clip(np.ceil(center - width), 0, m - 1).astype(np.int64)
+    hi = np.clip(np.floor(center + width), 0, m - 1).astype(np.int64)
+    return lo, hi
+
+
+def band_mask(n, m, band):
+    """band_limits 对应的 (n, m) 布尔掩码"""
+    lo, hi = band_limits(n, m, band)
+    j = np.arange(m)[None, :]
+    return (j >= lo[:, None]) & (j <= hi[:, None])
+
+
+def accumulated_cost(x, y, band=None, open_begin=False):
+    """
+    按反对角线推进计算累积代价：同一反对角线上的格子只依赖前两条反对角线，可一次向量化计算。
+    矩阵按带内坐标存储，格子 (i, j) 位于第 i 行第 j - lo[i] 列，宽度为最宽一行的列数
+    （约 2 * band + 1；不限带宽时即完整的 m 列），内存与计算量都只与带内格子数成正比。
+    :return: (acc, steps, lo)
+             acc 为累积代价，带外为 inf；起点之前视为代价 0（open_begin 时 x 可以从 y 的任意帧开始匹配）。
+             steps 为 int8 前驱编号，0 = (i-1, j)、1 = (i, j-1)、2 = (i-1, j-1)，
+             代价相同时取编号小者（与 fastdtw 的回溯顺序一致）。lo 为各行起始列。
+    """
+    n, m = len(x), len(y)
+    lo, hi = band_limits(n, m, band)
+    width = int((hi - lo).max()) + 1
+    # 计算用的矩阵多一行虚拟起始行（第 0 行）和左侧一列 inf，右侧留出相邻两行起始列之差的余量，
+    # 使三个前驱都能直接按下标读取，越出带宽的位置读到的都是 inf
+    lo_rows = np.concatenate([[0], lo])
+    padded = np.full((n + 1, width + int(np.diff(lo_rows).max()) + 1), np.inf)
+    if open_begin:
+        padded[0, :] = 0.0
+    else:
+        padded[0, 0] = 0.0
+    steps = np.zeros((n, width), dtype=np.int8)
+    cost = cdist(x, y, metric='euclidean') if band is None else None
+
+    # 第 s 条反对角线上的带内格子满足 lo[i] + i <= s <= hi[i] + i，两者都随 i 严格递增，可二分得到行范围
+    first_diag, last_diag = lo + np.arange(n), hi + np.arange(n)
+    for s in range(n + m - 1):
+        i = np.arange(np.searchsorted(last_diag, s), np.searchsorted(first_diag, s, side='right'))
+        if len(i) == 0:
+            continue
+        j = s - i
+        if cost is None:
+            diff = x[i] - y[j]
+            step = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        else:
+            step = cost[i, j]
+        col = j - lo[i]
+        prev_col = j - lo_rows[i]
+        up, left, diag = padded[i, prev_col + 1], padded[i + 1, col], padded[i, prev_col]
+        best = np.minimum(np.minimum(up, left), diag)
+        padded[i + 1, col + 1] = step + best
+        steps[i, col] = np.where(up == best, 0, np.where(left == best, 1, 2))
+    return padded[1:, 1:width + 1], steps, lo
+
+
+def _backtrack(steps, lo, end, open_begin=False):
+    """
+    从 (n-1, end) 沿 accumulated_cost 记录的前驱回溯最优路径，每步只读一个前驱编号。
+    open_begin 时回溯到 x 的第一帧即停止，否则回溯到 (0, 0)。
+    """
+    lo = lo.tolist()
+    i, j = len(lo) - 1, int(end)
+    path = [(i, j)]
+    while i > 0 or (j > 0 and not open_begin):
+        step = steps[i, j - lo[i]]
+        if step != 1:
+            i -= 1
+        if step != 0:
+            j -= 1
+        path.append((i, j))
+    path.reverse()
+    return np.array(path, dtype=np.int32)
+
+
+def path_to_list(path):
+    """把 (L, 2) 路径数组转换为 [(i, j), ...]，兼容旧代码对 alignment_path 的用法"""
+    return [tuple(p) for p in np.asarray(path).tolist()]
@@ -1,4 +1,136 @@
 # evaluation.py
+import numpy as np
+from scipy.signal import find_peaks
+
+try:
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from pose_sequence import PoseSequence
+
+# 空闲判定：平滑后的运动能量低于 (第 95 百分位能量 × IDLE_ENERGY_RATIO) 视为静止
+IDLE_ENERGY_RATIO = 0.1
+IDLE_SMOOTH_WINDOW = 5
+# 首尾静止段至少持续这么多帧才会被裁剪；裁剪后在活动段两侧保留 IDLE_MARGIN 帧
+MIN_IDLE_FRAMES = 15
+IDLE_MARGIN = 3
+
+# 重复动作切分：主导关节角的往返幅度至少为 max(REP_MIN_PROMINENCE 度, 总幅度 × REP_PROMINENCE_RATIO)，
+# 相邻两次动作的极值至少相隔 MIN_REP_FRAMES 帧
+REP_MIN_PROMINENCE = 15.0
+REP_PROMINENCE_RATIO = 0.4
+MIN_REP_FRAMES = 10
+
+
+def motion_energy(sequence, window=IDLE_SMOOTH_WINDOW):
+    """
+    逐帧运动能量：相邻帧归一化坐标的平均位移 + 关节角平均变化（除以 180 缩放），
+    再做长度为 window 的滑动平均。第 0 帧取 0；未检测到人体的帧能量为 0。
+    :return: (T,) float64
+    """
+    sequence = PoseSequence.from_frames(sequence)
+    energy = np.zeros(len(sequence))
+    if len(sequence) < 2:
+        return energy
+
+    coords = np.where(sequence.norm_valid[:, None, None], sequence.norm_landmarks, 0.0)
+    step = np.sqrt((np.diff(coords, axis=0) ** 2).sum(axis=2)).mean(axis=1)
+    if sequence.angles.shape[1] > 0:
+        step = step + np.abs(np.diff(sequence.angles, axis=0)).mean(axis=1) / 180.0
+    # 与无人体帧相邻的差分没有意义
+    both_valid = sequence.norm_valid[1:] & sequence.norm_valid[:-1]
+    energy[1:] = np.where(both_valid, step, 0.0)
+
+    if window > 1:
+        energy = np.convolve(energy, np.ones(window) / window, mode='same')
+    return energy
+
+
+def detect_active_range(sequence, ratio=IDLE_ENERGY_RATIO, min_idle=MIN_IDLE_FRAMES, margin=IDLE_MARGIN):
+    """
+    检测首尾静止段，返回活动段 (起始帧, 结束帧)（闭区间，原始帧索引）。
+    静止段短于 min_idle 帧时不裁剪；整段都静止时返回完整范围。
+    """
+    energy = motion_energy(sequence)
+    last = len(energy) - 1
+    if last < 0:
+        return 0, -1
+
+    threshold = np.percentile(energy, 95) * ratio
+    active = np.flatnonzero(energy > threshold)
+    if threshold <= 0 or len(active) == 0:
+        return 0, last
+
+    start = max(int(active[0]) - margin, 0)
+    end = min(int(active[-1]) + margin, last)
+    if start < min_idle:
+        start = 0
+    if last - end < min_idle:
+        end = last
+    return start, end
+
+
+def offset_patient_indices(dtw_result, offset):
+    """
+    把在裁剪后患者序列上得到的 DTW 结果映射回原始帧索引：
+    对齐路径（含按次对齐的分段路径）、帧得分和匹配范围中的患者帧索引统一加上 offset（原地修改并返回）。
+    """
+    if not offset:
+        return dtw_result
+    dtw_result['alignment_path'] = [(i, j + offset) for i, j in dtw_result['alignment_path']]
+    if 'segment_paths' in dtw_result:
+        dtw_result['segment_paths'] = [[(i, j + offset) for i, j in path] for path in dtw_result['segment_paths']]
+    if 'path_indices' in dtw_result:
+        dtw_result['path_indices'] = dtw_result['path_indices'] + np.array([0, offset], dtype=np.int32)
+    dtw_result['frame_scores'] = [(j + offset, score) for j, score in dtw_result['frame_scores']]
+    if 'matched_range' in dtw_result:
+        first, last = dtw_result['matched_range']
+        dtw_result['matched_range'] = (first + offset, last + offset)
+    for rep in dtw_result.get('repetitions', []):
+        first, last = rep['patient_range']
+        rep['patient_range'] = (first + offset, last + offset)
+    return dtw_result
+
+
+def segment_repetitions(sequence, min_rep_frames=MIN_REP_FRAMES, min_prominence=REP_MIN_PROMINENCE,
+                        prominence_ratio=REP_PROMINENCE_RATIO):
+    """
+    按主导关节角（变化幅度最大的关节角）把序列切分为若干次重复动作。
+    视频开头的角度值所在一侧视为静止姿态，另一侧的显著极值为每次动作的“最深点”，
+    相邻两个最深点之间最接近静止姿态的帧作为切分点。
+    :return: [(起始帧, 结束帧), ...]，闭区间，首尾相接覆盖整段序列；检测不到两次以上动作时返回整段
+    """
+    sequence = PoseSequence.from_frames(sequence)
+    length = len(sequence)
+    if length == 0:
+        return []
+    if sequence.angles.shape[1] == 0 or length < 2 * min_rep_frames:
+        return [(0, length - 1)]
+
+    angles = sequence.angles
+    dominant = angles[:, int(np.argmax(angles.std(axis=0)))]
+    # 边缘用端点值填充后做滑动平均，抑制关键点抖动造成的伪极值
+    window = IDLE_SMOOTH_WINDOW
+    padded = np.pad(dominant, window // 2, mode='edge')
+    signal = np.convolve(padded, np.ones(window) / window, mode='valid')
+
+    amplitude = np.ptp(signal)
+    prominence = max(min_prominence, amplitude * prominence_ratio)
+    # 统一变换为“静止姿态在高处”，最深点即为谷值
+    rest_is_high = signal[0] >= (signal.max() + signal.min()) / 2
+    upright = signal if rest_is_high else -signal
+    # 两端补一个静止姿态的值，使视频在动作中途开始/结束时末次动作的深度也能被计算
+    rest = upright.max()
+    bottoms, _ = find_peaks(-np.concatenate([[rest], upright, [rest]]),
+                            prominence=prominence, distance=min_rep_frames)
+    bottoms = bottoms - 1
+    if len(bottoms) < 2:
+        return [(0, length - 1)]
+
+    cuts = [int(a + np.argmax(upright[a:b + 1])) for a, b in zip(bottoms[:-1], bottoms[1:])]
+    bounds = [0] + cuts + [length]
+    return [(bounds[k], bounds[k + 1] - 1) for k in range(len(bounds) - 1)]
+
+
 def detect_action_stages(sequence, angle_threshold=5):
     """
     根据关键点角度变化自动识别动作阶段。
@@ -25,16 +157,18 @@ def detect_action_stages(sequence, angle_threshold=5):
 def select_lowest_score_frames(dtw_result, stages, max_frames=3):
     """
     在识别的阶段中选取得分最低的帧。
-    :param dtw_result: DTW 对齐结果，包含各帧得分
+    :param dtw_result: DTW 对齐结果，包含各帧得分 [(患者帧索引, 得分), ...]
     :param stages: 动作阶段列表
     :param max_frames: 最多选择的帧数
     :return: 选定的最低得分帧列表
+    按患者帧索引（而非列表位置）划分阶段，子序列对齐时未匹配的首尾帧没有得分，对应阶段跳过。
     """
     frame_scores = dtw_result['frame_scores']
     lowest_frames = []
     for stage_start, stage_end in stages:
-        stage_scores = frame_scores[stage_start:stage_end+1]
-        lowest_frames.append(sorted(stage_scores, key=lambda x: x[1])[0])
+        stage_scores = [item for item in frame_scores if stage_start <= item[0] <= stage_end]
+        if stage_scores:
+            lowest_frames.append(min(stage_scores, key=lambda x: x[1]))
     if len(stages) > max_frames:
         lowest_frames = sorted(lowest_frames, key=lambda x: x[1])[:max_frames]
     return lowest_frames
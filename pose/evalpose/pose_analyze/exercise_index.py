@@ -0,0 +1,220 @@
+# exercise_index.py
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    from .evaluation import detect_active_range, segment_repetitions
+    from .joint_angles import compile_key_angles, compute_angles
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from evaluation import detect_active_range, segment_repetitions
+    from joint_angles import compile_key_angles, compute_angles
+    from pose_sequence import PoseSequence
+
+logger = logging.getLogger(__name__)
+
+# 索引文件格式版本，嵌入方式变化时递增，旧索引加载时报错并需重新构建
+INDEX_FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+# 与各标准视频的 KEY_ANGLES 无关的固定关节角集合，所有参考视频的嵌入在同一空间中比较
+INDEX_ANGLES = {
+    'left_elbow': [11, 13, 15],
+    'right_elbow': [12, 14, 16],
+    'left_shoulder': [13, 11, 23],
+    'right_shoulder': [14, 12, 24],
+    'left_hip': [11, 23, 25],
+    'right_hip': [12, 24, 26],
+    'left_knee': [23, 25, 27],
+    'right_knee': [24, 26, 28],
+}
+# 每个窗口重采样后的帧数
+EMBED_LENGTH = 32
+
+
+def canonical_sequence(sequence):
+    """用 INDEX_ANGLES 重新计算关节角，关键点和归一化坐标不变"""
+    sequence = PoseSequence.from_frames(sequence)
+    angle_names, triplets = compile_key_angles(INDEX_ANGLES)
+    angles = compute_angles(sequence.landmarks, sequence.valid, triplets)
+    return PoseSequence(sequence.landmarks, sequence.valid, angles, angle_names,
+                        sequence.norm_landmarks, sequence.norm_valid)
+
+
+def embed_window(angles, valid, length=EMBED_LENGTH):
+    """
+    把一段 (T, K) 关节角轨迹在有效帧上线性插值重采样为 length 帧，除以 180 缩放后展平。
+    没有有效帧时返回 None。
+    :return: (length * K,) float32
+    """
+    frames = np.flatnonzero(valid)
+    if len(frames) == 0:
+        return None
+    targets = np.linspace(frames[0], frames[-1], length)
+    resampled = np.stack([np.interp(targets, frames, angles[frames, k]) for k in range(angles.shape[1])], axis=1)
+    return (resampled / 180.0).ravel().astype(np.float32)
+
+
+def embed_sequence(sequence, trim=True, length=EMBED_LENGTH):
+    """
+    序列的窗口嵌入：活动段整体一个窗口，能切分出多次重复动作时每次动作再各一个窗口。
+    参考视频与患者视频用同一函数生成嵌入，重复次数不同的视频也能按单次动作匹配。
+    :return: (W, length * len(INDEX_ANGLES)) float32
+    """
+    sequence = canonical_sequence(sequence)
+    if trim and len(sequence):
+        start, end = detect_active_range(sequence)
+        sequence = sequence[start:end + 1]
+
+    windows = [(0, len(sequence) - 1)]
+    reps = segment_repetitions(sequence)
+    if len(reps) > 1:
+        windows += reps
+
+    embeddings = [embed_window(sequence.angles[a:b + 1], sequence.valid[a:b + 1], length) for a, b in windows]
+    embeddings = [e for e in embeddings if e is not None]
+    if not embeddings:
+        return np.zeros((0, length * len(INDEX_ANGLES)), dtype=np.float32)
+    return np.stack(embeddings)
+
+
+class ExerciseIndex:
+    """
+    参考视频库的动作识别索引：每个参考视频贡献若干窗口嵌入（embed_sequence），
+    嵌入矩阵保存为 .npy，以只读内存映射方式加载，同一台机器上的所有工作进程共享页缓存；
+    每行所属的 numeric_id、视频路径以及嵌入文件名保存在 meta.json。
+    """
+
+    def __init__(self, embeddings, keys, references, length=EMBED_LENGTH):
+        self.embeddings = embeddings
+        self.keys = np.asarray(keys)
+        self.references = dict(references)
+        self.length = length
+        self._sq_norms = None
+
+    def __len__(self):
+        return len(self.references)
+
+    @classmethod
+    def build(cls, entries, length=EMBED_LENGTH):
+        """
+        :param entries: [(numeric_id, video_path, sequence), ...]
+        """
+        blocks, keys, references = [], [], {}
+        for numeric_id, video_path, sequence in entries:
+            embeddings = embed_sequence(sequence, length=length)
+            if len(embeddings) == 0:
+                logger.warning(f"No valid frames to index for {numeric_id}")
+                continue
+            blocks.append(embeddings)
+            keys.extend([numeric_id] * len(embeddings))
+            references[numeric_id] = str(video_path)
+        dim = length * len(INDEX_ANGLES)
+        matrix = np.concatenate(blocks) if blocks else np.zeros((0, dim), dtype=np.float32)
+        return cls(matrix, keys, references, length)
+
+    def save(self, directory):
+        """
+        写入索引：嵌入矩阵按内容摘要命名，先写嵌入文件再原子替换 meta.json，
+        读取方要么看到旧索引要么看到新索引；已映射旧嵌入文件的进程不受删除影响。
+        """
+        os.makedirs(directory, exist_ok=True)
+        embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        embeddings_file = f"embeddings_{hashlib.sha256(embeddings.tobytes()).hexdigest()[:16]}.npy"
+        meta = {
+            'format': INDEX_FORMAT_VERSION,
+            'length': self.length,
+            'angles': INDEX_ANGLES,
+            'embeddings': embeddings_file,
+            'keys': [str(k) for k in self.keys],
+            'references': self.references,
+        }
+        _atomic_write(directory, embeddings_file, lambda f: np.save(f, embeddings))
+        _atomic_write(directory, META_FILE, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode('utf-8')))
+        for name in os.listdir(directory):
+            if name.startswith('embeddings_') and name.endswith('.npy') and name != embeddings_file:
+                os.remove(os.path.join(directory, name))
+
+    @classmethod
+    def load(cls, directory):
+        """以内存映射方式加载索引；文件不存在时抛出 FileNotFoundError，格式版本不符时抛出 ValueError"""
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT_VERSION or meta.get('angles') != INDEX_ANGLES:
+            raise ValueError(f"动作识别索引 {directory} 的格式已过期，请重新构建")
+        embeddings = np.load(os.path.join(directory, meta['embeddings']), mmap_mode='r')
+        if len(embeddings) != len(meta['keys']):
+            raise ValueError(f"动作识别索引 {directory} 的嵌入与元数据不一致，请重新构建")
+        return cls(embeddings, meta['keys'], meta['references'], meta['length'])
+
+    def query(self, sequence, top_k=5):
+        """
+        找出与序列最接近的 top_k 个参考视频。
+        查询窗口与索引所有行的欧氏距离用 |q|² + |x|² - 2 q·x 一次矩阵运算得到，
+        每个参考视频取其所有窗口对中的最小距离（除以 sqrt(嵌入维度)，与窗口长度无关）。
+        :return: [(numeric_id, distance), ...]，按距离升序
+        """
+        if len(self.embeddings) == 0:
+            return []
+        queries = embed_sequence(sequence, length=self.length)
+        if len(queries) == 0:
+            return []
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings, dtype=np.float64)
+        # 直接在内存映射的 float32 矩阵上做矩阵乘法，不复制整个索引
+        cross = (queries @ self.embeddings.T).astype(np.float64)
+        sq = (queries.astype(np.float64) ** 2).sum(axis=1)[:, None] + self._sq_norms[None, :] - 2.0 * cross
+        row_distance = np.sqrt(np.maximum(sq, 0.0)).min(axis=0) / np.sqrt(self.embeddings.shape[1])
+
+        order = np.argsort(row_distance, kind='stable')
+        ranked, seen = [], set()
+        for row in order:
+            key = str(self.keys[row])
+            if key in seen:
+                continue
+            seen.add(key)
+            ranked.append((key, float(row_distance[row])))
+            if len(ranked) >= top_k:
+                break
+        return ranked
+
+
+def _atomic_write(directory, name, write):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+_index_lock = threading.Lock()
+_loaded_index = {}
+
+
+def get_exercise_index(directory):
+    """
+    进程内共享的索引实例：按元数据文件的修改时间缓存，重新构建后下一次调用自动加载新索引。
+    索引不存在时返回 None。
+    """
+    meta_path = os.path.join(directory, META_FILE)
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _index_lock:
+        cached = _loaded_index.get(directory)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, ExerciseIndex.load(directory))
+            _loaded_index[directory] = cached
+            logger.info(f"Loaded exercise index {directory}: {len(cached[1])} references")
+        return cached[1]
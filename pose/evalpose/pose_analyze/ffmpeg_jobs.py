@@ -0,0 +1,151 @@
+# ffmpeg_jobs.py
+import collections
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 单个转换任务的默认超时（秒）
+DEFAULT_TIMEOUT = 300
+# 出错时保留的 ffmpeg 错误输出行数
+STDERR_TAIL_LINES = 20
+
+
+def with_progress(command):
+    """在 ffmpeg 命令中加入 -progress pipe:1（进度以 key=value 行写到 stdout）并关闭 stderr 上的统计输出"""
+    return [command[0], '-progress', 'pipe:1', '-nostats'] + list(command[1:])
+
+
+class FFmpegJobManager:
+    """
+    ffmpeg 任务管理：所有任务共用一个线程池，超出全局并发上限（max_jobs 个名额）的任务排队等待。
+    渲染时直接写入 ffmpeg 管道的 HLS 编码进程（FFmpegHLSWriter）通过 reserve() 占用同一组名额。
+    每个任务有超时限制（超时后终止进程），通过 -progress 记录进度，返回结果中包含实际运行耗时。
+    stdout（进度）和 stderr 都由后台线程持续读取，不会因管道写满而阻塞 ffmpeg。
+    """
+
+    def __init__(self, max_jobs=None, default_timeout=DEFAULT_TIMEOUT):
+        self.max_jobs = max(int(max_jobs or os.cpu_count() or 1), 1)
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='ffmpeg-job')
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._slots_in_use = 0
+        # 正在运行的任务名 -> 最近一次进度（key=value 字典）
+        self.progress = {}
+
+    def submit(self, command, name=None, timeout=None):
+        """提交任务，返回 Future，其结果为 run() 的返回值"""
+        return self._executor.submit(self.run, command, name, timeout)
+
+    def run_all(self, jobs, timeout=None):
+        """
+        并发执行多个任务并等待全部完成。
+        :param jobs: {name: command}
+        :return: {name: run() 的返回值}
+        """
+        futures = {name: self.submit(command, name, timeout) for name, command in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    @contextmanager
+    def reserve(self, count=1):
+        """
+        占用 count 个并发名额直到退出 with 块，名额不足时等待。
+        一次需要的名额超过上限时按上限占用（即独占运行），不会永远等待。
+        """
+        count = min(max(int(count), 0), self.max_jobs)
+        with self._slots:
+            self._slots.wait_for(lambda: self._slots_in_use + count <= self.max_jobs)
+            self._slots_in_use += count
+        try:
+            yield count
+        finally:
+            with self._slots:
+                self._slots_in_use -= count
+                self._slots.notify_all()
+
+    def run(self, command, name=None, timeout=None):
+        """
+        在当前线程中执行一个 ffmpeg 任务（占用一个并发名额，通常通过 submit/run_all 调用）。
+        :return: {'name', 'success', 'returncode', 'timed_out', 'wall_time', 'progress', 'error'}
+        """
+        with self.reserve(1):
+            return self._run(command, name, timeout)
+
+    def _run(self, command, name, timeout):
+        name = name or os.path.basename(command[-1])
+        timeout = self.default_timeout if timeout is None else timeout
+        result = {'name': name, 'success': False, 'returncode': None, 'timed_out': False,
+                  'wall_time': 0.0, 'progress': {}, 'error': None}
+        stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+
+        started = time.monotonic()
+        try:
+            process = subprocess.Popen(with_progress(command), stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            result['error'] = str(e)
+            logger.error(f"启动 FFmpeg 任务 {name} 失败: {str(e)}")
+            return result
+
+        readers = [
+            threading.Thread(target=self._read_progress, args=(process.stdout, name, result['progress']), daemon=True),
+            threading.Thread(target=lambda: stderr_tail.extend(line.rstrip() for line in process.stderr), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            result['returncode'] = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            result['returncode'] = process.wait()
+            result['timed_out'] = True
+        for reader in readers:
+            reader.join()
+        with self._lock:
+            self.progress.pop(name, None)
+
+        result['wall_time'] = time.monotonic() - started
+        result['success'] = result['returncode'] == 0 and not result['timed_out']
+        if result['timed_out']:
+            result['error'] = f"超时（{timeout}s）"
+            logger.error(f"FFmpeg 任务 {name} 超时（{timeout}s），已终止")
+        elif not result['success']:
+            result['error'] = ' | '.join(stderr_tail)
+            logger.error(f"FFmpeg 任务 {name} 失败（返回码 {result['returncode']}）: {result['error']}")
+        else:
+            logger.info(f"FFmpeg 任务 {name} 完成，耗时 {result['wall_time']:.2f}s，"
+                        f"已处理 {result['progress'].get('out_time', '?')}（{result['progress'].get('speed', '?')}）")
+        return result
+
+    def _read_progress(self, stream, name, progress):
+        """解析 -progress 输出：每组 key=value 以 progress=continue/end 结尾，整组更新一次"""
+        block = {}
+        for line in stream:
+            key, sep, value = line.strip().partition('=')
+            if not sep:
+                continue
+            block[key] = value
+            if key == 'progress':
+                progress.update(block)
+                with self._lock:
+                    self.progress[name] = dict(progress)
+                block = {}
+
+
+_manager_lock = threading.Lock()
+_manager = None
+
+
+def get_job_manager(max_jobs=None, default_timeout=DEFAULT_TIMEOUT):
+    """进程内共享的任务管理器，首次调用时按参数创建，全局并发上限对所有请求生效"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = FFmpegJobManager(max_jobs, default_timeout)
+        return _manager
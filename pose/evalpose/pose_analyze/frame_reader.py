@@ -0,0 +1,95 @@
+# frame_reader.py
+import queue
+import threading
+
+import cv2
+
+# 默认解码队列深度（帧数）
+DEFAULT_QUEUE_SIZE = 32
+
+_END = object()
+
+
+class FrameReader:
+    """
+    后台线程解码视频帧，通过有界队列交给推理循环消费，使解码与推理重叠执行。
+    迭代得到 (bgr帧, rgb帧)：convert_rgb 为 False 时 rgb帧为 None；
+    resize_max 指定时 rgb帧的长边缩放到不超过该值（MediaPipe 输出归一化坐标，缩放不影响关键点映射）。
+    传入视频路径时由本类负责打开和释放；传入 cv2.VideoCapture 时从其当前位置读取，释放由调用方负责。
+    """
+
+    def __init__(self, source, queue_size=None, convert_rgb=False, resize_max=None, max_frames=None):
+        if isinstance(source, cv2.VideoCapture):
+            self.cap = source
+            self._owns_cap = False
+        else:
+            self.cap = cv2.VideoCapture(source)
+            self._owns_cap = True
+            if not self.cap.isOpened():
+                raise ValueError(f"无法打开视频文件：{source}")
+
+        self.convert_rgb = convert_rgb
+        self.resize_max = resize_max
+        self.max_frames = max_frames
+        self._queue = queue.Queue(maxsize=max(int(queue_size or DEFAULT_QUEUE_SIZE), 1))
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='FrameReader', daemon=True)
+        self._thread.start()
+
+    def _prepare_rgb(self, img):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if self.resize_max:
+            h, w = rgb.shape[:2]
+            scale = self.resize_max / max(h, w)
+            if scale < 1:
+                rgb = cv2.resize(rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return rgb
+
+    def _put(self, item):
+        # 队列满时周期性检查停止标志，避免消费者提前退出后线程永久阻塞
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        count = 0
+        try:
+            while not self._stop.is_set() and (self.max_frames is None or count < self.max_frames):
+                success, img = self.cap.read()
+                if not success:
+                    break
+                rgb = self._prepare_rgb(img) if self.convert_rgb else None
+                if not self._put((img, rgb)):
+                    return
+                count += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(_END)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                break
+            yield item
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """停止解码线程并释放资源（可重复调用）"""
+        self._stop.set()
+        self._thread.join()
+        if self._owns_cap:
+            self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,133 @@
+# hls_writer.py
+import collections
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每个 .ts 片段的时长（秒），与原先对 mp4 做 HLS 转换时的 -hls_time 一致
+HLS_SEGMENT_SECONDS = 2
+# 编码参数：H.264 + yuv420p 便于浏览器直接播放；yuv420p 要求宽高为偶数
+HLS_ENCODE_ARGS = [
+    '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+    '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+]
+# 写入线程缓冲的帧数
+HLS_QUEUE_SIZE = 16
+# 出错时保留的 ffmpeg 错误输出行数
+STDERR_TAIL_LINES = 20
+# 视频帧率读取失败时使用的帧率
+DEFAULT_FPS = 25.0
+
+_END = object()
+
+
+def ffmpeg_available(binary='ffmpeg'):
+    """系统中能否找到 ffmpeg 可执行文件"""
+    return shutil.which(binary) is not None
+
+
+def hls_command(output_dir, name, fps, size, binary='ffmpeg', segment_seconds=HLS_SEGMENT_SECONDS):
+    """从 stdin 读取 BGR 原始帧、直接切片输出 {name}.m3u8 和 {name}_%03d.ts 的 ffmpeg 命令"""
+    width, height = size
+    return [
+        binary, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{fps:g}',
+        '-i', '-',
+        *HLS_ENCODE_ARGS,
+        '-hls_time', str(segment_seconds),
+        '-hls_list_size', '0',
+        '-hls_segment_filename', os.path.join(output_dir, f'{name}_%03d.ts'),
+        '-f', 'hls',
+        os.path.join(output_dir, f'{name}.m3u8'),
+    ]
+
+
+class FFmpegHLSWriter:
+    """
+    把渲染好的帧通过管道写入 ffmpeg 的 stdin，由 ffmpeg 直接编码并切片为 HLS，
+    不再先用 cv2.VideoWriter 写中间 mp4、再解码重新编码一遍。
+    写入在后台线程进行；ffmpeg 中途退出时后续帧被丢弃，close() 返回 False，不影响同一次渲染的其他输出。
+    指定 timeout 时进程运行超过 timeout 秒即被终止（timed_out 为 True）；close() 后 wall_time 为进程实际运行耗时。
+    """
+
+    def __init__(self, output_dir, name, fps, size, binary='ffmpeg', queue_size=HLS_QUEUE_SIZE, timeout=None):
+        self.output_dir = output_dir
+        self.name = name
+        self.timeout = timeout
+        self.timed_out = False
+        self.wall_time = 0.0
+        self.playlist_path = os.path.join(output_dir, f'{name}.m3u8')
+        os.makedirs(output_dir, exist_ok=True)
+        command = hls_command(output_dir, name, fps or DEFAULT_FPS, size, binary)
+        logger.info(f"开始生成{name}视频的HLS流: {' '.join(command)}")
+        self._started = time.monotonic()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+        self._error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        # stderr 必须持续读取，否则管道写满后 ffmpeg 会阻塞
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, name='FFmpegStderr', daemon=True)
+        self._stderr_thread.start()
+        self._thread = threading.Thread(target=self._run, name='FFmpegHLSWriter', daemon=True)
+        self._thread.start()
+        self._watchdog = None
+        if timeout:
+            self._watchdog = threading.Timer(timeout, self._kill)
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def _kill(self):
+        """超时：终止 ffmpeg，写入线程随之因管道断开而丢弃后续帧"""
+        if self.process.poll() is None:
+            self.timed_out = True
+            self.process.kill()
+
+    def _drain_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self._stderr_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is _END:
+                break
+            if self._error is None:
+                try:
+                    self.process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+                except (BrokenPipeError, OSError, ValueError) as e:
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is None:
+            self._queue.put(frame)
+
+    def close(self):
+        """结束输入并等待 ffmpeg 退出，返回是否成功生成播放列表"""
+        self._queue.put(_END)
+        self._thread.join()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self.process.wait()
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self._stderr_thread.join()
+        self.wall_time = time.monotonic() - self._started
+        if self.timed_out:
+            logger.error(f"FFmpeg 编码 {self.name} 超时（{self.timeout}s），已终止")
+            return False
+        if returncode != 0 or self._error is not None:
+            logger.error(f"FFmpeg 错误 ({self.name}, 返回码 {returncode}): {' | '.join(self._stderr_tail) or self._error}")
+            return False
+        logger.info(f"HLS 流处理完成: {self.playlist_path}")
+        return True
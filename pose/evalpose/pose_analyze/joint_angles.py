@@ -0,0 +1,51 @@
+# joint_angles.py
+import numpy as np
+
+try:
+    from .pose_sequence import NUM_LANDMARKS
+except ImportError:
+    from pose_sequence import NUM_LANDMARKS
+
+
+def compile_key_angles(key_angles):
+    """
+    将 KEY_ANGLES（{名称: [p1, p2, p3]}）编译为角度名称列表和 (K, 3) 的关键点索引数组，
+    p2 为角的顶点。
+    """
+    names = list(key_angles)
+    triplets = np.array([list(key_angles[name]) for name in names], dtype=np.intp).reshape(-1, 3)
+    return names, triplets
+
+
+def compute_angles(landmarks, valid, triplets):
+    """
+    一次性计算整段序列的关节角度，语义与 PoseDetector.find_angle 一致：
+    角度为两向量 (p1 - p2)、(p3 - p2) 夹角的绝对值（0-180 度），
+    NumPy 的 arctan2 与 math.atan2 之间最多相差 1 ulp。
+    :param landmarks: (T, 33, 2) 关键点像素坐标
+    :param valid: (T,) bool，未检测到人体的帧角度为 0
+    :param triplets: compile_key_angles 得到的 (K, 3) 索引数组
+    :return: (T, K) float64 角度矩阵
+    """
+    landmarks = np.asarray(landmarks)
+    valid = np.asarray(valid, dtype=bool)
+    T, K = len(landmarks), len(triplets)
+    if K == 0:
+        return np.zeros((T, 0))
+
+    # 超出关键点范围的三元组与 find_angle 一样恒为 0
+    in_range = triplets.max(axis=1) < NUM_LANDMARKS
+    safe = np.where(in_range[:, None], triplets, 0)
+
+    # 坐标为整数，用 int64 计算点积和叉积，结果与逐个计算时完全相同
+    pts = landmarks.astype(np.int64)
+    vertex = pts[:, safe[:, 1]]
+    v1 = pts[:, safe[:, 0]] - vertex
+    v2 = pts[:, safe[:, 2]] - vertex
+    dot = v1[..., 0] * v2[..., 0] + v1[..., 1] * v2[..., 1]
+    cross = v1[..., 0] * v2[..., 1] - v1[..., 1] * v2[..., 0]
+    angles = np.abs(np.degrees(np.arctan2(cross.astype(np.float64), dot.astype(np.float64))))
+
+    angles[~valid] = 0
+    angles[:, ~in_range] = 0
+    return angles
@@ -0,0 +1,71 @@
+# normalization.py
+import numpy as np
+
+try:
+    from .pose_sequence import NUM_LANDMARKS
+except ImportError:
+    from pose_sequence import NUM_LANDMARKS
+
+
+def l2_bbox_normalize(landmarks, valid, normalization_joints=()):
+    """
+    对整段序列做包围盒 + L2 归一化，参考 Compare_pose.py 中的 l2_normalize 算法：
+    1. 根据所有关键点计算包围盒（box = [min_x, min_y, max_x, max_y]）
+    2. 计算 temp_x = (max_x - min_x)/2, temp_y = (max_y - min_y)/2
+    3. 若 temp_x <= temp_y，则 sub_x = min_x - (temp_y - temp_x), sub_y = min_y；
+       否则，sub_x = min_x, sub_y = min_y - (temp_x - temp_y)
+    4. 对每个关键点，计算偏移坐标 (x - sub_x, y - sub_y)，并将所有偏移坐标组成一维向量，
+       计算该向量的 L2 范数 norm_val，再除以 norm_val得到归一化后的坐标（norm_val 为 0 时保留偏移坐标）。
+    :param landmarks: (T, 33, 2) 关键点像素坐标
+    :param valid: (T,) bool，该帧是否检测到人体
+    :param normalization_joints: 归一化所需的关节，任一关节不存在时该帧无归一化结果
+    :return: ((T, 33, 2) float64 归一化坐标, (T,) bool 归一化是否有效)
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    norm_valid = np.asarray(valid, dtype=bool).copy()
+    # 检测到人体时 33 个关键点齐全，超出范围的关节视为缺失
+    if any(int(k) >= NUM_LANDMARKS or int(k) < 0 for k in normalization_joints):
+        norm_valid[:] = False
+
+    normalized = np.zeros(landmarks.shape, dtype=np.float64)
+    if not norm_valid.any():
+        return normalized, norm_valid
+
+    pts = landmarks[norm_valid]
+    mins = pts.min(axis=1)
+    maxs = pts.max(axis=1)
+    half = (maxs - mins) / 2
+    temp_x, temp_y = half[:, 0], half[:, 1]
+
+    sub = mins.copy()
+    wide = temp_x > temp_y
+    sub[~wide, 0] -= (temp_y - temp_x)[~wide]
+    sub[wide, 1] -= (temp_x - temp_y)[wide]
+
+    offsets = pts - sub[:, None, :]
+    norm_val = np.linalg.norm(offsets.reshape(len(pts), -1), axis=1)
+    scale = np.where(norm_val == 0, 1.0, norm_val)
+    normalized[norm_valid] = offsets / scale[:, None, None]
+    return normalized, norm_valid
+
+
+def minmax_normalize(landmarks, valid):
+    """
+    README 描述的归一化：每帧关键点按各自包围盒缩放到 [0, 1]，
+    包围盒宽或高为 0 的维度取 0。
+    :param landmarks: (T, N, 2) 关键点像素坐标
+    :param valid: (T,) bool，无效帧输出全 0
+    :return: (T, N, 2) float64
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    valid = np.asarray(valid, dtype=bool)
+    normalized = np.zeros(landmarks.shape, dtype=np.float64)
+    if landmarks.size == 0 or not valid.any():
+        return normalized
+
+    pts = landmarks[valid]
+    mins = pts.min(axis=1, keepdims=True)
+    ranges = pts.max(axis=1, keepdims=True) - mins
+    safe = np.where(ranges == 0, 1.0, ranges)
+    normalized[valid] = np.where(ranges == 0, 0.0, (pts - mins) / safe)
+    return normalized
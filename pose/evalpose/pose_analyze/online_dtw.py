@@ -0,0 +1,127 @@
+# online_dtw.py
+import numpy as np
+
+try:
+    from .action_comparator import ActionComparator
+    from .joint_angles import compile_key_angles, compute_angles
+    from .normalization import l2_bbox_normalize
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from action_comparator import ActionComparator
+    from joint_angles import compile_key_angles, compute_angles
+    from normalization import l2_bbox_normalize
+    from pose_sequence import PoseSequence
+
+# 每来一帧只计算匹配位置前后 DEFAULT_WINDOW 个标准帧的累积代价
+DEFAULT_WINDOW = 30
+
+
+class OnlineAligner:
+    """
+    增量（在线）DTW：预先加载标准序列，患者帧逐帧输入。
+    累积代价只保留当前匹配位置附近 [match - window, match + window] 范围内的一列，
+    每帧的计算量与标准视频长度无关，只与窗口大小有关。
+    递推式与离线 DTW 相同：D[i, j] = c(i, j) + min(D[i-1, j], D[i, j-1], D[i-1, j-1])，
+    窗口覆盖整段标准序列时，最后一行的累积代价与 dtw_engine.dtw 的距离一致。
+    匹配位置只前进不后退；患者开始新一次动作时调用 reset()。
+    """
+
+    def __init__(self, std_sequence, config, window=DEFAULT_WINDOW, reference_features=None):
+        """
+        :param std_sequence: 标准序列（PoseSequence 或逐帧字典列表）
+        :param config: 提供 KEY_ANGLES、NORMALIZATION_JOINTS 的配置，需与提取标准序列时一致
+        :param window: 匹配位置两侧保留的标准帧数
+        :param reference_features: ActionComparator.fit_reference_features 的结果，提供时不再重新拟合
+        """
+        self.std = PoseSequence.from_frames(std_sequence)
+        if len(self.std) == 0:
+            raise ValueError("标准序列不能为空")
+        self.angle_names, self.angle_triplets = compile_key_angles(config.KEY_ANGLES)
+        self.normalization_joints = list(getattr(config, 'NORMALIZATION_JOINTS', []))
+        self.window = max(int(window), 1)
+
+        if reference_features is None:
+            reference_features = ActionComparator.fit_reference_features(self.std)
+        self.mean = np.asarray(reference_features['mean'], dtype=np.float64)
+        self.scale = np.asarray(reference_features['scale'], dtype=np.float64)
+        self.std_features = np.asarray(reference_features['scaled'], dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """清空对齐状态，下一帧重新从标准序列第 0 帧开始匹配"""
+        self.frame_count = 0
+        self.match = 0
+        # 上一列累积代价：覆盖标准帧 [_col_start, _col_start + len(_col))
+        self._col = None
+        self._col_start = 0
+
+    @property
+    def distance(self):
+        """当前累积代价（终点为标准序列最后一帧）；最后一帧不在窗口内时为 inf"""
+        if self._col is None:
+            return np.inf
+        last = len(self.std) - 1 - self._col_start
+        return float(self._col[last]) if 0 <= last < len(self._col) else np.inf
+
+    def update(self, landmarks, valid=True):
+        """
+        输入一帧患者关键点，更新对齐状态。
+        :param landmarks: (33, 2) 关键点像素坐标
+        :param valid: 该帧是否检测到人体；未检测到时不推进对齐，返回 None
+        :return: {'frame_index', 'std_index', 'frame_cost', 'similarity_score', 'progress'}
+        """
+        landmarks = np.asarray(landmarks).reshape(1, -1, 2)
+        norm, norm_valid = l2_bbox_normalize(landmarks, [bool(valid)], self.normalization_joints)
+        if not norm_valid[0]:
+            return None
+        angles = compute_angles(landmarks, [True], self.angle_triplets)
+        features = (np.hstack([norm.reshape(1, -1), angles]) - self.mean) / self.scale
+        return self._advance(features[0], norm[0], angles[0])
+
+    def extend(self, sequence):
+        """依次输入一段序列的所有帧，返回每帧 update 的结果列表"""
+        sequence = PoseSequence.from_frames(sequence)
+        return [self.update(sequence.landmarks[t], sequence.valid[t]) for t in range(len(sequence))]
+
+    def _advance(self, features, norm, angles):
+        n = len(self.std)
+        lo = max(self.match - self.window, 0)
+        hi = min(self.match + self.window, n - 1)
+        rows = np.arange(lo, hi + 1)
+
+        step = np.sqrt(((self.std_features[lo:hi + 1] - features) ** 2).sum(axis=1))
+        # 从上一列进入第 k 行的代价：min(D[k, j-1], D[k-1, j-1])
+        if self._col is None:
+            enter = np.where(rows == 0, 0.0, np.inf)
+        else:
+            same = self._previous(rows)
+            diag = self._previous(rows - 1)
+            enter = np.minimum(same, diag)
+        # 列内纵向推进：D[i] = min_{k<=i}(enter[k] + c[k..i]) = C[i] + min_{k<=i}(enter[k] - C[k-1])
+        cumulative = np.cumsum(step)
+        col = cumulative + np.minimum.accumulate(enter + step - cumulative)
+
+        # 以路径长度归一化的累积代价选取匹配位置，且不后退
+        j = self.frame_count
+        best = int(np.argmin(col / (rows + j + 2)))
+        self.match = max(self.match, lo + best)
+        self._col, self._col_start = col, lo
+        self.frame_count += 1
+
+        i = self.match
+        coord_diff = np.sqrt(((norm - self.std.norm_landmarks[i]) ** 2).sum(axis=1)).mean()
+        angle_diff = np.abs(angles - self.std.angles[i]).mean() if len(angles) else 0.0
+        matched_cost = col[i - lo]
+        return {
+            'frame_index': j,
+            'std_index': i,
+            'frame_cost': float(coord_diff + angle_diff / 180.0),
+            'similarity_score': float(1 / (1 + matched_cost / max(i + 1, j + 1))),
+            'progress': (i + 1) / n,
+        }
+
+    def _previous(self, rows):
+        """上一列在给定标准帧处的累积代价，窗口外为 inf"""
+        idx = rows - self._col_start
+        inside = (idx >= 0) & (idx < len(self._col))
+        return np.where(inside, self._col[np.clip(idx, 0, len(self._col) - 1)], np.inf)
@@ -1,6 +1,15 @@
 # pose_comparison.py
 import numpy as np
 
+try:
+    from .dtw_engine import DEFAULT_METHOD, dtw
+    from .normalization import minmax_normalize
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from dtw_engine import DEFAULT_METHOD, dtw
+    from normalization import minmax_normalize
+    from pose_sequence import PoseSequence
+
 
 def readme_normalize_landmarks(landmarks):
     """
@@ -8,20 +17,10 @@ def readme_normalize_landmarks(landmarks):
     输入 landmarks：列表，每个元素格式为 [index, x, y]
     输出：归一化后的关键点列表，每个元素为 [norm_x, norm_y]，归一化到 [0, 1]
     """
-    xs = [lm[1] for lm in landmarks]
-    ys = [lm[2] for lm in landmarks]
-    min_x = min(xs)
-    max_x = max(xs)
-    min_y = min(ys)
-    max_y = max(ys)
-    range_x = max_x - min_x
-    range_y = max_y - min_y
-    normalized = []
-    for lm in landmarks:
-        norm_x = (lm[1] - min_x) / range_x if range_x != 0 else 0
-        norm_y = (lm[2] - min_y) / range_y if range_y != 0 else 0
-        normalized.append([norm_x, norm_y])
-    return normalized
+    if len(landmarks) == 0:
+        return []
+    points = np.array([lm[1:3] for lm in landmarks], dtype=np.float64)[None]
+    return minmax_normalize(points, [True])[0].tolist()
 
 
 def flatten_pose(frame, use_readme_norm=True):
@@ -45,6 +44,25 @@ def flatten_pose(frame, use_readme_norm=True):
     return feature_vector
 
 
+def sequence_features(sequence, use_readme_norm=True):
+    """
+    将整段序列展平为 (N, D) 特征矩阵，跳过无法归一化的帧，逐帧结果与 flatten_pose 相同。
+    PoseSequence 直接在数组上批量归一化，旧的 dict 列表逐帧处理。
+    """
+    if isinstance(sequence, PoseSequence):
+        if use_readme_norm:
+            rows = sequence.valid
+            coords = minmax_normalize(sequence.landmarks, rows)
+        else:
+            rows = sequence.norm_valid
+            coords = sequence.norm_landmarks
+        return np.hstack([coords[rows].reshape(int(rows.sum()), -1), sequence.angles[rows]])
+
+    features = [flatten_pose(frame, use_readme_norm=use_readme_norm) for frame in sequence]
+    features = [vec for vec in features if vec is not None]
+    return np.array(features)
+
+
 def cosine_similarity(vec1, vec2):
     """
     计算两个向量之间的余弦相似度。
@@ -120,31 +138,20 @@ def weight_match_l2(pose1, pose2, weights=None):
     return score
 
 
-def dtw_compare(seq1, seq2, scaler=None):
+def dtw_compare(seq1, seq2, scaler=None, method=DEFAULT_METHOD, band=None):
     """
     利用 DTW 比较两个视频序列的姿态数据，返回 DTW 距离及归一化后的相似度得分（0～100）。
     使用 README 的归一化方法对每一帧进行归一化，再计算特征向量差异。
+    method/band 为 DTW 引擎参数，见 dtw_engine.dtw。
     """
-    from fastdtw import fastdtw
-    from scipy.spatial.distance import euclidean
-    features1 = []
-    features2 = []
-    for frame in seq1:
-        vec = flatten_pose(frame, use_readme_norm=True)
-        if vec is not None:
-            features1.append(vec)
-    for frame in seq2:
-        vec = flatten_pose(frame, use_readme_norm=True)
-        if vec is not None:
-            features2.append(vec)
+    features1 = sequence_features(seq1, use_readme_norm=True)
+    features2 = sequence_features(seq2, use_readme_norm=True)
     if len(features1) == 0 or len(features2) == 0:
         return None, 0.0
-    features1 = np.array(features1)
-    features2 = np.array(features2)
     if scaler is not None:
         features1 = scaler.fit_transform(features1)
         features2 = scaler.transform(features2)
-    distance, _ = fastdtw(features1, features2, dist=euclidean)
+    distance, _ = dtw(features1, features2, method=method, band=band)
     max_length = max(len(features1), len(features2))
     normalized_distance = distance / max_length
     similarity = 100 * (1 / (1 + normalized_distance))
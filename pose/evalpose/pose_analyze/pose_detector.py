@@ -2,8 +2,61 @@
 import cv2
 import mediapipe as mp
 import math
+import types
 import numpy as np
 
+try:
+    from .frame_reader import FrameReader
+    from .joint_angles import compile_key_angles, compute_angles
+    from .normalization import l2_bbox_normalize
+    from .pose_pool import get_pose_pool
+    from .pose_sequence import NUM_LANDMARKS, PoseSequence
+    from .process_pool import get_process_pool
+except ImportError:
+    from frame_reader import FrameReader
+    from joint_angles import compile_key_angles, compute_angles
+    from normalization import l2_bbox_normalize
+    from pose_pool import get_pose_pool
+    from pose_sequence import NUM_LANDMARKS, PoseSequence
+    from process_pool import get_process_pool
+
+# 分段并行提取时，每段向前多解码的帧数，用于让 MediaPipe 的跟踪状态预热
+CHUNK_WARMUP_FRAMES = 8
+# 每段至少包含的帧数，视频过短时退回串行提取
+MIN_CHUNK_FRAMES = 60
+# ROI 模式下人体包围盒向外扩展的比例（相对包围盒长边）
+ROI_MARGIN = 0.25
+# ROI 模式下送入推理的图像长边上限
+ROI_MAX_SIDE = 640
+# 全身可见性预检：抽样帧数、所需关节的平均可见度阈值、需要通过的抽样帧比例
+VISIBILITY_PROBE_SAMPLES = 8
+VISIBILITY_THRESHOLD = 0.5
+VISIBILITY_MIN_PASS_RATIO = 0.5
+
+def _extract_chunk(task):
+    """
+    进程池工作函数：用独立的 Pose 实例提取 [start, stop) 范围内的帧。
+    先定位到 start - warmup，对预热帧只做推理不输出，使跟踪状态与串行提取接近。
+    """
+    config = types.SimpleNamespace(**task['config'])
+    analyzer = VideoAnalyzer(config=config, queue_size=task['queue_size'], **task['roi'], **task['detector'])
+    cap = cv2.VideoCapture(task['video_path'])
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频文件：{task['video_path']}")
+    analyzer.acquire_pose()
+    try:
+        warmup_start = max(task['start'] - task['warmup'], 0)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+        for _ in range(task['start'] - warmup_start):
+            success, img = cap.read()
+            if not success:
+                return PoseSequence.empty(0, list(analyzer.key_angles))
+            analyzer._detect_landmarks(img)
+        return analyzer._extract_frames(cap, task['stride'], task['stop'] - task['start'] if task['stop'] else None)
+    finally:
+        analyzer.release_pose()
+        cap.release()
+
 class PoseDetector:
     def __init__(self, mode=False, smooth=True, detection_con=0.5, track_con=0.5):
         self.mode = mode
@@ -13,17 +66,44 @@ class PoseDetector:
 
         self.mp_draw = mp.solutions.drawing_utils
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
-            static_image_mode=self.mode,
-            smooth_landmarks=self.smooth,
-            min_detection_confidence=self.detection_con,
-            min_tracking_confidence=self.track_con
-        )
+        # Pose 实例从进程级实例池借出，首次推理时获取，release_pose() 归还
+        self.pose = None
         self.results = None
 
-    def find_pose(self, img, draw=True):
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.pose.process(img_rgb)
+    def detector_settings(self):
+        """返回影响检测结果的参数，用于构造缓存键"""
+        return {
+            'static_image_mode': self.mode,
+            'smooth_landmarks': self.smooth,
+            'min_detection_confidence': self.detection_con,
+            'min_tracking_confidence': self.track_con,
+        }
+
+    def acquire_pose(self):
+        """从实例池借出一个跟踪状态已重置的 Pose（已持有时直接返回）"""
+        if self.pose is None:
+            self.pose = get_pose_pool().acquire(self.detector_settings())
+            self.results = None
+        return self.pose
+
+    def release_pose(self):
+        """把持有的 Pose 归还实例池"""
+        if self.pose is not None:
+            get_pose_pool().release(self.detector_settings(), self.pose)
+            self.pose = None
+            self.results = None
+
+    def reset(self):
+        """清除跟踪状态，使下一段视频的检测结果不受上一段视频影响"""
+        if self.pose is not None:
+            self.pose.reset()
+        self.results = None
+
+    def find_pose(self, img, draw=True, img_rgb=None):
+        """img_rgb 为解码线程预先转换好的 RGB 帧，提供时跳过颜色转换"""
+        if img_rgb is None:
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        self.results = self.acquire_pose().process(img_rgb)
         if self.results.pose_landmarks and draw:
             self.mp_draw.draw_landmarks(
                 img, self.results.pose_landmarks,
@@ -69,7 +149,7 @@ class PoseDetector:
 
 
 class VideoAnalyzer(PoseDetector):
-    def __init__(self, config=None, **kwargs):
+    def __init__(self, config=None, workers=1, queue_size=None, roi=False, roi_max_side=ROI_MAX_SIDE, **kwargs):
         super().__init__(**kwargs)
         # Use provided config or import default if none provided
         if config is None:
@@ -79,97 +159,291 @@ class VideoAnalyzer(PoseDetector):
         else:
             self.key_angles = config.KEY_ANGLES
             self.normalization_joints = getattr(config, 'NORMALIZATION_JOINTS', [11, 12, 23])
+        # KEY_ANGLES 编译为索引数组，供批量角度计算使用
+        self.angle_names, self.angle_triplets = compile_key_angles(self.key_angles)
         
         # Store the config object for other methods to access
         self.config = config
+        # 并行提取使用的进程数，1 表示串行
+        self.workers = max(int(workers or 1), 1)
+        # 解码队列深度，None 表示使用 FrameReader 的默认值
+        self.queue_size = queue_size
+        # ROI 模式：根据上一帧关键点裁剪人体区域并缩小后再推理，适合高分辨率视频
+        self.roi = bool(roi)
+        self.roi_max_side = int(roi_max_side)
+        self._roi_box = None
+
+    def detector_settings(self):
+        settings = super().detector_settings()
+        if self.roi:
+            settings.update({'roi': True, 'roi_max_side': self.roi_max_side, 'roi_margin': ROI_MARGIN})
+        if self.workers > 1:
+            # 分段提取的结果与分段方式有关，分段参数也计入缓存键
+            settings.update({'workers': self.workers, 'chunk_warmup_frames': CHUNK_WARMUP_FRAMES,
+                             'min_chunk_frames': MIN_CHUNK_FRAMES})
+        return settings
+
+    def process_video(self, video_path, skip_frames=None, workers=None):
+        """
+        提取视频中的姿势特征序列，返回 PoseSequence（下标访问/迭代仍得到逐帧 dict）
+        :param skip_frames: 每两次推理之间跳过的帧数；为 None 时使用配置中的 SKIP_FRAMES。
+                            被跳过的帧通过相邻推理帧的线性插值补齐，输出序列与视频帧一一对应。
+        :param workers: 并行提取的进程数；为 None 时使用构造时的 workers。
+                        大于 1 时视频按帧区间分段，在进程池中并行提取后按顺序合并。
+        """
+        if skip_frames is None:
+            skip_frames = getattr(self.config, 'SKIP_FRAMES', 0) if self.config else 0
+        stride = max(int(skip_frames), 0) + 1
+        workers = self.workers if workers is None else max(int(workers), 1)
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"无法打开视频文件：{video_path}")
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        chunks = self._plan_chunks(total_frames, workers)
+        if len(chunks) > 1:
+            cap.release()
+            return self._process_chunks_parallel(video_path, chunks, stride)
 
-    def process_video(self, video_path, skip_frames=2):
+        # 每段视频借用一个新重置的 Pose，结束后归还实例池
+        self.release_pose()
+        self.acquire_pose()
+        self._roi_box = None
+        try:
+            return self._extract_frames(cap, stride)
+        finally:
+            self.release_pose()
+            cap.release()
+
+    def required_joints(self):
+        """归一化和角度计算依赖的关节索引"""
+        joints = {int(k) for k in self.normalization_joints}
+        joints.update(int(k) for k in self.angle_triplets.ravel())
+        return sorted(joints)
+
+    def probe_visibility(self, video_path, samples=VISIBILITY_PROBE_SAMPLES):
         """
-        提取视频中的姿势特征序列
+        全身可见性预检：在视频中均匀抽取若干帧，以静态图片模式检测，
+        检查 NORMALIZATION_JOINTS 和 KEY_ANGLES 涉及的关节是否被检测到：
+        帧内检测到人体且这些关节的平均 visibility 不低于阈值即视为通过
+        （个别关节被遮挡或略出画面时仍可正常分析，因此不要求每个关节都可见）。
+        :return: {'sampled': 抽样帧数, 'visible': 通过的帧数, 'passed': 是否通过}；
+                 无法获取帧数时不做判断，直接视为通过
         """
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"无法打开视频文件：{video_path}")
-        sequence = []
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            cap.release()
+            return {'sampled': 0, 'visible': 0, 'passed': True}
+
+        joints = [k for k in self.required_joints() if k < NUM_LANDMARKS]
+        probe_settings = dict(self.detector_settings(), static_image_mode=True)
+        positions = np.unique(np.linspace(0, total_frames - 1, num=max(int(samples), 1)).astype(int))
+        sampled = visible = 0
+        try:
+            with get_pose_pool().checkout(probe_settings) as pose:
+                for pos in positions:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, int(pos))
+                    success, img = cap.read()
+                    if not success:
+                        continue
+                    sampled += 1
+                    results = pose.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+                    if not results.pose_landmarks:
+                        continue
+                    landmarks = results.pose_landmarks.landmark
+                    if not joints or np.mean([landmarks[k].visibility for k in joints]) >= VISIBILITY_THRESHOLD:
+                        visible += 1
+        finally:
+            cap.release()
+
+        passed = sampled == 0 or visible >= VISIBILITY_MIN_PASS_RATIO * sampled
+        return {'sampled': sampled, 'visible': visible, 'passed': passed}
+
+    @staticmethod
+    def _plan_chunks(total_frames, workers):
+        """把 [0, total_frames) 均分为若干帧区间；最后一段不设上界，一直读到视频结束"""
+        if workers <= 1 or total_frames <= 0:
+            return [(0, None)]
+        n_chunks = min(workers, total_frames // MIN_CHUNK_FRAMES)
+        if n_chunks <= 1:
+            return [(0, None)]
+        bounds = [round(i * total_frames / n_chunks) for i in range(n_chunks)]
+        return [(start, stop) for start, stop in zip(bounds, bounds[1:] + [None])]
+
+    def _process_chunks_parallel(self, video_path, chunks, stride):
+        config = {
+            'KEY_ANGLES': self.key_angles,
+            'NORMALIZATION_JOINTS': self.normalization_joints,
+        }
+        detector = {
+            'mode': self.mode,
+            'smooth': self.smooth,
+            'detection_con': self.detection_con,
+            'track_con': self.track_con,
+        }
+        tasks = [{
+            'video_path': video_path,
+            'start': start,
+            'stop': stop,
+            'stride': stride,
+            'warmup': CHUNK_WARMUP_FRAMES,
+            'queue_size': self.queue_size,
+            'roi': {'roi': self.roi, 'roi_max_side': self.roi_max_side},
+            'config': config,
+            'detector': detector,
+        } for start, stop in chunks]
+
+        # 池大小取自 workers 配置而不是本视频的分段数，各请求共用同一个池，不会被重建
+        pool = get_process_pool('pose_extraction', self.workers)
+        return PoseSequence.concatenate(pool.map(_extract_chunk, tasks))
+
+    def _extract_frames(self, cap, stride, max_frames=None):
+        """
+        从 cap 当前位置开始逐帧提取，最多 max_frames 帧（None 表示读到结尾）。
+        解码与颜色转换在 FrameReader 的后台线程中进行，与推理重叠执行；
+        推理只负责关键点，角度和归一化坐标在整段序列上批量计算。
+        """
+        landmarks = []
+        valid = []
+        inferred = []
         frame_count = 0
+        last_img = None
 
-        while cap.isOpened():
-            success, img = cap.read()
-            if not success:
-                break
+        # ROI 模式只对裁剪区域做颜色转换，解码线程不再转换整帧
+        with FrameReader(cap, queue_size=self.queue_size, convert_rgb=not self.roi, max_frames=max_frames) as reader:
+            for img, img_rgb in reader:
+                if frame_count % stride == 0:
+                    points, detected = self._detect_landmarks(img, img_rgb)
+                    inferred.append(True)
+                else:
+                    # 占位，推理结束后再插值补齐
+                    points, detected = None, False
+                    inferred.append(False)
+                    last_img = img
+                landmarks.append(points)
+                valid.append(detected)
+                frame_count += 1
 
-            # 如果需要跳帧，可取消注释下面的代码
-            # if frame_count % (skip_frames+1) != 0:
-            #     frame_count += 1
-            #     continue
+        # 保证最后一帧经过推理，使每个被跳过的帧都夹在两个推理帧之间
+        if inferred and not inferred[-1]:
+            landmarks[-1], valid[-1] = self._detect_landmarks(last_img)
+            inferred[-1] = True
 
-            self.find_pose(img)
-            lm_list = self.find_position(img, draw=False)
-            angles = self._get_frame_angles(img)
+        empty = np.zeros((NUM_LANDMARKS, 2), dtype=np.int32)
+        landmarks = np.array([empty if points is None else points for points in landmarks],
+                             dtype=np.int32).reshape(-1, NUM_LANDMARKS, 2)
+        valid = np.array(valid, dtype=bool)
+        if stride > 1:
+            self._fill_skipped_frames(landmarks, valid, np.array(inferred, dtype=bool))
+        return self._build_sequence(landmarks, valid)
 
-            frame_data = {
-                'landmarks': lm_list,
-                'angles': angles,
-                'norm_landmarks': self._normalize_landmarks(lm_list)
-            }
-            sequence.append(frame_data)
-            frame_count += 1
+    def _detect_landmarks(self, img, img_rgb=None):
+        """对单帧推理，返回 ((33, 2) 关键点坐标, 是否检测到人体)"""
+        if self.roi:
+            return self._detect_landmarks_roi(img)
+        self.find_pose(img, draw=False, img_rgb=img_rgb)
+        lm_list = self.find_position(img, draw=False)
+        if len(lm_list) != NUM_LANDMARKS:
+            return np.zeros((NUM_LANDMARKS, 2), dtype=np.int32), False
+        return np.array([lm[1:] for lm in lm_list], dtype=np.int32), True
 
-        cap.release()
-        return sequence
+    def _detect_landmarks_roi(self, img):
+        """
+        ROI 模式推理：在上一帧人体包围盒（含边距）内裁剪推理，关键点映射回整帧坐标；
+        首帧或跟踪丢失时对整帧（同样缩小）推理，重新建立包围盒。
+        """
+        h, w = img.shape[:2]
+        points = None
+        if self._roi_box is not None:
+            x0, y0, x1, y1 = self._roi_box
+            points = self._infer_region(img[y0:y1, x0:x1], x0, y0)
+        if points is None:
+            points = self._infer_region(img, 0, 0)
+        if points is None:
+            self._roi_box = None
+            return np.zeros((NUM_LANDMARKS, 2), dtype=np.int32), False
+        self._roi_box = self._next_roi_box(points, w, h, self._roi_box)
+        return points, True
+
+    def _infer_region(self, region, x0, y0):
+        """对图像区域推理，长边缩小到 roi_max_side 以内；返回整帧坐标下的 (33, 2) 关键点，未检测到时返回 None"""
+        rh, rw = region.shape[:2]
+        scale = self.roi_max_side / max(rh, rw)
+        if scale < 1:
+            region = cv2.resize(region, (max(int(rw * scale), 1), max(int(rh * scale), 1)),
+                                interpolation=cv2.INTER_LINEAR)
+        self.results = self.acquire_pose().process(cv2.cvtColor(region, cv2.COLOR_BGR2RGB))
+        if not self.results.pose_landmarks:
+            return None
+        # MediaPipe 输出相对区域的归一化坐标，按区域原始尺寸映射回整帧
+        return np.array([[int(x0 + lm.x * rw), int(y0 + lm.y * rh)]
+                         for lm in self.results.pose_landmarks.landmark], dtype=np.int32)
 
-    def _normalize_landmarks(self, lm_list):
+    @staticmethod
+    def _next_roi_box(points, width, height, current=None):
         """
-        使用新的归一化方法，参考 Compare_pose.py 中的 l2_normalize 算法：
-        1. 根据所有关键点计算包围盒（box = [min_x, min_y, max_x, max_y]）
-        2. 计算 temp_x = (max_x - min_x)/2, temp_y = (max_y - min_y)/2
-        3. 若 temp_x <= temp_y，则 sub_x = min_x - (temp_y - temp_x), sub_y = min_y；
-           否则，sub_x = min_x, sub_y = min_y - (temp_x - temp_y)
-        4. 对每个关键点，计算偏移坐标 (x - sub_x, y - sub_y)，并将所有偏移坐标组成一维向量，
-           计算该向量的 L2 范数 norm_val，再除以 norm_val得到归一化后的坐标。
+        由关键点包围盒加边距得到下一帧的裁剪区域，裁剪到画面范围内；区域过小时返回 None。
+        人体仍在当前区域的内半边距以内且区域没有明显偏大时沿用当前区域，
+        避免裁剪窗口逐帧抖动干扰 MediaPipe 的帧间跟踪。
         """
-        if len(lm_list) == 0:
-            return []
-        
-        # 对于并非所有关键点存在的情况，返回空列表
-        if not all(k in [lm[0] for lm in lm_list] for k in self.normalization_joints):
-            return []
-
-        # 计算包围盒
-        xs = [lm[1] for lm in lm_list]
-        ys = [lm[2] for lm in lm_list]
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
-        # 计算半宽和半高
-        temp_x = (max_x - min_x) / 2
-        temp_y = (max_y - min_y) / 2
-
-        # 按照 Compare_pose.py 的处理（这里 box[0]=min_x, box[1]=min_y, box[2]=max_x, box[3]=max_y，且 min_x<=max_x, min_y<=max_y）
-        if temp_x <= temp_y:
-            sub_x = min_x - (temp_y - temp_x)
-            sub_y = min_y
-        else:
-            sub_x = min_x
-            sub_y = min_y - (temp_x - temp_y)
-
-        # 对每个关键点，计算相对于 sub_x, sub_y 的偏移
-        normalized_coords = []
-        for lm in lm_list:
-            norm_x = lm[1] - sub_x
-            norm_y = lm[2] - sub_y
-            normalized_coords.append([norm_x, norm_y])
-        # 将所有坐标平铺成一维向量，计算 L2 范数
-        flat_coords = [coord for pair in normalized_coords for coord in pair]
-        norm_val = np.linalg.norm(flat_coords)
-        if norm_val == 0:
-            return normalized_coords
-        # 对每个关键点进行归一化
-        normalized = [[x / norm_val, y / norm_val] for (x, y) in normalized_coords]
-        return normalized
-
-    def _get_frame_angles(self, img):
-        return {k: self.find_angle(img, *v, draw=False) for k, v in self.key_angles.items()}
-    
+        (min_x, min_y), (max_x, max_y) = points.min(axis=0), points.max(axis=0)
+        margin = ROI_MARGIN * max(max_x - min_x, max_y - min_y)
+        if current is not None:
+            x0, y0, x1, y1 = current
+            inner = margin / 2
+            fits = (min_x - inner >= x0 or x0 == 0) and (min_y - inner >= y0 or y0 == 0) \
+                and (max_x + inner <= x1 or x1 == width) and (max_y + inner <= y1 or y1 == height)
+            oversized = (x1 - x0) * (y1 - y0) > 2 * (max_x - min_x + 2 * margin) * (max_y - min_y + 2 * margin)
+            if fits and not oversized:
+                return current
+        x0 = int(max(min_x - margin, 0))
+        y0 = int(max(min_y - margin, 0))
+        x1 = int(min(max_x + margin, width))
+        y1 = int(min(max_y + margin, height))
+        if x1 - x0 < 32 or y1 - y0 < 32:
+            return None
+        return x0, y0, x1, y1
+
+    def rebuild_sequence(self, sequence):
+        """
+        用当前配置的 KEY_ANGLES 和 NORMALIZATION_JOINTS 重新计算另一序列的角度和归一化坐标，
+        关键点坐标不变；同一段视频与多个不同配置的标准视频比较时只需提取一次。
+        """
+        sequence = PoseSequence.from_frames(sequence)
+        return self._build_sequence(sequence.landmarks, sequence.valid)
+
+    def _build_sequence(self, landmarks, valid):
+        angles = compute_angles(landmarks, valid, self.angle_triplets)
+        norm_landmarks, norm_valid = l2_bbox_normalize(landmarks, valid, self.normalization_joints)
+        return PoseSequence(landmarks, valid, angles, self.angle_names, norm_landmarks, norm_valid)
+
+    def _fill_skipped_frames(self, landmarks, valid, inferred):
+        """
+        对跳过的帧（inferred 为 False）在前后两个推理帧之间线性插值关键点坐标（原地修改），
+        角度和归一化坐标随后由插值后的坐标计算。若任一端未检测到人体，则复制距离更近的推理帧。
+        """
+        key_idxs = np.flatnonzero(inferred)
+        skipped = np.flatnonzero(~inferred)
+        if len(key_idxs) == 0 or len(skipped) == 0:
+            return
+        pos = np.searchsorted(key_idxs, skipped)
+        a = key_idxs[pos - 1]
+        b = key_idxs[pos]
+        t = (skipped - a) / (b - a)
+
+        can_interp = valid[a] & valid[b]
+        nearest = np.where(t < 0.5, a, b)
+        lm_a = landmarks[a].astype(np.float64)
+        lm_b = landmarks[b].astype(np.float64)
+        interp = np.rint(lm_a + t[:, None, None] * (lm_b - lm_a)).astype(np.int32)
+
+        landmarks[skipped] = np.where(can_interp[:, None, None], interp, landmarks[nearest])
+        valid[skipped] = np.where(can_interp, True, valid[nearest])
+
     # Adding the draw_bone function from visualization
     def draw_bone(self, img, landmarks, connections, color=(0, 255, 0)):
         """
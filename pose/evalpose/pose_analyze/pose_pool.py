@@ -0,0 +1,131 @@
+# pose_pool.py
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import mediapipe as mp
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每种检测参数组合默认保留的空闲实例数
+DEFAULT_POOL_SIZE = min(os.cpu_count() or 1, 8)
+
+
+def _pool_key(settings):
+    return (
+        bool(settings.get('static_image_mode', False)),
+        bool(settings.get('smooth_landmarks', True)),
+        float(settings.get('min_detection_confidence', 0.5)),
+        float(settings.get('min_tracking_confidence', 0.5)),
+    )
+
+
+class PosePool:
+    """
+    进程级的 MediaPipe Pose 实例池，按 (static_image_mode, smooth_landmarks, 检测阈值, 跟踪阈值) 分组。
+    构造 Pose 需要加载模型并分配计算图，代价较高；池中实例创建后先在空白帧上推理一次完成预热，
+    借出前调用 reset() 清空跟踪状态，归还后供下一段视频复用。
+    每组最多保留 size 个空闲实例，多余的实例在归还时关闭。
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = max(int(size), 1)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _create(self, key):
+        static_image_mode, smooth_landmarks, detection_con, track_con = key
+        pose = mp.solutions.pose.Pose(
+            static_image_mode=static_image_mode,
+            smooth_landmarks=smooth_landmarks,
+            min_detection_confidence=detection_con,
+            min_tracking_confidence=track_con
+        )
+        # 第一次推理会初始化推理引擎，提前在空白帧上完成
+        pose.process(np.zeros((64, 64, 3), dtype=np.uint8))
+        return pose
+
+    def acquire(self, settings):
+        """借出一个已重置跟踪状态的 Pose 实例，池中没有空闲实例时新建"""
+        key = _pool_key(settings)
+        with self._lock:
+            idle = self._idle.get(key)
+            pose = idle.pop() if idle else None
+        if pose is None:
+            pose = self._create(key)
+        pose.reset()
+        return pose
+
+    def release(self, settings, pose):
+        """归还实例；该组空闲实例已满时直接关闭"""
+        key = _pool_key(settings)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(pose)
+                return
+        pose.close()
+
+    @contextmanager
+    def checkout(self, settings):
+        pose = self.acquire(settings)
+        try:
+            yield pose
+        finally:
+            self.release(settings, pose)
+
+    def warm(self, settings, count=None):
+        """预先创建实例直到该组空闲数达到 count（默认 size）"""
+        key = _pool_key(settings)
+        count = min(self.size if count is None else int(count), self.size)
+        with self._lock:
+            missing = count - len(self._idle.get(key, []))
+        created = [self._create(key) for _ in range(max(missing, 0))]
+        for pose in created:
+            self.release(settings, pose)
+        if created:
+            logger.info(f"Warmed {len(created)} Pose instances for {key}")
+
+    def resize(self, size):
+        """调整每组保留的空闲实例上限，超出部分立即关闭"""
+        surplus = []
+        with self._lock:
+            self.size = max(int(size), 1)
+            for idle in self._idle.values():
+                while len(idle) > self.size:
+                    surplus.append(idle.pop())
+        for pose in surplus:
+            pose.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pose_pool():
+    """返回当前进程共享的 PosePool"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = PosePool()
+        return _default_pool
+
+
+def warm_in_background(settings_list, count=None):
+    """
+    在后台线程中按每组检测参数预热共享池（各 count 个，默认池大小），不阻塞服务启动；
+    预热完成前到达的请求照常新建实例。返回预热线程。
+    """
+    def run():
+        pool = get_pose_pool()
+        for settings in settings_list:
+            try:
+                pool.warm(settings, count)
+            except Exception as e:
+                logger.warning(f"Pose 实例池预热失败 {settings}: {str(e)}")
+
+    thread = threading.Thread(target=run, name='PosePoolWarmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,133 @@
+# pose_sequence.py
+import numpy as np
+
+# MediaPipe Pose 输出的关键点数量
+NUM_LANDMARKS = 33
+
+
+class PoseSequence:
+    """
+    列式存储的姿态序列，替代逐帧的 dict 列表：
+      - landmarks:      (T, 33, 2) int32，关键点像素坐标
+      - valid:          (T,) bool，该帧是否检测到人体
+      - angles:         (T, K) float64，按 angle_names 顺序排列的关节角度
+      - norm_landmarks: (T, 33, 2) float64，归一化坐标
+      - norm_valid:     (T,) bool，该帧归一化坐标是否有效（归一化所需关节全部存在）
+    兼容旧接口：len()、下标访问和迭代返回与原来相同结构的 dict
+    （{'landmarks': [[idx, x, y], ...], 'angles': {...}, 'norm_landmarks': [[x, y], ...]}），
+    切片返回新的 PoseSequence。
+    """
+
+    def __init__(self, landmarks, valid, angles, angle_names, norm_landmarks, norm_valid=None):
+        self.landmarks = np.asarray(landmarks, dtype=np.int32).reshape(-1, NUM_LANDMARKS, 2)
+        self.valid = np.asarray(valid, dtype=bool).reshape(-1)
+        self.angle_names = tuple(angle_names)
+        self.angles = np.asarray(angles, dtype=np.float64).reshape(len(self.valid), len(self.angle_names))
+        self.norm_landmarks = np.asarray(norm_landmarks, dtype=np.float64).reshape(-1, NUM_LANDMARKS, 2)
+        self.norm_valid = self.valid.copy() if norm_valid is None else np.asarray(norm_valid, dtype=bool).reshape(-1)
+
+    @classmethod
+    def empty(cls, length, angle_names):
+        return cls(
+            np.zeros((length, NUM_LANDMARKS, 2), dtype=np.int32),
+            np.zeros(length, dtype=bool),
+            np.zeros((length, len(angle_names))),
+            angle_names,
+            np.zeros((length, NUM_LANDMARKS, 2)),
+            np.zeros(length, dtype=bool),
+        )
+
+    @classmethod
+    def from_frames(cls, frames, angle_names=None):
+        """由旧的逐帧 dict 列表构造；angle_names 为空时取第一帧角度的键顺序"""
+        if isinstance(frames, PoseSequence):
+            return frames
+        frames = list(frames)
+        if angle_names is None:
+            angle_names = list(frames[0]['angles']) if frames else []
+        seq = cls.empty(len(frames), angle_names)
+        for t, frame in enumerate(frames):
+            landmarks = frame.get('landmarks') or []
+            if len(landmarks) == NUM_LANDMARKS:
+                seq.valid[t] = True
+                seq.landmarks[t] = [lm[1:3] for lm in landmarks]
+            angles = frame.get('angles') or {}
+            seq.angles[t] = [angles.get(name, 0) for name in seq.angle_names]
+            norm = frame.get('norm_landmarks') or []
+            if len(norm) == NUM_LANDMARKS:
+                seq.norm_valid[t] = True
+                seq.norm_landmarks[t] = norm
+        return seq
+
+    @classmethod
+    def concatenate(cls, parts):
+        """按顺序拼接多个序列（所有序列的 angle_names 必须一致）"""
+        parts = list(parts)
+        if not parts:
+            return cls.empty(0, [])
+        return cls(
+            np.concatenate([p.landmarks for p in parts]),
+            np.concatenate([p.valid for p in parts]),
+            np.concatenate([p.angles for p in parts]),
+            parts[0].angle_names,
+            np.concatenate([p.norm_landmarks for p in parts]),
+            np.concatenate([p.norm_valid for p in parts]),
+        )
+
+    def frame(self, t):
+        """返回第 t 帧的旧格式 dict"""
+        if self.valid[t]:
+            landmarks = [[idx, int(x), int(y)] for idx, (x, y) in enumerate(self.landmarks[t].tolist())]
+        else:
+            landmarks = []
+        norm = self.norm_landmarks[t].tolist() if self.norm_valid[t] else []
+        return {
+            'landmarks': landmarks,
+            'angles': dict(zip(self.angle_names, self.angles[t].tolist())),
+            'norm_landmarks': norm,
+        }
+
+    def to_frames(self):
+        """转换为旧格式的 dict 列表（可直接 JSON 序列化，用于 session.frame_data）"""
+        return [self.frame(t) for t in range(len(self))]
+
+    def angle_index(self, name):
+        return self.angle_names.index(name)
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return PoseSequence(
+                self.landmarks[item], self.valid[item], self.angles[item],
+                self.angle_names, self.norm_landmarks[item], self.norm_valid[item]
+            )
+        return self.frame(range(len(self))[item])
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self.frame(t)
+
+    def __repr__(self):
+        return f"PoseSequence(frames={len(self)}, angles={list(self.angle_names)})"
+
+    def save(self, file):
+        """以 npz 格式保存到文件路径或文件对象"""
+        np.savez(
+            file,
+            landmarks=self.landmarks,
+            valid=self.valid,
+            angles=self.angles,
+            angle_names=np.array(self.angle_names, dtype=str),
+            norm_landmarks=self.norm_landmarks,
+            norm_valid=self.norm_valid,
+        )
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            return cls(
+                data['landmarks'], data['valid'], data['angles'],
+                data['angle_names'].tolist(), data['norm_landmarks'], data['norm_valid']
+            )
@@ -0,0 +1,25 @@
+# process_pool.py
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools_lock = threading.Lock()
+_pools = {}
+
+
+def get_process_pool(name, workers):
+    """
+    进程内共享的进程池（spawn 方式启动，避免 fork 后 MediaPipe 状态异常），按名字区分用途。
+    每个名字的池在首次调用时按 workers 创建，之后一直复用，不会因某次任务更大而重建或关闭，
+    其他请求线程拿到的池因此始终可用；workers 应取自固定配置（如 POSE_EXTRACTION_WORKERS），
+    超出池大小的任务排队执行。
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=max(int(workers), 1),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pools[name] = pool
+        return pool
@@ -0,0 +1,119 @@
+# reference_hls.py
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import cv2
+
+try:
+    from .ffmpeg_jobs import get_job_manager
+    from .hls_writer import HLS_ENCODE_ARGS, HLS_SEGMENT_SECONDS
+    from .renderer import AnnotatedSink, MultiSinkRenderer
+except ImportError:
+    from ffmpeg_jobs import get_job_manager
+    from hls_writer import HLS_ENCODE_ARGS, HLS_SEGMENT_SECONDS
+    from renderer import AnnotatedSink, MultiSinkRenderer
+
+logger = logging.getLogger(__name__)
+
+# 可直接封装进 MPEG-TS 片段的视频编码（cv2 读到的 FOURCC），其余编码需要重新编码。
+# 只收 H.264：HEVC 放进 .ts 片段多数播放器无法播放（HLS 规范要求 HEVC 使用 fMP4 片段），
+# 而 ffmpeg 封装时仍返回成功，不会触发重新编码
+COPYABLE_FOURCCS = {'avc1', 'h264', 'H264', 'x264', 'X264'}
+
+PLAIN = 'plain'
+ANNOTATED = 'annotated'
+
+_key_locks_guard = threading.Lock()
+_key_locks = {}
+
+
+def source_fourcc(video_path):
+    """视频流的 FOURCC（如 'avc1'），无法读取时返回空字符串"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        code = int(cap.get(cv2.CAP_PROP_FOURCC)) if cap.isOpened() else 0
+    finally:
+        cap.release()
+    return ''.join(chr((code >> (8 * k)) & 0xFF) for k in range(4)).strip('\x00 ') if code else ''
+
+
+def _key_lock(key):
+    with _key_locks_guard:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+class ReferenceHLSStore:
+    """
+    标准视频共享的 HLS 版本：plain（原视频）和 annotated（叠加骨架标注），
+    每个标准视频/配置（key，即姿态缓存键）只生成一次，保存在 {root_dir}/{key}/ 下，各会话直接引用。
+    先在临时目录生成，全部成功后整体重命名为最终目录，因此最终目录存在即表示两个版本都已完整生成。
+    """
+
+    def __init__(self, root_dir, url_prefix, job_manager=None):
+        self.root_dir = root_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self.job_manager = job_manager or get_job_manager()
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def urls(self, key):
+        return {name: f"{self.url_prefix}/{key}/{name}.m3u8" for name in (PLAIN, ANNOTATED)}
+
+    def get(self, key):
+        """已生成时返回 {'plain': url, 'annotated': url}，否则返回 None"""
+        return self.urls(key) if os.path.isdir(os.path.join(self.root_dir, key)) else None
+
+    def ensure(self, key, video_path, sequence):
+        """
+        返回标准视频的共享 HLS 地址，不存在时生成（同一进程内同一 key 只生成一次）。
+        :param sequence: 标准视频的姿态序列，用于绘制 annotated 版本
+        :return: {'plain': url, 'annotated': url}，生成失败时返回 None
+        """
+        with _key_lock(key):
+            existing = self.get(key)
+            if existing is not None:
+                return existing
+
+            work_dir = tempfile.mkdtemp(dir=self.root_dir, prefix=f'.{key}-')
+            try:
+                if not self._package_plain(video_path, work_dir):
+                    return None
+                annotated = AnnotatedSink(os.path.join(work_dir, f'{ANNOTATED}.m3u8'), sequence, color=(0, 255, 0))
+                MultiSinkRenderer(video_path, [annotated], job_manager=self.job_manager).render()
+                if not annotated.success:
+                    return None
+                try:
+                    os.rename(work_dir, os.path.join(self.root_dir, key))
+                except OSError:
+                    # 其他进程已先生成了同一版本
+                    logger.info(f"参考视频 HLS {key} 已由其他进程生成，保留已有版本")
+                else:
+                    logger.info(f"已生成参考视频共享 HLS: {key}")
+                return self.urls(key)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _package_plain(self, video_path, output_dir):
+        """原视频转为 HLS：编码允许时只做封装转换（-c copy），失败或编码不支持时重新编码"""
+        fourcc = source_fourcc(video_path)
+        attempts = [['-c', 'copy']] if fourcc in COPYABLE_FOURCCS else []
+        attempts.append(HLS_ENCODE_ARGS)
+        for codec_args in attempts:
+            command = [
+                'ffmpeg', '-y',
+                '-i', video_path,
+                *codec_args,
+                '-hls_time', str(HLS_SEGMENT_SECONDS),
+                '-hls_list_size', '0',
+                '-hls_segment_filename', os.path.join(output_dir, f'{PLAIN}_%03d.ts'),
+                '-f', 'hls',
+                os.path.join(output_dir, f'{PLAIN}.m3u8'),
+            ]
+            result = self.job_manager.submit(command, name=f"reference/{os.path.basename(output_dir)}/{PLAIN}").result()
+            if result['success']:
+                mode = '封装转换' if codec_args[0] == '-c' else '重新编码'
+                logger.info(f"参考视频 plain HLS 生成完成（{mode}，源编码 {fourcc or '未知'}），耗时 {result['wall_time']:.2f}s")
+                return True
+        return False
@@ -0,0 +1,136 @@
+# reference_ranking.py
+import logging
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+try:
+    from .action_comparator import ActionComparator
+    from .dtw_engine import DEFAULT_METHOD, band_limits
+    from .process_pool import get_process_pool
+except ImportError:
+    from action_comparator import ActionComparator
+    from dtw_engine import DEFAULT_METHOD, band_limits
+    from process_pool import get_process_pool
+
+logger = logging.getLogger(__name__)
+
+def _sliding_envelope(series, lo, hi):
+    """
+    series 在每个帧区间 [lo[k], hi[k]] 上的逐维最小值和最大值：用一次 minimum/maximum_filter1d
+    滑动窗口（宽度取最长区间）得到，取区间中点处的结果。窗口可能比区间略宽，包络只会变松，下界仍然成立。
+    :return: (lower, upper)，均为 (len(lo), D)
+    """
+    half = int(np.ceil((hi - lo).max() / 2))
+    lower = minimum_filter1d(series, 2 * half + 1, axis=0, mode='nearest')
+    upper = maximum_filter1d(series, 2 * half + 1, axis=0, mode='nearest')
+    centers = (lo + hi) // 2
+    return lower[centers], upper[centers]
+
+
+def _envelope_gaps(values, lower, upper):
+    """values 每一行到对应包络盒 [lower, upper] 的欧氏距离"""
+    gap = np.maximum(lower - values, 0.0) + np.maximum(values - upper, 0.0)
+    return np.sqrt((gap ** 2).sum(axis=1))
+
+
+def _side_bound(gaps, start, end):
+    """
+    一侧的下界：每帧至少贡献到包络盒的距离；路径必经 (0, 0) 和 (n-1, m-1)，
+    首末两帧（不同帧时）改用这两个格子的实际距离（LB_Kim）。
+    """
+    if len(gaps) < 2:
+        return float(gaps.sum())
+    return float(gaps[1:-1].sum() + start + end)
+
+
+def lb_keogh(std_features, pat_features, band=None, subsequence=False):
+    """
+    LB_Keogh 式下界：DTW 路径覆盖每个标准帧和每个患者帧（子序列模式下只保证覆盖标准帧），
+    每帧的匹配代价不小于它到对方可匹配帧包络盒的距离，因此两侧之和都是 DTW 距离的下界，取较大者。
+    包络按 dtw_engine 的 Sakoe-Chiba 带宽逐帧滑动计算，band 为 None 时取整段序列。
+    :return: float，不大于 dtw(std_features, pat_features, band=band, subsequence=subsequence) 的距离
+    """
+    std_features = np.asarray(std_features, dtype=np.float64)
+    pat_features = np.asarray(pat_features, dtype=np.float64)
+    n, m = len(std_features), len(pat_features)
+    if subsequence:
+        # 患者帧可任意截取、起止点不固定，只有标准侧的包络下界成立
+        return float(_envelope_gaps(std_features, pat_features.min(axis=0), pat_features.max(axis=0)).sum())
+
+    # 标准第 i 帧可匹配患者 [lo[i], hi[i]]；反过来患者第 j 帧可匹配的标准帧同样是连续区间
+    lo, hi = band_limits(n, m, band)
+    frames = np.arange(m)
+    pat_lo, pat_hi = np.searchsorted(hi, frames), np.searchsorted(lo, frames, side='right') - 1
+
+    start = float(np.linalg.norm(std_features[0] - pat_features[0]))
+    end = float(np.linalg.norm(std_features[-1] - pat_features[-1]))
+    std_gaps = _envelope_gaps(std_features, *_sliding_envelope(pat_features, lo, hi))
+    pat_gaps = _envelope_gaps(pat_features, *_sliding_envelope(std_features, pat_lo, pat_hi))
+    return max(_side_bound(std_gaps, start, end), _side_bound(pat_gaps, start, end))
+
+
+def _score_reference(task):
+    """进程池任务：对一个参考视频做完整 DTW 比较，只返回可序列化的汇总结果"""
+    comparator = ActionComparator(
+        task['std_sequence'], task['pat_sequence'],
+        dtw_method=task['dtw_method'], dtw_band=task['dtw_band'],
+        reference_features=task['reference_features'], subsequence=task['subsequence']
+    )
+    result = comparator.compare_sequences()
+    first, last = result['matched_range']
+    return {
+        'key': task['key'],
+        'dtw_distance': float(result['dtw_distance']),
+        'normalized_distance': float(result['dtw_distance']) / max(len(task['std_sequence']), last - first + 1),
+        'similarity_score': float(result['similarity_score'] * 100),
+        'matched_range': [first, last],
+    }
+
+
+def rank_references(candidates, workers=1, dtw_method=DEFAULT_METHOD, dtw_band=None, subsequence=False):
+    """
+    把同一段患者序列与多个参考序列比较，按归一化 DTW 距离（距离 / 较长序列长度）从小到大排序。
+    先按 lb_keogh 下界从小到大排列候选，下界已不小于当前最优距离的候选直接剪枝；
+    其余候选分发到进程池并行计算，最多 workers 个同时进行。
+    :param candidates: [{'key', 'std_sequence', 'pat_sequence', 'reference_features'}, ...]，
+                       pat_sequence 须已按该参考视频的配置计算角度和归一化坐标
+    :return: (ranked, pruned)：ranked 为 _score_reference 结果列表（按距离升序），pruned 为被剪枝的 key 列表
+    """
+    bounded = []
+    for candidate in candidates:
+        comparator = ActionComparator(candidate['std_sequence'], candidate['pat_sequence'],
+                                      reference_features=candidate['reference_features'])
+        std_features, pat_features = comparator.get_scaled_features()
+        normalizer = max(len(std_features), len(pat_features))
+        bound = lb_keogh(std_features, pat_features, band=dtw_band, subsequence=subsequence) / normalizer
+        bounded.append((bound, candidate))
+    bounded.sort(key=lambda item: item[0])
+
+    workers = max(int(workers), 1)
+    pool = get_process_pool('reference_ranking', workers) if workers > 1 and len(bounded) > 1 else None
+    ranked, pruned, pending = [], [], set()
+    best = np.inf
+
+    for position, (bound, candidate) in enumerate(bounded):
+        # 先等进行中的任务空出位置，这样剪枝时能用上最新的最优距离
+        while pending and len(pending) >= workers:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            ranked.extend(future.result() for future in done)
+            best = min([best] + [outcome['normalized_distance'] for outcome in ranked])
+        if bound >= best:
+            # 候选按下界升序排列，其后的候选同样不可能优于当前最优
+            pruned.extend(c['key'] for _, c in bounded[position:])
+            break
+        task = dict(candidate, dtw_method=dtw_method, dtw_band=dtw_band, subsequence=subsequence)
+        if pool is None:
+            ranked.append(_score_reference(task))
+            best = min(best, ranked[-1]['normalized_distance'])
+        else:
+            pending.add(pool.submit(_score_reference, task))
+
+    ranked.extend(future.result() for future in wait(pending).done)
+    ranked.sort(key=lambda item: item['normalized_distance'])
+    logger.info(f"Ranked {len(ranked)} references, pruned {len(pruned)} by lower bound")
+    return ranked, pruned
@@ -0,0 +1,284 @@
+# renderer.py
+import contextlib
+import logging
+import os
+import queue
+import threading
+
+import cv2
+
+try:
+    from .frame_reader import FrameReader
+    from .hls_writer import FFmpegHLSWriter
+    from .pose_sequence import PoseSequence
+    from .visualization import draw_bone
+except ImportError:
+    from frame_reader import FrameReader
+    from hls_writer import FFmpegHLSWriter
+    from pose_sequence import PoseSequence
+    from visualization import draw_bone
+
+logger = logging.getLogger(__name__)
+
+# 标注视频中绘制的骨架连接
+SKELETON_CONNECTIONS = [
+    (11, 13), (13, 15),  # 左臂
+    (12, 14), (14, 16),  # 右臂
+    (11, 23), (12, 24),  # 躯干
+    (23, 25), (24, 26),  # 左右髋
+    (25, 27), (26, 28),  # 左右腿
+]
+
+# 每个写入线程缓冲的帧数
+WRITER_QUEUE_SIZE = 16
+
+_END = object()
+
+
+class _BackgroundWriter:
+    """在独立线程中编码写入视频帧，多个输出的编码可以与解码、绘制并行进行"""
+
+    def __init__(self, output_path, fourcc, fps, size, queue_size=WRITER_QUEUE_SIZE):
+        self.output_path = output_path
+        self.writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='VideoWriter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is _END:
+                break
+            if self._error is None:
+                try:
+                    self.writer.write(frame)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(_END)
+        self._thread.join()
+        self.writer.release()
+        if self._error is not None:
+            raise self._error
+        return True
+
+
+class FrameSink:
+    """
+    渲染输出的基类。MultiSinkRenderer 每解码一帧，依次调用各输出的 consume(frame_idx, frame)；
+    frame 是该输出独占的副本，可以直接在上面绘制。
+    """
+
+    # 是否启动 ffmpeg 编码进程（需要占用 FFmpegJobManager 的并发名额）
+    uses_ffmpeg = False
+
+    def open(self, fps, size, timeout=None):
+        """:param timeout: ffmpeg 编码进程的超时（秒），None 表示不限制"""
+        pass
+
+    def consume(self, frame_idx, frame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @property
+    def done(self):
+        """不再需要后续帧时返回 True；所有输出都完成后渲染提前结束"""
+        return False
+
+
+class VideoSink(FrameSink):
+    """
+    绘制后写入视频文件的输出，max_frames 之后的帧不再写入。
+    output_path 以 .m3u8 结尾时帧直接通过管道交给 ffmpeg 切片为 HLS（FFmpegHLSWriter），
+    否则用 cv2.VideoWriter 按 fourcc 写入视频文件。close() 后 success 表示输出是否成功生成，
+    wall_time 为 ffmpeg 编码进程的运行耗时（cv2.VideoWriter 输出为 None）。
+    """
+
+    def __init__(self, output_path, fourcc='mp4v', max_frames=None):
+        self.output_path = output_path
+        self.fourcc = fourcc
+        self.max_frames = max_frames
+        self.frames_written = 0
+        self.success = False
+        self.wall_time = None
+        self._writer = None
+
+    @property
+    def uses_ffmpeg(self):
+        return self.output_path.endswith('.m3u8')
+
+    def open(self, fps, size, timeout=None):
+        if self.uses_ffmpeg:
+            output_dir, filename = os.path.split(self.output_path)
+            self._writer = FFmpegHLSWriter(output_dir, os.path.splitext(filename)[0], fps, size, timeout=timeout)
+        else:
+            self._writer = _BackgroundWriter(self.output_path, self.fourcc, fps, size)
+
+    def consume(self, frame_idx, frame):
+        if self.done:
+            return
+        self.draw(frame_idx, frame)
+        self._writer.write(frame)
+        self.frames_written += 1
+
+    def draw(self, frame_idx, frame):
+        raise NotImplementedError
+
+    def close(self):
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            self.success = writer.close()
+            self.wall_time = getattr(writer, 'wall_time', None)
+
+    @property
+    def done(self):
+        return self.max_frames is not None and self.frames_written >= self.max_frames
+
+
+class AnnotatedSink(VideoSink):
+    """关键点 + 骨架标注视频；提供 frame_scores 时在左上角显示该帧得分（无得分的帧显示 0）"""
+
+    def __init__(self, output_path, sequence, frame_scores=None, color=(0, 255, 0), fourcc='mp4v'):
+        super().__init__(output_path, fourcc)
+        self.sequence = PoseSequence.from_frames(sequence)
+        self.color = color
+        self.scores_by_frame = dict(frame_scores) if frame_scores is not None else None
+
+    def draw(self, frame_idx, frame):
+        if frame_idx >= len(self.sequence):
+            return
+        if self.sequence.valid[frame_idx]:
+            points = self.sequence.landmarks[frame_idx].tolist()
+            for x, y in points:
+                cv2.circle(frame, (x, y), 5, self.color, -1)
+            for start_idx, end_idx in SKELETON_CONNECTIONS:
+                cv2.line(frame, tuple(points[start_idx]), tuple(points[end_idx]), self.color, 2)
+        if self.scores_by_frame is not None:
+            score = self.scores_by_frame.get(frame_idx, 0)
+            cv2.putText(frame, f"Score: {score:.1f}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
+
+class OverlapSink(VideoSink):
+    """
+    患者骨架与对齐后的标准骨架叠加视频：标准骨架按 config.NORMALIZATION_JOINTS[0] 锚点平移到患者位置，
+    骨架取 config.KEY_ANGLES。只输出到患者序列最后一帧。
+    """
+
+    def __init__(self, output_path, std_sequence, pat_sequence, dtw_result, config, fourcc='XVID'):
+        self.std = PoseSequence.from_frames(std_sequence)
+        self.pat = PoseSequence.from_frames(pat_sequence)
+        super().__init__(output_path, fourcc, max_frames=len(self.pat))
+        self.anchor_id = config.NORMALIZATION_JOINTS[0]
+        self.bones = [[(j1, j2), (j2, j3)] for j1, j2, j3 in config.KEY_ANGLES.values()]
+
+        # 患者帧 -> 标准帧；子序列对齐时路径只覆盖匹配段，段外的空闲帧沿用首/末匹配帧的映射
+        pat_to_std = {pat_idx: std_idx for std_idx, pat_idx in dtw_result['alignment_path']}
+        first_pat, last_pat = dtw_result.get('matched_range', (0, len(self.pat) - 1))
+        self.std_index = [min(pat_to_std.get(min(max(t, first_pat), last_pat), 0), len(self.std) - 1)
+                          for t in range(len(self.pat))]
+
+    def draw(self, frame_idx, frame):
+        std_idx = self.std_index[frame_idx]
+        if not (self.pat.valid[frame_idx] and self.std.valid[std_idx]):
+            return
+        pat_landmarks = self.pat.landmarks[frame_idx]
+        translation = pat_landmarks[self.anchor_id] - self.std.landmarks[std_idx, self.anchor_id]
+        std_landmarks = self.std.landmarks[std_idx] + translation
+        for bone in self.bones:
+            draw_bone(frame, pat_landmarks, bone, color=(255, 0, 0))  # 患者：蓝色
+            draw_bone(frame, std_landmarks, bone, color=(0, 255, 0))  # 标准：绿色
+
+
+class JpegCaptureSink(FrameSink):
+    """
+    把指定帧保存为 JPEG（按帧序编号 frame_1.jpg、frame_2.jpg ...）。
+    overlay 为另一个 VideoSink 时，保存的是叠加了该输出绘制内容的画面。
+    """
+
+    def __init__(self, output_dir, frame_indices, overlay=None, prefix='frame'):
+        self.output_dir = output_dir
+        self.frame_indices = sorted(set(int(i) for i in frame_indices))
+        self.overlay = overlay
+        self.prefix = prefix
+        self.saved = []
+
+    def consume(self, frame_idx, frame):
+        if frame_idx not in self.frame_indices:
+            return
+        if self.overlay is not None:
+            self.overlay.draw(frame_idx, frame)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{self.prefix}_{len(self.saved) + 1}.jpg")
+        cv2.imwrite(path, frame)
+        self.saved.append(path)
+
+    @property
+    def done(self):
+        return len(self.saved) >= len(self.frame_indices)
+
+
+class MultiSinkRenderer:
+    """
+    单次解码、多路输出：视频只解码一次，每帧分发给所有输出（标注视频、重叠视频、低分帧截图等），
+    各视频输出使用自己的写入线程编码。所有输出都完成后提前停止解码。
+    提供 job_manager 时，渲染期间为所有 ffmpeg 输出一次性占用任务管理器的并发名额，并按其超时限制编码进程。
+    """
+
+    def __init__(self, video_path, sinks, queue_size=None, job_manager=None):
+        self.video_path = video_path
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.job_manager = job_manager
+
+    def render(self):
+        """:return: 解码的帧数"""
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise IOError(f"无法打开视频 {self.video_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+        frame_idx = 0
+        opened = []
+        ffmpeg_outputs = sum(1 for sink in self.sinks if sink.uses_ffmpeg)
+        if self.job_manager is not None and ffmpeg_outputs:
+            # 同一次渲染的编码进程必须同时运行，名额一次性占用，避免多个渲染各占一部分而互相等待
+            slots, timeout = self.job_manager.reserve(ffmpeg_outputs), self.job_manager.default_timeout
+        else:
+            slots, timeout = contextlib.nullcontext(), None
+        with slots:
+            try:
+                for sink in self.sinks:
+                    sink.open(fps, size, timeout=timeout)
+                    opened.append(sink)
+                with FrameReader(cap, queue_size=self.queue_size) as reader:
+                    for frame, _ in reader:
+                        active = [sink for sink in self.sinks if not sink.done]
+                        if not active:
+                            break
+                        # 最后一个输出直接使用解码得到的帧，其余输出各自拿一份副本
+                        for k, sink in enumerate(active):
+                            sink.consume(frame_idx, frame if k == len(active) - 1 else frame.copy())
+                        frame_idx += 1
+            finally:
+                cap.release()
+                errors = []
+                for sink in opened:
+                    try:
+                        sink.close()
+                    except Exception as e:
+                        errors.append(e)
+                if errors:
+                    raise errors[0]
+        logger.info(f"Rendered {frame_idx} frames of {self.video_path} to {len(self.sinks)} outputs")
+        return frame_idx
@@ -0,0 +1,160 @@
+# sequence_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import zipfile
+
+import numpy as np
+
+try:
+    from .pose_sequence import PoseSequence
+except ImportError:
+    from pose_sequence import PoseSequence
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件格式版本，序列结构变化时递增即可让旧缓存全部失效
+CACHE_FORMAT_VERSION = 2
+# 缓存文件名：{numeric_id}_{24 位十六进制摘要}.npz，特征缓存为 .features.npz
+_ENTRY_NAME = re.compile(r'^(?P<numeric_id>.+)_[0-9a-f]{24}(\.features)?\.(npz|json)$')
+
+_digest_lock = threading.Lock()
+_digest_memo = {}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    计算视频文件内容的 SHA-256 摘要。
+    同一进程内按 (路径, 大小, 修改时间) 记忆结果，避免每次请求都重新读取整个文件。
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digest_memo.get(memo_key)
+    if cached is not None:
+        return cached
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def config_digest(config):
+    """
+    根据配置内容（KEY_ANGLES、NORMALIZATION_JOINTS、SKIP_FRAMES）生成版本摘要，
+    配置被修改后摘要随之变化，对应的缓存自然失效。
+    """
+    payload = {
+        'key_angles': getattr(config, 'KEY_ANGLES', {}),
+        'normalization_joints': getattr(config, 'NORMALIZATION_JOINTS', []),
+        'skip_frames': getattr(config, 'SKIP_FRAMES', 0),
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class PoseSequenceCache:
+    """
+    标准视频姿态序列及其标准化特征的磁盘缓存（内容寻址）。
+    缓存键由 视频文件摘要 + numeric_id + 配置版本 + 检测器参数 共同决定，
+    任意一项变化都会得到新的键，因此不需要显式失效。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, video_path, config, detector_settings):
+        numeric_id = getattr(config, 'NUMERIC_ID', None) or 'default'
+        parts = {
+            'format': CACHE_FORMAT_VERSION,
+            'video': file_digest(video_path),
+            'numeric_id': numeric_id,
+            'config': config_digest(config),
+            'detector': detector_settings,
+        }
+        raw = json.dumps(parts, sort_keys=True)
+        return f"{numeric_id}_{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _features_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.features.npz")
+
+    def get(self, key):
+        """读取缓存的 PoseSequence，不存在时返回 None；损坏的条目被删除并返回 None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return PoseSequence.load(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Discarding unreadable pose cache entry {path}: {str(e)}")
+            self._discard(path)
+            return None
+
+    def put(self, key, sequence):
+        """原子地写入缓存：先写临时文件，再 os.replace 到目标位置"""
+        sequence = PoseSequence.from_frames(sequence)
+        self._atomic_write(self._path(key), sequence.save)
+
+    def get_features(self, key):
+        """
+        读取与序列同键保存的标准化统计量和缩放后的标准特征矩阵，
+        返回 {'mean', 'var', 'scale', 'n_samples_seen', 'scaled'}，不存在时返回 None，损坏的条目被删除并返回 None
+        """
+        path = self._features_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return {name: data[name] for name in ('mean', 'var', 'scale', 'n_samples_seen', 'scaled')}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Discarding unreadable feature cache entry {path}: {str(e)}")
+            self._discard(path)
+            return None
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def put_features(self, key, features):
+        """原子地写入 get_features 返回格式的特征缓存"""
+        self._atomic_write(self._features_path(key), lambda f: np.savez(f, **features))
+
+    def _atomic_write(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self, numeric_id=None):
+        """
+        删除缓存条目；指定 numeric_id 时只删除该标准视频的条目，返回删除数量。
+        按完整的键格式匹配：numeric_id 本身含下划线，'01' 不会误删 '01_11' 的条目。
+        """
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            match = _ENTRY_NAME.match(name)
+            if match and (not numeric_id or match.group('numeric_id') == numeric_id):
+                os.remove(os.path.join(self.cache_dir, name))
+                removed += 1
+        return removed
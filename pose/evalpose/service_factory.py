@@ -80,7 +80,7 @@ class ModernPoseAnalyzerService(VideoProcessingService):
                 logger.info(f"Updating analyzer configuration to {standard_numeric_id}")
                 self.modern_analyzer = ModernPoseAnalyzer(numeric_id=standard_numeric_id)
                 
-            # Process videos with enhanced analysis
+            # Stage 1: pose extraction + DTW, exactly once per session
             modern_result = self.modern_analyzer.process_videos(
                 session_id, 
                 standard_video_path, 
@@ -92,21 +92,27 @@ class ModernPoseAnalyzerService(VideoProcessingService):
             if not modern_result['dtw_success']:
                 raise Exception(f"Modern pose analysis failed: {modern_result.get('error', 'Unknown error')}")
             
-            # Update session with analysis results
+            # Stage 2: persist the session once
             self._update_session_with_results(session_id, modern_result)
             
-            # Create visualization videos
-            visualization_result = self.modern_analyzer.generate_visualization_videos(
+            # Stage 3: render annotated/overlap videos and HLS from the stage 1 results
+            result = {
+                'dtw_success': modern_result['dtw_success'],
+                'frame_scores': modern_result['frame_scores'],
+                'matched_range': modern_result['matched_range'],
+                'active_range': modern_result['active_range'],
+                'repetitions': modern_result['repetitions']
+            }
+            result.update(self._render_outputs(
                 session_id,
+                standard_video_path,
+                exercise_video_path,
                 modern_result['std_sequence'],
                 modern_result['exe_sequence'],
                 modern_result['dtw_result'],
-                standard_numeric_id=standard_numeric_id,
+                self.modern_analyzer.analyzer,
                 config=config
-            )
-            
-            # Continue with HLS conversion using parent class
-            result = super().process_videos(session_id, standard_video_path, exercise_video_path,config=config)
+            ))
             
             # Add enhanced metrics to result
             result['advanced_metrics'] = modern_result.get('additional_metrics', {})
@@ -139,8 +145,8 @@ class ModernPoseAnalyzerService(VideoProcessingService):
             
             # Create frame data object
             frame_data = {
-                'std_frame_data': analysis_result['std_sequence'], 
-                'exercise_frame_data': analysis_result['exe_sequence'],
+                'std_frame_data': analysis_result['std_sequence'].to_frames(),
+                'exercise_frame_data': analysis_result['exe_sequence'].to_frames(),
                 'advanced_metrics': advanced_metrics,  # Use consistent key name
                 'additional_metrics': advanced_metrics  # Keep both for backward compatibility
             }
@@ -4,10 +4,18 @@ import numpy as np
 import logging
 from .models import EvalSession, VideoFile
 import os
-import subprocess
 from .modern_pose_analyzer import VideoAnalyzer, ActionComparator
 from django.conf import settings
 from concurrent.futures import ThreadPoolExecutor
+from .pose_analyze.frame_reader import FrameReader
+from .pose_analyze.config import Config as DefaultConfig
+from .pose_analyze.evaluation import detect_action_stages, detect_active_range, offset_patient_indices, select_lowest_score_frames
+from .pose_analyze.ffmpeg_jobs import get_job_manager
+from .pose_analyze.hls_writer import ffmpeg_available
+from .pose_analyze.reference_hls import ReferenceHLSStore
+from .pose_analyze.renderer import AnnotatedSink, JpegCaptureSink, MultiSinkRenderer, OverlapSink
+from .pose_analyze.sequence_cache import PoseSequenceCache
+from .pose_analyze.pose_pool import get_pose_pool
 from .exceptions import ApiErrorHandler, FullBodyNotVisibleError, VideoLengthMismatchError
 
 logger = logging.getLogger(__name__)
@@ -16,18 +24,35 @@ mp_drawing_styles = mp.solutions.drawing_styles
 mp_pose = mp.solutions.pose
 
 class PoseProcessor:
+    POSE_SETTINGS = {
+        'static_image_mode': False,
+        'smooth_landmarks': True,
+        'min_detection_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+    }
+
     def __init__(self):
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        # Pose 实例从进程级实例池借出，首次使用时获取
+        self.pose = None
+
+    def _acquire_pose(self):
+        if self.pose is None:
+            self.pose = get_pose_pool().acquire(self.POSE_SETTINGS)
+        return self.pose
+
+    def close(self):
+        """把持有的 Pose 归还实例池"""
+        if self.pose is not None:
+            get_pose_pool().release(self.POSE_SETTINGS, self.pose)
+            self.pose = None
         
-    def process_frame(self, frame, draw_landmarks=True):
-        """处理单帧并返回处理后的帧和姿态结果"""
+    def process_frame(self, frame, draw_landmarks=True, frame_rgb=None):
+        """处理单帧并返回处理后的帧和姿态结果；frame_rgb 为预先转换好的 RGB 帧，提供时跳过颜色转换"""
         frame.flags.writeable = False
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pose_results = self.pose.process(frame_rgb)
+        if frame_rgb is None:
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        pose_results = self._acquire_pose().process(frame_rgb)
         frame.flags.writeable = True
         
         if draw_landmarks and pose_results.pose_landmarks:
@@ -38,6 +63,17 @@ class PoseProcessor:
             )
             
         return frame, pose_results
+
+    def process_video(self, video_path, draw_landmarks=True):
+        """逐帧处理视频：解码和颜色转换在后台线程中进行，依次产出 (处理后的帧, 姿态结果)"""
+        # 每段视频使用一个新重置的 Pose
+        self.close()
+        try:
+            with FrameReader(video_path, queue_size=settings.POSE_DECODE_QUEUE_SIZE, convert_rgb=True) as reader:
+                for frame, frame_rgb in reader:
+                    yield self.process_frame(frame, draw_landmarks, frame_rgb=frame_rgb)
+        finally:
+            self.close()
         
     def draw_landmarks(self, image, landmark_list, connections=None,
                       color=(0, 255, 0), thickness=2):
@@ -85,18 +121,42 @@ class VideoProcessingService:
             logger.info(f"开始处理视频: session_id={session_id}")
             
             # 1. DTW 分析
-            if config:
-                analyzer = VideoAnalyzer(config=config)
-            else:
-                analyzer = VideoAnalyzer()
+            analyzer = VideoAnalyzer(
+                config=config or None,
+                workers=settings.POSE_EXTRACTION_WORKERS,
+                queue_size=settings.POSE_DECODE_QUEUE_SIZE,
+                roi=settings.POSE_ROI_MODE,
+                roi_max_side=settings.POSE_ROI_MAX_SIDE
+            )
             
+            # 全身可见性预检，提前拒绝非全身视频
+            if settings.POSE_VISIBILITY_PROBE:
+                probe = analyzer.probe_visibility(exercise_video_path, samples=settings.POSE_VISIBILITY_PROBE_SAMPLES)
+                if not probe['passed']:
+                    logger.warning(f"全身可见性预检未通过: {probe}")
+                    raise FullBodyNotVisibleError()
+
             # 获取所有帧数据
-            std_sequence = analyzer.process_video(standard_video_path, skip_frames=2) 
-            exe_sequence = analyzer.process_video(exercise_video_path, skip_frames=2)
+            std_sequence = analyzer.process_video(standard_video_path) 
+            exe_sequence = analyzer.process_video(exercise_video_path)
+
+            # 裁剪患者视频首尾静止段，只对活动段做对齐
+            if settings.POSE_IDLE_TRIM:
+                active_start, active_end = detect_active_range(exe_sequence)
+            else:
+                active_start, active_end = 0, len(exe_sequence) - 1
+            result['active_range'] = [active_start, active_end]
 
             # 2. 比较序列
-            comparator = ActionComparator(std_sequence, exe_sequence)
-            dtw_result = comparator.compare_sequences()
+            comparator = ActionComparator(std_sequence, exe_sequence[active_start:active_end + 1],
+                                          dtw_method=settings.POSE_DTW_METHOD,
+                                          dtw_band=settings.POSE_DTW_BAND,
+                                          subsequence=settings.POSE_DTW_SUBSEQUENCE)
+            if getattr(config, 'REPETITION_ALIGNMENT', False):
+                dtw_result = comparator.compare_repetitions()
+            else:
+                dtw_result = comparator.compare_sequences()
+            dtw_result = offset_patient_indices(dtw_result, active_start)
             result['dtw_success'] = True
             
             logger.info(f"DTW分析完成: {dtw_result['similarity_score']}")
@@ -105,66 +165,19 @@ class VideoProcessingService:
             session = EvalSession.objects.get(pk=session_id)
             session.dtw_distance = float(dtw_result['dtw_distance'])
             session.similarity_score = float(dtw_result['similarity_score'] * 100)
-            session.frame_data = {'std_frame_data': std_sequence, 'exercise_frame_data': exe_sequence}
+            session.frame_data = {'std_frame_data': std_sequence.to_frames(), 'exercise_frame_data': exe_sequence.to_frames()}
             session.frame_scores = {str(idx): float(score) for idx, score in dtw_result['frame_scores']}
             result['frame_scores'] = session.frame_scores
+            result['matched_range'] = list(dtw_result['matched_range'])
+            result['repetitions'] = dtw_result.get('repetitions', [])
             session.status = 'completed'
             session.save()
 
             # 4. 生成标注后的视频并转换为HLS
-            output_dir = os.path.join(settings.MEDIA_ROOT, 'hls', str(session_id))
-            os.makedirs(output_dir, exist_ok=True)
-            
-            std_output_path = os.path.join(output_dir, 'standard_annotated.mp4')
-            ex_output_path = os.path.join(output_dir, 'exercise_annotated.mp4')
-            overlap_output_path = os.path.join(output_dir, 'overlap_annotated.mp4')
-
-
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                if config:
-                    futures = [
-                        executor.submit(self._process_video_with_annotations, standard_video_path, std_output_path, std_sequence, color=(0, 255, 0), is_standard=True),
-                        executor.submit(self._process_video_with_annotations, exercise_video_path, ex_output_path, exe_sequence, frame_scores=dtw_result['frame_scores'], color=(0, 0, 255)),
-                        executor.submit(analyzer._process_overlap_video, std_sequence, exe_sequence, dtw_result, overlap_output_path, exercise_video_path, config=config)
-                    ]
-                else:
-                    futures = [
-                        executor.submit(self._process_video_with_annotations, standard_video_path, std_output_path, std_sequence, color=(0, 255, 0), is_standard=True),
-                        executor.submit(self._process_video_with_annotations, exercise_video_path, ex_output_path, exe_sequence, frame_scores=dtw_result['frame_scores'], color=(0, 0, 255)),
-                        executor.submit(analyzer._process_overlap_video, std_sequence, exe_sequence, dtw_result, overlap_output_path, exercise_video_path)
-                    ]
-                for future in futures:
-                    future.result()
-            # 处理标准视频
-            # self._process_video_with_annotations(
-            #     standard_video_path, 
-            #     std_output_path, 
-            #     std_sequence, 
-            #     color=(0, 255, 0),
-            #     is_standard=True
-            # )
-            # # 处理练习视频
-            # self._process_video_with_annotations(
-            #     exercise_video_path, 
-            #     ex_output_path, 
-            #     exe_sequence, 
-            #     frame_scores=dtw_result['frame_scores'],
-            #     color=(0, 0, 255)
-            # )
-            
-            # analyzer._process_overlap_video(
-            #     std_sequence,
-            #     exe_sequence,
-            #     dtw_result,
-            #     overlap_output_path,
-            #     exercise_video_path               
-            # )
-
-            # 生成HLS流
-            result['overlap_hls'] = self._generate_hls_stream(session_id, overlap_output_path, 'overlap')
-            result['standard_hls'] = self._generate_hls_stream(session_id, std_output_path, 'standard')
-            result['exercise_hls'] = self._generate_hls_stream(session_id, ex_output_path, 'exercise')
-            result['hls_success'] = result['standard_hls'] and result['exercise_hls'] and  result['overlap_hls']
+            result.update(self._render_outputs(
+                session_id, standard_video_path, exercise_video_path,
+                std_sequence, exe_sequence, dtw_result, analyzer, config=config
+            ))
             
             logger.info(f"视频处理完成，HLS转换状态: {result}")
             return result
@@ -180,148 +193,137 @@ class VideoProcessingService:
                 raise VideoLengthMismatchError() from e
             raise
 
+    def _render_outputs(self, session_id, standard_video_path, exercise_video_path,
+                        std_sequence, exe_sequence, dtw_result, analyzer, config=None):
+        """
+        渲染阶段：基于已完成的姿态提取与 DTW 结果生成标注视频、重叠视频并转换为 HLS。
+        该阶段不会重新提取姿态或重新对齐，返回各 HLS 输出的状态。
+        POSE_HLS_DIRECT 开启且能找到 ffmpeg 时，渲染的帧直接交给 ffmpeg 切片，不生成中间 mp4。
+        配置有 numeric_id 时标准视频使用共享的 HLS 版本（每个标准视频/配置只生成一次），
+        返回的 standard_hls_url / standard_plain_hls_url 指向共享路径，不再按会话重新渲染。
+        """
+        output_dir = os.path.join(settings.MEDIA_ROOT, 'hls', str(session_id))
+        os.makedirs(output_dir, exist_ok=True)
+
+        direct_hls = settings.POSE_HLS_DIRECT and ffmpeg_available()
+        if direct_hls:
+            std_output_path = os.path.join(output_dir, 'standard.m3u8')
+            ex_output_path = os.path.join(output_dir, 'exercise.m3u8')
+            overlap_output_path = os.path.join(output_dir, 'overlap.m3u8')
+        else:
+            std_output_path = os.path.join(output_dir, 'standard_annotated.mp4')
+            ex_output_path = os.path.join(output_dir, 'exercise_annotated.mp4')
+            overlap_output_path = os.path.join(output_dir, 'overlap_annotated.mp4')
+
+        # 患者视频只解码一次，同时输出标注视频、重叠视频和最低得分帧截图
+        overlap = OverlapSink(overlap_output_path, std_sequence, exe_sequence, dtw_result, config or analyzer.config or DefaultConfig)
+        lowest_score_frames = select_lowest_score_frames(dtw_result, detect_action_stages(exe_sequence))
+        exercise = AnnotatedSink(ex_output_path, exe_sequence, frame_scores=dtw_result['frame_scores'], color=(0, 0, 255))
+        standard = AnnotatedSink(std_output_path, std_sequence, color=(0, 255, 0))
+        exercise_sinks = [
+            exercise,
+            overlap,
+            JpegCaptureSink(os.path.join(output_dir, 'low_score_frames'), [f[0] for f in lowest_score_frames], overlay=overlap),
+        ]
+        reference_key = self._reference_hls_key(standard_video_path, config, analyzer)
+        job_manager = self._job_manager()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if reference_key is not None:
+                standard_future = executor.submit(self._reference_hls_store().ensure,
+                                                  reference_key, standard_video_path, std_sequence)
+            else:
+                standard_future = executor.submit(
+                    MultiSinkRenderer(standard_video_path, [standard], settings.POSE_DECODE_QUEUE_SIZE, job_manager).render)
+            exercise_future = executor.submit(
+                MultiSinkRenderer(exercise_video_path, exercise_sinks, settings.POSE_DECODE_QUEUE_SIZE, job_manager).render)
+            exercise_future.result()
+            reference_urls = standard_future.result() if reference_key is not None else None
+
+        shared_standard = reference_urls is not None
+        if reference_key is not None and not shared_standard:
+            # 共享版本生成失败时退回按会话渲染
+            logger.warning(f"标准视频共享 HLS 生成失败，改为按会话渲染: {reference_key}")
+            MultiSinkRenderer(standard_video_path, [standard], settings.POSE_DECODE_QUEUE_SIZE, job_manager).render()
+
+        # 生成HLS流
+        if direct_hls:
+            sinks = {'overlap': overlap, 'exercise': exercise}
+            if not shared_standard:
+                sinks['standard'] = standard
+            status = {f"{video_type}_hls": sink.success for video_type, sink in sinks.items()}
+            status['hls_wall_time'] = {video_type: sink.wall_time for video_type, sink in sinks.items()}
+        else:
+            videos = {'overlap': overlap_output_path, 'exercise': ex_output_path}
+            if not shared_standard:
+                videos['standard'] = std_output_path
+            jobs = self._generate_hls_streams(session_id, videos)
+            status = {f"{video_type}_hls": job['success'] for video_type, job in jobs.items()}
+            status['hls_wall_time'] = {video_type: job['wall_time'] for video_type, job in jobs.items()}
+        if shared_standard:
+            status['standard_hls'] = True
+            status['standard_hls_url'] = reference_urls['annotated']
+            status['standard_plain_hls_url'] = reference_urls['plain']
+        status['hls_success'] = status['standard_hls'] and status['exercise_hls'] and status['overlap_hls']
+        return status
+
+    def _reference_hls_key(self, standard_video_path, config, analyzer):
+        """标准视频共享 HLS 的键（与姿态缓存键相同）；未启用、没有 ffmpeg 或配置没有 numeric_id 时返回 None"""
+        config = config or analyzer.config
+        if not (settings.POSE_SHARED_REFERENCE_HLS and getattr(config, 'NUMERIC_ID', None) and ffmpeg_available()):
+            return None
+        return PoseSequenceCache(settings.POSE_CACHE_DIR).make_key(standard_video_path, config, analyzer.detector_settings())
+
+    def _reference_hls_store(self):
+        return ReferenceHLSStore(os.path.join(settings.MEDIA_ROOT, 'hls', 'reference'),
+                                 f"{settings.MEDIA_URL}hls/reference",
+                                 self._job_manager())
+
+    def _job_manager(self):
+        """进程内共享的 ffmpeg 任务管理器，并发上限和超时取自配置"""
+        return get_job_manager(settings.POSE_FFMPEG_MAX_JOBS, settings.POSE_FFMPEG_TIMEOUT)
+
     def _process_video_with_annotations(self, input_path, output_path, sequence_data, 
                                        frame_scores=None, color=(0, 255, 0), is_standard=False):
-        """处理视频，添加关键点和得分标注"""
+        """处理视频，添加关键点和得分标注（单路输出的 MultiSinkRenderer）"""
         try:
-            cap = cv2.VideoCapture(input_path)
-            if not cap.isOpened():
-                raise ValueError(f"无法打开视频: {input_path}")
-
-            # 获取视频属性
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            # 创建视频写入器
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-            
-            frame_idx = 0
-            seq_idx = 0  # 序列数据索引
-            
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                    
-                if seq_idx < len(sequence_data):
-                    # 绘制关键点
-                    landmarks = sequence_data[seq_idx].get('landmarks', [])
-                    for lm in landmarks:
-                        if len(lm) >= 3:
-                            cv2.circle(frame, (lm[1], lm[2]), 5, color, -1)
-                    
-                    # 绘制骨架连接
-                    self._draw_skeleton(frame, landmarks, color)
-                    
-                    # 如果有得分数据，显示得分
-                    if frame_scores is not None and not is_standard:
-                        score = 0
-                        if seq_idx < len(frame_scores):
-                            score = frame_scores[seq_idx][1]  # (idx, score)
-                        
-                        cv2.putText(
-                            frame,
-                            f"Score: {score:.1f}",
-                            (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            1,
-                            (0, 255, 0),
-                            2
-                        )
-                    
-                    seq_idx += 1
-                
-                # 写入帧
-                out.write(frame)
-                frame_idx += 1
-                
-                # 记录进度
-                if frame_idx % 100 == 0:
-                    logger.info(f"处理视频进度: {frame_idx}/{total_frames} 帧")
-            
-            # 释放资源
-            cap.release()
-            out.release()
-            
+            sink = AnnotatedSink(output_path, sequence_data,
+                                 frame_scores=None if is_standard else frame_scores, color=color)
+            MultiSinkRenderer(input_path, [sink], settings.POSE_DECODE_QUEUE_SIZE, self._job_manager()).render()
         except Exception as e:
             logger.error(f"处理视频添加标注失败: {str(e)}", exc_info=True)
             raise
 
-    def _draw_skeleton(self, frame, landmarks, color):
-        """绘制骨架连接线"""
-        # 定义需要连接的关键点对
-        connections = [
-            (11, 13), (13, 15),  # 左臂
-            (12, 14), (14, 16),  # 右臂
-            (11, 23), (12, 24),  # 躯干
-            (23, 25), (24, 26),  # 左右髋
-            (25, 27), (26, 28),  # 左右腿
+    def _hls_command(self, session_id, video_path, video_type='exercise'):
+        """把视频转换为 HLS 的 FFmpeg 命令"""
+        hls_output_path = os.path.join(settings.MEDIA_ROOT, 'hls', str(session_id))
+        os.makedirs(hls_output_path, exist_ok=True)
+
+        # 根据视频类型设置输出文件名
+        output_filename = f"{video_type}.m3u8"
+
+        return [
+            'ffmpeg',
+            '-i', video_path,
+            '-hls_time', '2',  # 每个片段的时长
+            '-hls_list_size', '0',  # 保留所有片段
+            '-hls_segment_filename', os.path.join(hls_output_path, f"{video_type}_%03d.ts"),  # 片段文件名格式
+            '-f', 'hls',
+            os.path.join(hls_output_path, output_filename)  # 输出播放列表
         ]
-        
-        try:
-            for start_idx, end_idx in connections:
-                start_point = None
-                end_point = None
-                
-                for lm in landmarks:
-                    if lm[0] == start_idx:
-                        start_point = (lm[1], lm[2])
-                    elif lm[0] == end_idx:
-                        end_point = (lm[1], lm[2])
-                
-                if start_point and end_point:
-                    cv2.line(frame, start_point, end_point, color, 2)
-        except Exception as e:
-            logger.error(f"绘制骨架失败: {str(e)}")
+
+    def _generate_hls_streams(self, session_id, videos):
+        """
+        并发生成多个 HLS 流，受全局 FFmpeg 并发上限和单任务超时约束。
+        :param videos: {video_type: video_path}
+        :return: {video_type: FFmpegJobManager.run 的结果}
+        """
+        jobs = {f"{session_id}/{video_type}": self._hls_command(session_id, video_path, video_type)
+                for video_type, video_path in videos.items()}
+        logger.info(f"开始生成HLS流: {list(jobs)}")
+        results = self._job_manager().run_all(jobs, timeout=settings.POSE_FFMPEG_TIMEOUT)
+        return {video_type: results[f"{session_id}/{video_type}"] for video_type in videos}
 
     def _generate_hls_stream(self, session_id, video_path, video_type='exercise'):
         """生成HLS流"""
-        try:
-            hls_output_path = os.path.join(settings.MEDIA_ROOT, 'hls', str(session_id))
-            os.makedirs(hls_output_path, exist_ok=True)
-
-            # 根据视频类型设置输出文件名
-            output_filename = f"{video_type}.m3u8"
-
-            # FFmpeg 命令
-            command = [
-                'ffmpeg',
-                '-i', video_path,
-                '-hls_time', '2',  # 每个片段的时长
-                '-hls_list_size', '0',  # 保留所有片段
-                '-hls_segment_filename', os.path.join(hls_output_path, f"{video_type}_%03d.ts"),  # 片段文件名格式
-                '-f', 'hls',
-                os.path.join(hls_output_path, output_filename)  # 输出播放列表
-            ]
-            logger.info(f"开始生成{video_type}视频的HLS流: {' '.join(command)}")
-            # 使用 Popen 来运行 FFmpeg，并等待完成
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # 实时获取输出
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    logger.debug(f"FFmpeg 输出: {output.strip()}")
-            
-            # 获取最终结果
-            stdout, stderr = process.communicate()
-            if process.returncode != 0:
-                logger.error(f"FFmpeg 错误: {stderr}")
-                return False
-            else:
-                logger.info(f"HLS 流处理完成: {hls_output_path}/{output_filename}")
-                return True
-           
-        except Exception as e:
-            logger.error(f"启动 HLS 流处理失败: {str(e)}")
+        return self._generate_hls_streams(session_id, {video_type: video_path})[video_type]['success']
 
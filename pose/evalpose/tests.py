@@ -1,3 +1,731 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
+
 from django.test import TestCase
+import cv2
+import numpy as np
+
+from evalpose.pose_analyze.action_comparator import ActionComparator
+from evalpose.pose_analyze.dtw_engine import accumulated_cost, band_mask, dtw
+from evalpose.pose_analyze.exercise_index import ExerciseIndex
+from evalpose.pose_analyze.ffmpeg_jobs import FFmpegJobManager
+from evalpose.pose_analyze.frame_reader import FrameReader
+from evalpose.pose_analyze.evaluation import detect_active_range, offset_patient_indices, segment_repetitions
+from evalpose.pose_analyze.joint_angles import compile_key_angles, compute_angles
+from evalpose.pose_analyze.normalization import l2_bbox_normalize, minmax_normalize
+from evalpose.pose_analyze.online_dtw import OnlineAligner
+from evalpose.pose_analyze.pose_detector import CHUNK_WARMUP_FRAMES, MIN_CHUNK_FRAMES, PoseDetector, VideoAnalyzer
+from evalpose.pose_analyze.pose_pool import _pool_key, get_pose_pool, warm_in_background
+from evalpose.pose_analyze.pose_sequence import NUM_LANDMARKS, PoseSequence
+from evalpose.pose_analyze.process_pool import get_process_pool
+from evalpose.pose_analyze.reference_hls import ReferenceHLSStore
+from evalpose.pose_analyze.reference_ranking import _score_reference, lb_keogh, rank_references
+from evalpose.pose_analyze.sequence_cache import PoseSequenceCache
+from evalpose.pose_analyze.renderer import FrameSink, JpegCaptureSink, MultiSinkRenderer, VideoSink
+
+
+def make_sequence(length=6, seed=0):
+    rng = np.random.default_rng(seed)
+    landmarks = rng.integers(0, 720, size=(length, NUM_LANDMARKS, 2))
+    valid = np.ones(length, dtype=bool)
+    valid[2] = False
+    angle_names, triplets = compile_key_angles({'left_elbow': [11, 13, 15], 'left_hip': [11, 23, 25]})
+    angles = compute_angles(landmarks, valid, triplets)
+    norm = rng.random((length, NUM_LANDMARKS, 2))
+    return PoseSequence(landmarks, valid, angles, angle_names, norm)
+
+
+class PoseSequenceTests(TestCase):
+
+    def test_frames_round_trip(self):
+        seq = make_sequence()
+        frames = seq.to_frames()
+        self.assertEqual(frames[2]['landmarks'], [])
+        self.assertEqual(frames[0]['landmarks'][11][0], 11)
+        self.assertEqual(PoseSequence.from_frames(frames).to_frames(), frames)
+
+    def test_slice_and_concatenate(self):
+        seq = make_sequence()
+        merged = PoseSequence.concatenate([seq[:3], seq[3:]])
+        self.assertEqual(len(merged), len(seq))
+        self.assertEqual(merged.to_frames(), seq.to_frames())
+
+
+class PoseSequenceCacheTests(TestCase):
+
+    class Config:
+        NUMERIC_ID = '01_1'
+        KEY_ANGLES = {'left_elbow': [11, 13, 15]}
+        NORMALIZATION_JOINTS = [11, 12, 23]
+        SKIP_FRAMES = 0
+
+    DETECTOR = {'model_complexity': 1, 'min_detection_confidence': 0.5}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = PoseSequenceCache(os.path.join(self.tmp.name, 'cache'))
+        self.video = write_video(os.path.join(self.tmp.name, 'std.avi'), 5)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def config(self, **overrides):
+        return type('Config', (self.Config,), overrides)
+
+    def test_sequence_round_trip(self):
+        seq = make_sequence(10)
+        key = self.cache.make_key(self.video, self.Config, self.DETECTOR)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, seq)
+        cached = self.cache.get(key)
+        self.assertEqual(cached.to_frames(), seq.to_frames())
+        self.assertEqual(cached.angle_names, seq.angle_names)
+
+    def test_features_round_trip(self):
+        features = ActionComparator.fit_reference_features(make_sequence(10)[3:])
+        key = self.cache.make_key(self.video, self.Config, self.DETECTOR)
+        self.assertIsNone(self.cache.get_features(key))
+        self.cache.put_features(key, features)
+        cached = self.cache.get_features(key)
+        self.assertEqual(set(cached), set(features))
+        for name, value in features.items():
+            np.testing.assert_array_equal(cached[name], value)
+
+    def test_key_tracks_config_and_detector_settings(self):
+        key = self.cache.make_key(self.video, self.Config, self.DETECTOR)
+        self.assertEqual(key, self.cache.make_key(self.video, self.Config, dict(self.DETECTOR)))
+        self.assertRegex(key, r'^01_1_[0-9a-f]{24}$')
+        variants = [
+            self.cache.make_key(self.video, self.config(KEY_ANGLES={'left_hip': [11, 23, 25]}), self.DETECTOR),
+            self.cache.make_key(self.video, self.config(SKIP_FRAMES=1), self.DETECTOR),
+            self.cache.make_key(self.video, self.Config, dict(self.DETECTOR, model_complexity=2)),
+        ]
+        self.assertEqual(len({key, *variants}), 4)
+
+    def test_corrupt_entries_are_discarded(self):
+        key = self.cache.make_key(self.video, self.Config, self.DETECTOR)
+        for path in (self.cache._path(key), self.cache._features_path(key)):
+            with open(path, 'wb') as f:
+                f.write(b'not a zip archive')
+        with self.assertLogs('evalpose', level='WARNING'):
+            self.assertIsNone(self.cache.get(key))
+            self.assertIsNone(self.cache.get_features(key))
+        self.assertFalse(os.path.exists(self.cache._path(key)))
+        self.assertFalse(os.path.exists(self.cache._features_path(key)))
+
+    def test_clear_only_removes_matching_id(self):
+        seq = make_sequence(10)[3:]
+        features = ActionComparator.fit_reference_features(seq)
+        keys = {}
+        for numeric_id in ('01_1', '01_11', '02_1'):
+            keys[numeric_id] = self.cache.make_key(self.video, self.config(NUMERIC_ID=numeric_id), self.DETECTOR)
+            self.cache.put(keys[numeric_id], seq)
+            self.cache.put_features(keys[numeric_id], features)
+        unrelated = os.path.join(self.cache.cache_dir, '01_1_notes.json')
+        open(unrelated, 'w').close()
+
+        self.assertEqual(self.cache.clear('01_1'), 2)
+        self.assertIsNone(self.cache.get(keys['01_1']))
+        self.assertIsNotNone(self.cache.get(keys['01_11']))
+        self.assertIsNotNone(self.cache.get_features(keys['01_11']))
+        self.assertIsNotNone(self.cache.get(keys['02_1']))
+        self.assertTrue(os.path.exists(unrelated))
+
+        self.assertEqual(self.cache.clear(), 4)
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)), ['01_1_notes.json'])
+
+
+class PosePoolTests(TestCase):
+
+    def test_background_warmup_fills_each_group(self):
+        tracking = PoseDetector().detector_settings()
+        probe = dict(tracking, static_image_mode=True)
+        warm_in_background([tracking, probe], count=1).join()
+        pool = get_pose_pool()
+        for settings in (tracking, probe):
+            self.assertGreaterEqual(len(pool._idle[_pool_key(settings)]), 1)
+
+
+class VideoAnalyzerTests(TestCase):
+
+    class Config:
+        KEY_ANGLES = {'left_elbow': [11, 13, 15]}
+        NORMALIZATION_JOINTS = [11, 12, 23]
+
+    def test_plan_chunks_covers_every_frame_once(self):
+        for total, workers in ((600, 4), (1000, 3), (250, 8), (121, 2)):
+            chunks = VideoAnalyzer._plan_chunks(total, workers)
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertIsNone(chunks[-1][1])
+            frames = []
+            for k, (start, stop) in enumerate(chunks):
+                stop = total if stop is None else stop
+                self.assertGreaterEqual(stop - start, MIN_CHUNK_FRAMES)
+                if k > 0:
+                    # 预热帧全部落在前一段内，只推理不输出
+                    self.assertGreaterEqual(start - CHUNK_WARMUP_FRAMES, chunks[k - 1][0])
+                frames.extend(range(start, stop))
+            self.assertEqual(frames, list(range(total)))
+
+    def test_plan_chunks_single_chunk_for_short_video(self):
+        self.assertEqual(VideoAnalyzer._plan_chunks(2 * MIN_CHUNK_FRAMES - 1, 8), [(0, None)])
+        self.assertEqual(VideoAnalyzer._plan_chunks(1000, 1), [(0, None)])
+        self.assertEqual(VideoAnalyzer._plan_chunks(0, 4), [(0, None)])
+
+    def test_chunk_layout_is_part_of_cache_settings(self):
+        serial = VideoAnalyzer(config=self.Config).detector_settings()
+        chunked = VideoAnalyzer(config=self.Config, workers=4).detector_settings()
+        self.assertNotIn('workers', serial)
+        self.assertEqual(chunked['workers'], 4)
+        self.assertEqual(chunked['chunk_warmup_frames'], CHUNK_WARMUP_FRAMES)
+        self.assertNotEqual(serial, chunked)
+
+    def test_shared_process_pool_is_never_rebuilt(self):
+        pool = get_process_pool('tests', 1)
+        # A larger request must not replace (and shut down) the pool other threads are using
+        self.assertIs(get_process_pool('tests', 4), pool)
+        self.assertEqual(pool.submit(abs, -3).result(), 3)
+
+    def test_fill_skipped_frames(self):
+        landmarks = np.zeros((7, NUM_LANDMARKS, 2), dtype=np.int32)
+        landmarks[0], landmarks[3] = 10, 40
+        valid = np.array([True, False, False, True, False, False, False])
+        inferred = np.array([True, False, False, True, False, False, True])
+        VideoAnalyzer.__new__(VideoAnalyzer)._fill_skipped_frames(landmarks, valid, inferred)
+        # 两端都检测到人体：线性插值
+        self.assertTrue((landmarks[1] == 20).all() and (landmarks[2] == 30).all())
+        # 末端推理帧未检测到人体：复制距离更近的推理帧
+        self.assertTrue((landmarks[4] == 40).all())
+        self.assertTrue((landmarks[5] == 0).all())
+        self.assertEqual(valid.tolist(), [True, True, True, True, True, False, False])
+
+    def test_next_roi_box(self):
+        points = np.array([[100, 100], [200, 300], [150, 200]])
+        # 边距为包围盒长边的 ROI_MARGIN（0.25 * 200）
+        box = VideoAnalyzer._next_roi_box(points, 1000, 1000)
+        self.assertEqual(box, (50, 50, 250, 350))
+        # 人体仍在内半边距以内时沿用当前区域
+        self.assertEqual(VideoAnalyzer._next_roi_box(points + 10, 1000, 1000, box), box)
+        # 移出区域或当前区域明显偏大时重新计算
+        self.assertEqual(VideoAnalyzer._next_roi_box(points + 60, 1000, 1000, box), (110, 110, 310, 410))
+        self.assertEqual(VideoAnalyzer._next_roi_box(points, 1000, 1000, (0, 0, 1000, 1000)), box)
+        # 裁剪到画面范围内
+        self.assertEqual(VideoAnalyzer._next_roi_box(points, 220, 320), (50, 50, 220, 320))
+        # 关键点集中在很小的范围内时放弃 ROI
+        self.assertIsNone(VideoAnalyzer._next_roi_box(np.array([[10, 10], [20, 25]]), 1000, 1000))
+
+
+def write_video(path, count, size=(64, 48)):
+    """Solid-colour frames whose brightness encodes the frame index (i * 10)"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, size)
+    for i in range(count):
+        writer.write(np.full((size[1], size[0], 3), i * 10, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def frame_index(frame):
+    return int(round(frame.mean() / 10))
+
+
+class RecordingSink(FrameSink):
+    """Records the frame index it sees, then paints the frame white"""
+
+    def __init__(self, fail_at=None):
+        self.seen = []
+        self.frames = []
+        self.fail_at = fail_at
+        self.closed = False
+
+    def consume(self, frame_idx, frame):
+        if frame_idx == self.fail_at:
+            raise RuntimeError('sink failed')
+        self.seen.append(frame_index(frame))
+        self.frames.append(frame)
+        frame[:] = 255
+
+    def close(self):
+        self.closed = True
+
+
+class EncoderSink(RecordingSink):
+    """Stands in for an ffmpeg-backed output, recording the timeout and slots held while rendering"""
+
+    uses_ffmpeg = True
+
+    def __init__(self, job_manager):
+        super().__init__()
+        self.job_manager = job_manager
+        self.timeout = None
+        self.slots_in_use = set()
+
+    def open(self, fps, size, timeout=None):
+        self.timeout = timeout
+
+    def consume(self, frame_idx, frame):
+        self.slots_in_use.add(self.job_manager._slots_in_use)
+        super().consume(frame_idx, frame)
+
+
+class PlainVideoSink(VideoSink):
+
+    def draw(self, frame_idx, frame):
+        pass
+
+
+class MultiSinkRendererTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.video = write_video(os.path.join(self.tmp.name, 'frames.avi'), 12)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_each_sink_gets_its_own_frame(self):
+        first, last = RecordingSink(), RecordingSink()
+        self.assertEqual(MultiSinkRenderer(self.video, [first, last]).render(), 12)
+        # 前一个输出在帧上的绘制不影响后一个输出
+        self.assertEqual(first.seen, list(range(12)))
+        self.assertEqual(last.seen, list(range(12)))
+        self.assertTrue(all(a is not b for a, b in zip(first.frames, last.frames)))
+
+    def test_jpeg_capture_stops_decoding_early(self):
+        capture = JpegCaptureSink(os.path.join(self.tmp.name, 'low'), [5, 2])
+        self.assertEqual(MultiSinkRenderer(self.video, [capture]).render(), 6)
+        self.assertEqual([os.path.basename(path) for path in capture.saved], ['frame_1.jpg', 'frame_2.jpg'])
+        self.assertEqual([frame_index(cv2.imread(path)) for path in capture.saved], [2, 5])
+
+    def test_sinks_are_closed_when_one_fails(self):
+        output = PlainVideoSink(os.path.join(self.tmp.name, 'out.avi'), fourcc='MJPG', max_frames=4)
+        failing = RecordingSink(fail_at=6)
+        with self.assertRaises(RuntimeError):
+            MultiSinkRenderer(self.video, [output, failing]).render()
+        self.assertTrue(failing.closed)
+        self.assertTrue(output.success)
+        self.assertEqual(output.frames_written, 4)
+        capture = cv2.VideoCapture(output.output_path)
+        self.assertEqual(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 4)
+        capture.release()
+
+    def test_encoders_hold_job_slots_while_rendering(self):
+        manager = FFmpegJobManager(max_jobs=3, default_timeout=42)
+        encoders = [EncoderSink(manager), EncoderSink(manager)]
+        MultiSinkRenderer(self.video, encoders + [RecordingSink()], job_manager=manager).render()
+        for encoder in encoders:
+            self.assertEqual(encoder.timeout, 42)
+            self.assertEqual(encoder.slots_in_use, {2})
+        self.assertEqual(manager._slots_in_use, 0)
+
+
+class FFmpegJobManagerTests(TestCase):
+
+    def test_reserve_caps_concurrency(self):
+        manager = FFmpegJobManager(max_jobs=2)
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def job():
+            with manager.reserve(1):
+                with lock:
+                    running[0] += 1
+                    peak[0] = max(peak[0], running[0])
+                time.sleep(0.02)
+                with lock:
+                    running[0] -= 1
+
+        threads = [threading.Thread(target=job) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_oversized_reservation_runs_alone(self):
+        manager = FFmpegJobManager(max_jobs=1)
+        with manager.reserve(3) as held:
+            self.assertEqual(held, 1)
+            self.assertEqual(manager._slots_in_use, 1)
+        self.assertEqual(manager._slots_in_use, 0)
+
+
+class ScriptedJobManager:
+    """Records submitted ffmpeg commands and fails those containing fail_on"""
+
+    def __init__(self, fail_on=None):
+        self.commands = []
+        self.fail_on = fail_on
+
+    def submit(self, command, name=None, timeout=None):
+        self.commands.append(command)
+        future = Future()
+        future.set_result({'name': name, 'success': self.fail_on not in command, 'wall_time': 0.0})
+        return future
+
+
+class ReferenceHLSStoreTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def package(self, fourcc, job_manager):
+        store = ReferenceHLSStore(self.tmp.name, '/media/hls/reference', job_manager)
+        with mock.patch('evalpose.pose_analyze.reference_hls.source_fourcc', return_value=fourcc):
+            return store._package_plain('reference.mp4', self.tmp.name)
+
+    def test_failed_copy_falls_back_to_reencode(self):
+        manager = ScriptedJobManager(fail_on='copy')
+        self.assertTrue(self.package('avc1', manager))
+        self.assertEqual([('copy' in c, 'libx264' in c) for c in manager.commands], [(True, False), (False, True)])
+
+    def test_hevc_is_always_reencoded(self):
+        manager = ScriptedJobManager()
+        self.assertTrue(self.package('hvc1', manager))
+        self.assertEqual(len(manager.commands), 1)
+        self.assertIn('libx264', manager.commands[0])
+        self.assertNotIn('copy', manager.commands[0])
+
+    def test_reports_failure_when_every_attempt_fails(self):
+        manager = ScriptedJobManager(fail_on='-i')
+        self.assertFalse(self.package('avc1', manager))
+        self.assertEqual(len(manager.commands), 2)
+
+
+class FrameReaderTests(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.video = write_video(os.path.join(self.tmp.name, 'frames.avi'), 20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_frames_arrive_in_order(self):
+        with FrameReader(self.video, queue_size=2, convert_rgb=True) as reader:
+            frames = list(reader)
+        self.assertEqual([frame_index(bgr) for bgr, _ in frames], list(range(20)))
+        self.assertEqual(frames[3][1].shape, frames[3][0].shape)
+
+    def test_back_pressure_and_early_close(self):
+        reader = FrameReader(self.video, queue_size=2)
+        time.sleep(0.3)
+        # 消费者未读取时解码线程阻塞在满队列上
+        self.assertTrue(reader._thread.is_alive())
+        self.assertEqual(reader._queue.qsize(), 2)
+        first = [frame_index(bgr) for _, (bgr, _) in zip(range(3), reader)]
+        reader.close()
+        self.assertEqual(first, [0, 1, 2])
+        self.assertFalse(reader._thread.is_alive())
+
+    def test_max_frames(self):
+        with FrameReader(self.video, max_frames=5) as reader:
+            self.assertEqual([frame_index(bgr) for bgr, _ in reader], [0, 1, 2, 3, 4])
+
+
+class JointAngleTests(TestCase):
+
+    def test_matches_find_angle(self):
+        seq = make_sequence(length=20, seed=1)
+        detector = PoseDetector.__new__(PoseDetector)
+        for t in range(len(seq)):
+            detector.lm_list = seq[t]['landmarks']
+            expected = [detector.find_angle(None, 11, 13, 15, draw=False),
+                        detector.find_angle(None, 11, 23, 25, draw=False)]
+            np.testing.assert_allclose(seq.angles[t], expected, rtol=1e-12, atol=0)
+
+    def test_missing_landmarks_give_zero(self):
+        angle_names, triplets = compile_key_angles({'a': [11, 13, 15], 'out_of_range': [11, 13, 40]})
+        landmarks = np.ones((2, NUM_LANDMARKS, 2), dtype=np.int32)
+        landmarks[:, 13] = [5, 9]
+        landmarks[:, 15] = [9, 1]
+        angles = compute_angles(landmarks, np.array([True, False]), triplets)
+        self.assertGreater(angles[0, 0], 0)
+        self.assertEqual(angles[1].tolist(), [0.0, 0.0])
+        self.assertEqual(angles[0, 1], 0.0)
+
+
+class NormalizationTests(TestCase):
+
+    def test_l2_bbox_normalize(self):
+        seq = make_sequence()
+        norm, norm_valid = l2_bbox_normalize(seq.landmarks, seq.valid, [11, 12, 23])
+        self.assertEqual(norm_valid.tolist(), seq.valid.tolist())
+        np.testing.assert_allclose(np.linalg.norm(norm[norm_valid].reshape(-1, 66), axis=1), 1.0)
+        self.assertFalse(norm[2].any())
+        _, norm_valid = l2_bbox_normalize(seq.landmarks, seq.valid, [11, 40])
+        self.assertFalse(norm_valid.any())
+
+    def test_minmax_normalize(self):
+        seq = make_sequence()
+        norm = minmax_normalize(seq.landmarks, seq.valid)
+        self.assertEqual(norm[seq.valid].min(axis=1).tolist(), [[0.0, 0.0]] * 5)
+        self.assertEqual(norm[seq.valid].max(axis=1).tolist(), [[1.0, 1.0]] * 5)
+
+
+class DTWEngineTests(TestCase):
+
+    def test_exact_matches_unconstrained_fastdtw(self):
+        rng = np.random.default_rng(2)
+        x, y = rng.normal(size=(30, 4)), rng.normal(size=(22, 4))
+        distance, path = dtw(x, y)
+        fast_distance, fast_path = dtw(x, y, method='fastdtw', radius=30)
+        self.assertAlmostEqual(distance, fast_distance, places=9)
+        self.assertEqual(path.tolist(), fast_path.tolist())
+        self.assertEqual(path.dtype, np.int32)
+
+    def test_band_keeps_endpoints(self):
+        rng = np.random.default_rng(3)
+        x, y = rng.normal(size=(40, 3)), rng.normal(size=(25, 3))
+        distance, path = dtw(x, y, band=2)
+        self.assertGreaterEqual(distance, dtw(x, y)[0])
+        self.assertEqual(path[0].tolist(), [0, 0])
+        self.assertEqual(path[-1].tolist(), [39, 24])
+
+    def test_band_is_stored_in_band_coordinates(self):
+        rng = np.random.default_rng(5)
+        x, y = rng.normal(size=(300, 3)), rng.normal(size=(280, 3))
+        acc, steps, lo = accumulated_cost(x, y, band=4)
+        self.assertLessEqual(acc.shape[1], 2 * 4 + 2)
+        self.assertEqual(steps.shape, acc.shape)
+        distance, path = dtw(x, y, band=4)
+        self.assertTrue(band_mask(300, 280, 4)[path[:, 0], path[:, 1]].all())
+        # 带宽覆盖整个矩阵时与不限带宽的结果相同
+        wide_distance, wide_path = dtw(x, y, band=300)
+        full_distance, full_path = dtw(x, y)
+        self.assertAlmostEqual(wide_distance, full_distance, places=9)
+        self.assertEqual(wide_path.tolist(), full_path.tolist())
+
+    def test_subsequence_skips_idle_frames(self):
+        rng = np.random.default_rng(4)
+        x = rng.normal(size=(15, 3))
+        y = np.vstack([np.full((10, 3), 5.0), x, np.full((8, 3), 5.0)])
+        distance, path = dtw(x, y, subsequence=True)
+        self.assertAlmostEqual(distance, 0.0)
+        self.assertEqual(path[0].tolist(), [0, 10])
+        self.assertEqual(path[-1].tolist(), [14, 24])
+
+
+class FrameScoreTests(TestCase):
+
+    def reference_scores(self, std, pat, path):
+        grouped = {}
+        for i, j in path:
+            coord = np.mean([np.linalg.norm(np.array(p) - np.array(q))
+                             for p, q in zip(pat[j]['norm_landmarks'], std[i]['norm_landmarks'])])
+            angle = np.mean(np.abs(np.array(list(pat[j]['angles'].values()))
+                                   - np.array(list(std[i]['angles'].values()))))
+            grouped.setdefault(j, []).append(coord + angle / 180.0)
+        scores = [(j, np.mean(values)) for j, values in grouped.items()]
+        low, high = min(s for _, s in scores), max(s for _, s in scores)
+        return [(j, 100 * (high - s) / (high - low)) for j, s in scores]
+
+    def test_matches_per_pair_loop(self):
+        std, pat = make_sequence(12, seed=4), make_sequence(9, seed=5)
+        std.norm_valid[:] = True
+        pat.norm_valid[:] = True
+        path = [(0, 0)] + [(i, 1) for i in range(1, 10)] + [(10, 2), (11, 3)] + [(11, j) for j in range(4, 9)]
+        scores = ActionComparator(std, pat)._compare_frames_with_multiple_matches(path)
+        self.assertEqual(scores, self.reference_scores(std.to_frames(), pat.to_frames(), path))
+
+    def test_reference_features_match_refit(self):
+        std, pat = make_sequence(12, seed=6), make_sequence(9, seed=7)
+        std.norm_valid[:] = True
+        pat.norm_valid[:] = True
+        features = ActionComparator.fit_reference_features(std)
+        fresh = ActionComparator(std, pat).compare_sequences()
+        cached = ActionComparator(std, pat, reference_features=features).compare_sequences()
+        self.assertEqual(cached['dtw_distance'], fresh['dtw_distance'])
+        self.assertEqual(cached['frame_scores'], fresh['frame_scores'])
+
+    def test_trimmed_path_is_cached_for_the_compared_path(self):
+        std, pat = make_sequence(12, seed=6), make_sequence(9, seed=7)
+        std.norm_valid[:] = True
+        pat.norm_valid[:] = True
+        comparator = ActionComparator(std, pat)
+        result = offset_patient_indices(comparator.compare_sequences(), 4)
+        expected = comparator.trim_alignment(result['alignment_path'])
+        self.assertEqual(comparator.get_trimmed_path(result['alignment_path'], segment=0), expected)
+        self.assertIsNotNone(comparator._trim_ranges[0])
+        # Paths the comparator did not produce are trimmed directly
+        other = [(0, 0), (0, 1), (1, 2), (2, 2)]
+        self.assertEqual(comparator.get_trimmed_path(other), comparator.trim_alignment(other))
+
+
+class IdleTrimTests(TestCase):
+
+    def test_detects_idle_lead_in_and_out(self):
+        moving = make_sequence(40, seed=8)
+        moving.norm_valid[:] = True
+        still = moving[:1]
+        sequence = PoseSequence.concatenate([still] * 30 + [moving] + [moving[-1:]] * 25)
+        start, end = detect_active_range(sequence)
+        self.assertTrue(25 <= start <= 30)
+        self.assertTrue(69 <= end <= 74)
+        self.assertEqual(detect_active_range(moving), (0, 39))
+
+    def test_offset_maps_back_to_original_frames(self):
+        result = {'alignment_path': [(0, 0), (1, 1)], 'frame_scores': [(0, 100.0), (1, 0.0)],
+                  'matched_range': (0, 1)}
+        offset_patient_indices(result, 12)
+        self.assertEqual(result['alignment_path'], [(0, 12), (1, 13)])
+        self.assertEqual(result['frame_scores'], [(12, 100.0), (13, 0.0)])
+        self.assertEqual(result['matched_range'], (12, 13))
+
+
+def make_reps(depths, rep_frames=30, seed=0):
+    """Elbow-like angle curve that dips once per rep, starting and ending at rest (160°)"""
+    t = np.linspace(0, 1, rep_frames, endpoint=False)
+    curve = np.concatenate([160 - depth * np.sin(np.pi * t) ** 2 for depth in depths])
+    sequence = make_sequence(len(curve), seed=seed)
+    sequence.valid[:] = True
+    sequence.norm_valid[:] = True
+    sequence.angles = np.stack([curve, np.full(len(curve), 170.0)], axis=1)
+    return sequence
+
+
+class RepetitionTests(TestCase):
+
+    def test_segments_each_rep(self):
+        reps = segment_repetitions(make_reps([80, 90, 70]))
+        self.assertEqual(len(reps), 3)
+        self.assertEqual(reps[0][0], 0)
+        self.assertEqual(reps[-1][1], 89)
+        for (_, end), (start, _) in zip(reps[:-1], reps[1:]):
+            self.assertEqual(start, end + 1)
+            self.assertLessEqual(min(start % 30, 30 - start % 30), 3)
+
+    def test_single_movement_is_not_split(self):
+        self.assertEqual(segment_repetitions(make_reps([80])), [(0, 29)])
+
+    def test_per_rep_alignment(self):
+        std, pat = make_reps([80], seed=1), make_reps([80, 80], seed=2)
+        result = ActionComparator(std, pat).compare_repetitions()
+        self.assertEqual([rep['standard_range'] for rep in result['repetitions']], [(0, 29), (0, 29)])
+        self.assertEqual(result['repetitions'][1]['patient_range'][1], 59)
+        self.assertEqual(sorted(idx for idx, _ in result['frame_scores']), list(range(60)))
+
+    def test_extra_patient_reps_keep_timing_metrics(self):
+        # One standard rep reused for both patient reps: the joined path jumps back to standard frame 0
+        std, pat = make_reps([80], seed=1), make_reps([80, 80], seed=2)
+        comparator = ActionComparator(std, pat)
+        result = offset_patient_indices(comparator.compare_repetitions(), 5)
+        metrics = comparator.alignment_metrics(result)
+        self.assertEqual([path[0][1] for path in result['segment_paths']], [5, 35])
+        self.assertAlmostEqual(metrics['alignment_angle']['angle_score'], 100.0)
+        self.assertAlmostEqual(metrics['time_variance']['time_variance_score'], 100.0)
+        self.assertAlmostEqual(metrics['alignment_ratio'], 1.0)
+        self.assertLess(comparator.compute_alignment_angle_score(result['alignment_path'])['angle_score'], 90)
+
+    def test_subsequence_mode_applies_per_rep(self):
+        std, pat = make_reps([80], seed=1), make_reps([80, 80], seed=2)
+        result = ActionComparator(std, pat, subsequence=True).compare_repetitions()
+        for rep, path in zip(result['repetitions'], result['segment_paths']):
+            (p0, p1), (s0, s1) = rep['patient_range'], rep['standard_range']
+            self.assertEqual((path[0][0], path[-1][0]), (s0, s1))
+            self.assertTrue(all(p0 <= j <= p1 for _, j in path))
+
+
+class ReferenceRankingTests(TestCase):
+
+    def test_lower_bound_never_exceeds_dtw(self):
+        rng = np.random.default_rng(11)
+        for n, m in ((20, 30), (30, 20), (25, 25)):
+            x, y = rng.normal(size=(n, 4)), rng.normal(size=(m, 4))
+            self.assertLessEqual(lb_keogh(x, y), dtw(x, y)[0] + 1e-9)
+            self.assertLessEqual(lb_keogh(x, y, band=3), dtw(x, y, band=3)[0] + 1e-9)
+            self.assertLessEqual(lb_keogh(x, y, subsequence=True), dtw(x, y, subsequence=True)[0] + 1e-9)
+
+    def test_pruned_ranking_keeps_best_match(self):
+        pat = make_reps([80, 80], seed=3)
+        candidates = []
+        for key, depth in (('deep', 80), ('shallow', 20), ('medium', 50)):
+            std = make_reps([depth], seed=4)
+            candidates.append({'key': key, 'std_sequence': std, 'pat_sequence': pat,
+                               'reference_features': ActionComparator.fit_reference_features(std)})
+        ranked, pruned = rank_references(candidates)
+        self.assertEqual(ranked[0]['key'], 'deep')
+        self.assertEqual(len(ranked) + len(pruned), 3)
+        distances = [outcome['normalized_distance'] for outcome in ranked]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_dissimilar_reference_is_pruned(self):
+        pat = make_reps([80, 80], seed=3)
+        candidates = []
+        for key, depth in (('deep', 80), ('still', 0)):
+            std = make_reps([depth, depth], seed=4)
+            candidates.append({'key': key, 'std_sequence': std, 'pat_sequence': pat,
+                               'reference_features': ActionComparator.fit_reference_features(std)})
+        for band in (None, 5):
+            ranked, pruned = rank_references(candidates, dtw_band=band)
+            self.assertEqual([outcome['key'] for outcome in ranked], ['deep'])
+            self.assertEqual(pruned, ['still'])
+            skipped = _score_reference(dict(candidates[1], dtw_method='exact', dtw_band=band, subsequence=False))
+            self.assertGreaterEqual(skipped['normalized_distance'], ranked[0]['normalized_distance'])
+
+
+def make_exercise(triplet, depths, rep_frames=30, seed=0):
+    """Fixed pose in which only the joint triplet's angle bends once per rep (rest 160°)"""
+    t = np.linspace(0, 1, rep_frames, endpoint=False)
+    curve = np.radians(np.concatenate([160 - depth * np.sin(np.pi * t) ** 2 for depth in depths]))
+    rng = np.random.default_rng(seed)
+    landmarks = np.repeat(rng.integers(200, 520, size=(1, NUM_LANDMARKS, 2)), len(curve), axis=0)
+    p1, p2, p3 = triplet
+    arm = landmarks[0, p1] - landmarks[0, p2]
+    base = np.arctan2(arm[1], arm[0])
+    landmarks[:, p3, 0] = np.round(landmarks[0, p2, 0] + 100 * np.cos(base + curve))
+    landmarks[:, p3, 1] = np.round(landmarks[0, p2, 1] + 100 * np.sin(base + curve))
+    valid = np.ones(len(curve), dtype=bool)
+    norm, norm_valid = l2_bbox_normalize(landmarks, valid, [11, 12, 23])
+    return PoseSequence(landmarks, valid, np.zeros((len(curve), 0)), [], norm, norm_valid)
+
+
+class ExerciseIndexTests(TestCase):
+
+    def test_recognizes_exercise_from_memory_mapped_index(self):
+        library = [('elbow', [11, 13, 15]), ('knee', [23, 25, 27]), ('hip', [11, 23, 25])]
+        entries = [(key, f'{key}.mp4', make_exercise(triplet, [80])) for key, triplet in library]
+        with tempfile.TemporaryDirectory() as directory:
+            ExerciseIndex.build(entries).save(directory)
+            index = ExerciseIndex.load(directory)
+            self.assertIsInstance(index.embeddings, np.memmap)
+            matches = index.query(make_exercise([23, 25, 27], [70, 75, 70], rep_frames=40, seed=5), top_k=2)
+        self.assertEqual(matches[0][0], 'knee')
+        self.assertEqual(len(matches), 2)
+        self.assertLess(matches[0][1], matches[1][1])
+
+
+class OnlineAlignerTests(TestCase):
+
+    class Config:
+        KEY_ANGLES = {'left_elbow': [11, 13, 15], 'left_hip': [11, 23, 25]}
+        NORMALIZATION_JOINTS = [11, 12, 23]
+
+    def extracted_sequence(self, length, seed):
+        rng = np.random.default_rng(seed)
+        landmarks = rng.integers(0, 720, size=(length, NUM_LANDMARKS, 2))
+        valid = np.ones(length, dtype=bool)
+        angle_names, triplets = compile_key_angles(self.Config.KEY_ANGLES)
+        norm, norm_valid = l2_bbox_normalize(landmarks, valid, self.Config.NORMALIZATION_JOINTS)
+        return PoseSequence(landmarks, valid, compute_angles(landmarks, valid, triplets), angle_names, norm, norm_valid)
+
+    def test_full_window_matches_batch_distance(self):
+        std, pat = self.extracted_sequence(25, seed=9), self.extracted_sequence(18, seed=10)
+        aligner = OnlineAligner(std, self.Config, window=len(std))
+        aligner.extend(pat)
+        comparator = ActionComparator(std, pat)
+        self.assertAlmostEqual(aligner.distance, dtw(*comparator.get_scaled_features())[0], places=6)
 
-# Create your tests here.
+    def test_tracks_slowed_movement(self):
+        std = self.extracted_sequence(40, seed=11)
+        slowed = PoseSequence.concatenate([std[t:t + 1] for t in np.repeat(np.arange(40), 2)])
+        results = OnlineAligner(std, self.Config, window=5).extend(slowed)
+        self.assertEqual([r['std_index'] for r in results], (np.arange(80) // 2).tolist())
+        self.assertEqual(results[-1]['progress'], 1.0)
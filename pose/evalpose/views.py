@@ -14,14 +14,34 @@ from pathlib import Path
 from video_manager.models import VideoAsset
 from .exceptions import ApiErrorHandler
 from .service_factory import get_video_processing_service
+from .modern_pose_analyzer import ModernPoseAnalyzer
 from django.utils.deprecation import RemovedInNextVersionWarning
 import warnings
 import re
 from .exceptions import ApiErrorHandler, InvalidNumericIdFormatError
 from .pose_analyze.config_service import get_video_config, create_dynamic_config_from_dict
+from contextlib import contextmanager
+import os
+import tempfile
 
 logger = logging.getLogger(__name__)
 
+
+@contextmanager
+def uploaded_video_file(base64_data):
+    """
+    Decode a base64 exercise video into a temporary .mp4 and yield its path; the file is removed on exit.
+    Used by query endpoints (ranking, recognition) that do not create an EvalSession.
+    """
+    content = VideoUploadSerializer().base64_to_file(base64_data, 'exercise.mp4')
+    handle, path = tempfile.mkstemp(suffix='.mp4')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content.read())
+        yield path
+    finally:
+        os.remove(path)
+
 # Create your views here.
 
 class VideoUploadView(APIView):
@@ -54,6 +74,9 @@ class VideoUploadView(APIView):
                         'overlap_video_hls': openapi.Schema(type=openapi.TYPE_STRING),
                         'exercise_worst_frames': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)),
                         'frame_scores': openapi.Schema(type=openapi.TYPE_OBJECT),
+                        'matched_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                        'active_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                        'repetitions': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
                         'processing_status': openapi.Schema(type=openapi.TYPE_OBJECT),
                     }
                 )
@@ -119,6 +142,9 @@ class VideoUploadView(APIView):
                         'overlap_hls': process_result['overlap_hls']
                     },
                     'frame_scores': process_result['frame_scores'],
+                    'matched_range': process_result.get('matched_range'),
+                    'active_range': process_result.get('active_range'),
+                    'repetitions': process_result.get('repetitions', []),
                     'advanced_metrics': process_result.get('advanced_metrics', {}),
                     'action_stages': process_result.get('action_stages', []),
                     'lowest_score_frames': process_result.get('lowest_score_frames', []),
@@ -202,10 +228,14 @@ class VideoUploadWithReferenceView(APIView):
                     properties={
                         'session_id': openapi.Schema(type=openapi.TYPE_STRING),
                         'standard_video_hls': openapi.Schema(type=openapi.TYPE_STRING),
+                        'standard_video_plain_hls': openapi.Schema(type=openapi.TYPE_STRING, description="Shared plain rendition of the standard video (null when not available)"),
                         'exercise_video_hls': openapi.Schema(type=openapi.TYPE_STRING),
                         'overlap_video_hls': openapi.Schema(type=openapi.TYPE_STRING),
                         'exercise_worst_frames': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)),
                         'frame_scores': openapi.Schema(type=openapi.TYPE_OBJECT),
+                        'matched_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                        'active_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                        'repetitions': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
                         'processing_status': openapi.Schema(type=openapi.TYPE_OBJECT),
                     }
                 )
@@ -295,13 +325,18 @@ class VideoUploadWithReferenceView(APIView):
             # Return session ID and video URLs
             response_data = {
                 'session_id': session.session_id,
-                'standard_video_hls': f'/media/hls/{session.session_id}/standard.m3u8',
+                # Standard renditions are shared across sessions when available
+                'standard_video_hls': process_result.get('standard_hls_url') or f'/media/hls/{session.session_id}/standard.m3u8',
+                'standard_video_plain_hls': process_result.get('standard_plain_hls_url'),
                 'exercise_video_hls': f'/media/hls/{session.session_id}/exercise.m3u8',
                 'overlap_video_hls': f'/media/hls/{session.session_id}/overlap.m3u8',
                 'exercise_worst_frames': [f'/media/hls/{session.session_id}/patient_frame_1.jpg',
                                           f'/media/hls/{session.session_id}/patient_frame_2.jpg',
                                           f'/media/hls/{session.session_id}/patient_frame_3.jpg'],
                 'frame_scores': process_result['frame_scores'],
+                'matched_range': process_result.get('matched_range'),
+                'active_range': process_result.get('active_range'),
+                'repetitions': process_result.get('repetitions', []),
                 'standard_video_info': {
                     'numeric_id': standard_video.numeric_id,
                     'tag_string': standard_video.tag_string,
@@ -339,6 +374,150 @@ class VideoUploadWithReferenceView(APIView):
         except Exception as e:
             return ApiErrorHandler.handle_exception(e, session)
     
+class ReferenceRankingView(APIView):
+    @swagger_auto_schema(
+        operation_description="Score an exercise video against every standard video under a tag prefix and rank them",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['exercise', 'tag_string'],
+            properties={
+                'exercise': openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description='Base64 encoded exercise video'
+                ),
+                'tag_string': openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description='Tag string prefix selecting the standard videos to compare against'
+                ),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description="Standard videos ranked by similarity, best match first",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'tag_string': openapi.Schema(type=openapi.TYPE_STRING),
+                        'ranking': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                        'pruned': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)),
+                        'uncached': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+                                                   description='Standard videos skipped because their pose cache has not been built'),
+                        'active_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    }
+                )
+            ),
+            400: "Invalid input or no standard video under the tag prefix",
+            503: "None of the standard videos has been prepared (import_videos --build-reference-cache)",
+            500: "Server error during processing"
+        }
+    )
+    def post(self, request):
+        logger.info(f"收到多参考视频排名请求: {request.META.get('HTTP_ORIGIN')}")
+
+        if 'exercise' not in request.data:
+            return Response({'error': 'Missing exercise video'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if 'tag_string' not in request.data:
+            return Response({'error': 'Missing tag_string'}, status=status.HTTP_400_BAD_REQUEST)
+
+        tag_string = request.data['tag_string']
+
+        # Resolve the candidate standard videos the same way VideoByTagsView does
+        references = []
+        for asset in VideoAsset.objects.filter(tag_string__startswith=tag_string).order_by('numeric_id'):
+            video_path = Path(settings.BASE_DIR) / asset.original_mp4_path
+            if not video_path.exists():
+                logger.warning(f"标准视频文件不存在: {video_path}")
+                continue
+            references.append((asset.numeric_id, str(video_path)))
+
+        if not references:
+            return Response({'error': f'No standard video found under tag prefix {tag_string}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Ranking is a query, not an evaluation: no EvalSession is stored, so it never
+        # shows up as a completed session without scores in the session/metrics endpoints
+        try:
+            with uploaded_video_file(request.data['exercise']) as exercise_path:
+                ranking_result = ModernPoseAnalyzer().rank_references(exercise_path, references)
+
+            return JsonResponse({
+                'tag_string': tag_string,
+                'ranking': ranking_result['ranking'],
+                'pruned': ranking_result['pruned'],
+                'uncached': ranking_result['uncached'],
+                'active_range': ranking_result['active_range'],
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            return ApiErrorHandler.handle_exception(e)
+
+
+class ExerciseRecognitionView(APIView):
+    @swagger_auto_schema(
+        operation_description="Identify the closest standard exercise for an exercise video without a standard_numeric_id",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['exercise'],
+            properties={
+                'exercise': openapi.Schema(
+                    type=openapi.TYPE_STRING,
+                    description='Base64 encoded exercise video'
+                ),
+                'top_k': openapi.Schema(
+                    type=openapi.TYPE_INTEGER,
+                    description='Number of index neighbours to re-rank with full DTW'
+                ),
+            }
+        ),
+        responses={
+            200: openapi.Response(
+                description="Closest standard videos, best match first",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'candidates': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                        'ranking': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                        'pruned': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING)),
+                        'uncached': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_STRING),
+                                                   description='Standard videos skipped because their pose cache has not been built'),
+                        'active_range': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    }
+                )
+            ),
+            400: "Invalid input",
+            503: "Exercise index or reference pose cache has not been built",
+            500: "Server error during processing"
+        }
+    )
+    def post(self, request):
+        logger.info(f"收到动作识别请求: {request.META.get('HTTP_ORIGIN')}")
+
+        if 'exercise' not in request.data:
+            return Response({'error': 'Missing exercise video'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            top_k = int(request.data.get('top_k') or settings.POSE_RECOGNITION_TOP_K)
+        except (TypeError, ValueError):
+            return Response({'error': 'top_k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Recognition is a query like ranking: no EvalSession is stored
+        try:
+            with uploaded_video_file(request.data['exercise']) as exercise_path:
+                recognition = ModernPoseAnalyzer().recognize_exercise(exercise_path, top_k=max(top_k, 1))
+
+            return JsonResponse({
+                'candidates': recognition['candidates'],
+                'ranking': recognition['ranking'],
+                'pruned': recognition['pruned'],
+                'uncached': recognition['uncached'],
+                'active_range': recognition['active_range'],
+            }, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            return ApiErrorHandler.handle_exception(e)
+
+
 class TestUploadView(APIView):
     @swagger_auto_schema(
         operation_description="Test endpoint for video upload",
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -136,6 +138,47 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 标准视频姿态序列缓存目录（不对外提供访问）
+POSE_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'pose_sequences')
+
+# 姿态提取并行进程数（按帧区间分段提取），默认 1 即串行。
+# 每段重新开始 MediaPipe 跟踪，段边界附近的关键点与串行提取略有差异，得分会随进程数变化，需要时再显式开启
+POSE_EXTRACTION_WORKERS = int(os.environ.get('POSE_EXTRACTION_WORKERS', 1))
+# 解码线程与推理循环之间的帧队列深度
+POSE_DECODE_QUEUE_SIZE = int(os.environ.get('POSE_DECODE_QUEUE_SIZE', 32))
+# 进程内 MediaPipe Pose 实例池中每种检测参数保留的空闲实例数
+POSE_POOL_SIZE = int(os.environ.get('POSE_POOL_SIZE', min(os.cpu_count() or 1, 8)))
+# 服务进程启动时在后台为默认检测参数和可见性预检各预热 POSE_POOL_SIZE 个实例（仅 WSGI 服务进程，管理命令不预热）
+POSE_POOL_WARMUP = os.environ.get('POSE_POOL_WARMUP', 'True').lower() in ('1', 'true', 'yes')
+# ROI 模式：只对人体所在区域（缩小到 POSE_ROI_MAX_SIDE 以内）做姿态推理，适合高分辨率上传视频
+POSE_ROI_MODE = os.environ.get('POSE_ROI_MODE', 'False').lower() in ('1', 'true', 'yes')
+POSE_ROI_MAX_SIDE = int(os.environ.get('POSE_ROI_MAX_SIDE', 640))
+# 全身可见性预检：完整提取前抽样检查上传视频中所需关节是否可见
+POSE_VISIBILITY_PROBE = os.environ.get('POSE_VISIBILITY_PROBE', 'True').lower() in ('1', 'true', 'yes')
+POSE_VISIBILITY_PROBE_SAMPLES = int(os.environ.get('POSE_VISIBILITY_PROBE_SAMPLES', 8))
+# DTW 引擎：exact（精确 DTW）或 fastdtw（与历史得分对比）；带宽为 Sakoe-Chiba 约束帧数，留空表示不限制
+POSE_DTW_METHOD = os.environ.get('POSE_DTW_METHOD', 'exact')
+POSE_DTW_BAND = int(os.environ['POSE_DTW_BAND']) if os.environ.get('POSE_DTW_BAND') else None
+# 子序列 DTW：标准动作只与患者视频中最匹配的一段对齐，忽略首尾空闲帧（不能与 POSE_DTW_BAND 同时使用）
+POSE_DTW_SUBSEQUENCE = os.environ.get('POSE_DTW_SUBSEQUENCE', 'False').lower() in ('1', 'true', 'yes')
+if POSE_DTW_SUBSEQUENCE and (POSE_DTW_BAND is not None or POSE_DTW_METHOD != 'exact'):
+    # 启动时拒绝，而不是让每次上传都在对齐时报错
+    raise ImproperlyConfigured("POSE_DTW_SUBSEQUENCE 只能与 POSE_DTW_METHOD=exact 一起使用，且不能设置 POSE_DTW_BAND")
+# 对齐前裁剪患者视频首尾的静止段（基于运动能量），frame_scores 仍使用原始帧索引
+POSE_IDLE_TRIM = os.environ.get('POSE_IDLE_TRIM', 'True').lower() in ('1', 'true', 'yes')
+# 多参考视频排名时并行比较的进程数，1 表示在当前进程内串行比较
+POSE_RANKING_WORKERS = int(os.environ.get('POSE_RANKING_WORKERS', min(os.cpu_count() or 1, 4)))
+# 动作识别索引目录（import_videos --build-index 生成），以及识别时用完整 DTW 重排的候选数
+POSE_INDEX_DIR = os.path.join(BASE_DIR, 'cache', 'exercise_index')
+POSE_RECOGNITION_TOP_K = int(os.environ.get('POSE_RECOGNITION_TOP_K', 3))
+# 渲染的帧直接通过管道交给 ffmpeg 切片为 HLS，不再先写中间 mp4 再转换（找不到 ffmpeg 时自动回退）
+POSE_HLS_DIRECT = os.environ.get('POSE_HLS_DIRECT', 'True').lower() in ('1', 'true', 'yes')
+# FFmpeg 转换任务的全局并发上限（默认等于 CPU 核数）和单任务超时（秒）
+POSE_FFMPEG_MAX_JOBS = int(os.environ.get('POSE_FFMPEG_MAX_JOBS', os.cpu_count() or 1))
+POSE_FFMPEG_TIMEOUT = int(os.environ.get('POSE_FFMPEG_TIMEOUT', 300))
+# 标准视频的 HLS（原视频与骨架标注两个版本）按视频/配置只生成一次，保存在 MEDIA_ROOT/hls/reference 下供各会话引用
+POSE_SHARED_REFERENCE_HLS = os.environ.get('POSE_SHARED_REFERENCE_HLS', 'True').lower() in ('1', 'true', 'yes')
+
 # DRF 配置
 REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
@@ -210,6 +253,7 @@ LOGGING = {
 # 确保媒体文件目录存在
 os.makedirs(MEDIA_ROOT, exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'hls'), exist_ok=True)
+os.makedirs(POSE_CACHE_DIR, exist_ok=True)
 # os.makedirs(FILE_UPLOAD_TEMP_DIR, exist_ok=True)
 
 # WebRTC 配置
@@ -29,6 +29,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('upload-videos/', VideoUploadView.as_view(), name='upload_videos'),
     path('upload-video/', VideoUploadWithReferenceView.as_view(), name='upload_video_with_reference'),
+    path('rank-references/', views.ReferenceRankingView.as_view(), name='rank_references'),
+    path('recognize-exercise/', views.ExerciseRecognitionView.as_view(), name='recognize_exercise'),
     # 添加专门的 HLS 文件服务路由
     path('test-upload/', TestUploadView.as_view(), name='test_upload'),
     path('frame-scores/<str:session_id>/', DeprecatedFrameScoresView.as_view(), name='frame_scores'),
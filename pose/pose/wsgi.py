@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pose.settings")
 
 application = get_wsgi_application()
+
+# 服务进程启动后在后台预热 MediaPipe Pose 实例池（管理命令不加载本模块）
+from django.apps import apps  # noqa: E402
+
+apps.get_app_config("evalpose").start_pose_pool()
@@ -16,6 +16,10 @@ class Command(BaseCommand):
                            help='Path to the explanation videos directory')
         parser.add_argument('--clear', action='store_true',
                            help='Clear existing database entries')
+        parser.add_argument('--build-reference-cache', action='store_true',
+                           help='Extract pose sequences and scaler features for configured standard videos')
+        parser.add_argument('--build-index', action='store_true',
+                           help='Build the exercise recognition index over all standard videos')
 
     def handle(self, *args, **options):
         if options['clear']:
@@ -30,6 +34,12 @@ class Command(BaseCommand):
         
         # Then process explain videos
         self.process_explain_videos(explain_path)
+
+        if options['build_reference_cache']:
+            self.build_reference_cache()
+
+        if options['build_index']:
+            self.build_exercise_index()
         
         self.stdout.write(self.style.SUCCESS('Successfully imported videos'))
 
@@ -138,6 +148,47 @@ class Command(BaseCommand):
                     
         self.stdout.write(f"Total videos imported: {count}")
 
+    def build_reference_cache(self):
+        """Precompute the cached pose sequence and scaler features of every standard video with a config."""
+        from evalpose.models import VideoConfig
+        from evalpose.modern_pose_analyzer import ModernPoseAnalyzer
+
+        configured = set(VideoConfig.objects.values_list('numeric_id', flat=True))
+        count = 0
+        for asset in VideoAsset.objects.filter(numeric_id__in=configured):
+            video_path = Path(settings.BASE_DIR) / asset.original_mp4_path
+            try:
+                sequence, _ = ModernPoseAnalyzer(numeric_id=asset.numeric_id).prepare_reference(str(video_path))
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"Failed to build reference cache for {asset.numeric_id}: {str(e)}"))
+                continue
+            count += 1
+            self.stdout.write(f"Cached reference: {asset.numeric_id} ({len(sequence)} frames)")
+
+        self.stdout.write(f"Total reference caches built: {count}")
+
+    def build_exercise_index(self):
+        """Embed every standard video and write the memory-mapped exercise recognition index."""
+        from evalpose.modern_pose_analyzer import ModernPoseAnalyzer
+        from evalpose.pose_analyze.exercise_index import ExerciseIndex
+
+        entries = []
+        for asset in VideoAsset.objects.all().order_by('numeric_id'):
+            video_path = Path(settings.BASE_DIR) / asset.original_mp4_path
+            try:
+                # Landmarks do not depend on the config; reuse the cached reference sequence when there is one
+                sequence = ModernPoseAnalyzer(numeric_id=asset.numeric_id).process_reference_video(str(video_path))
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"Failed to index {asset.numeric_id}: {str(e)}"))
+                continue
+            entries.append((asset.numeric_id, str(video_path), sequence))
+            self.stdout.write(f"Indexed: {asset.numeric_id} ({len(sequence)} frames)")
+
+        index = ExerciseIndex.build(entries)
+        index.save(settings.POSE_INDEX_DIR)
+        self.stdout.write(f"Exercise index written to {settings.POSE_INDEX_DIR}: "
+                          f"{len(index)} references, {len(index.embeddings)} windows")
+
     def process_explain_videos(self, root_path):
         """Record paths for explanation videos, covers, SRTs, and descriptions in the database."""
         self.stdout.write(f"Recording explain video paths from: {root_path}")